@@ -1,5 +1,6 @@
 from flask import Flask
 from app.config import load_configurations, configure_logging
+from app.utils.worker_pool import init_worker_pool
 from .views import webhook_blueprint
 
 
@@ -13,4 +14,7 @@ def create_app():
     # Import and register blueprints, if any
     app.register_blueprint(webhook_blueprint)
 
+    # Start the background webhook workers, if enabled
+    init_worker_pool(app)
+
     return app
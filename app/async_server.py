@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import time
+
+from aiohttp import web
+from flask import Flask
+
+from app.config import configure_logging, load_configurations
+from app.decorators.security import bearer_token_valid, validate_signature
+from app.utils.metrics import METRICS
+from app.utils.payload_templates import TEMPLATES
+from app.utils.whatsapp_utils import (
+    forget_message,
+    get_session_manager,
+    get_text_messages_data,
+    handle_webhook_payload,
+    plan_reply,
+    send_message,
+)
+
+# The Flask app is only used as a configuration/extension holder so the
+# webhook helpers that rely on `current_app` work unchanged.
+FLASK_APP = web.AppKey("flask_app", Flask)
+TASKS = web.AppKey("tasks", set)
+CONVERSATIONS = web.AppKey("conversations", dict)
+
+
+async def aprocess_whatsapp_message(app, event):
+    """
+    Reply to a single inbound WhatsApp message without blocking the event loop.
+
+    Replies are queued on the same OutboundDispatcher as the sync server, so
+    they get its rate limit, retries, per-recipient ordering and dead letters.
+    Queuing only appends to the recipient's lane and never blocks the loop.
+    """
+    logging.info(f"Processing message {event.message_id} from {event.wa_id}")
+    started_at = time.monotonic()
+    with app[FLASK_APP].app_context():
+        # Turns for one wa_id are already serialized by _run_message_task, so
+        # the session lock is always free here and never blocks the loop.
+        with get_session_manager().session(event.wa_id) as bot:
+            response_messages, llm_input = plan_reply(event, bot)
+            if llm_input is not None and app[FLASK_APP].config["LLM_STREAMING"]:
+                for msg in response_messages:
+                    send_message(msg, event.wa_id)
+                response_messages = []
+                await astream_reply(app, event, bot, llm_input, started_at)
+            elif llm_input is not None:
+                response_text = await bot.arespond_to_user(llm_input)
+                METRICS.observe(
+                    "llm.time_to_first_message_seconds", time.monotonic() - started_at
+                )
+                response_messages.extend(
+                    get_text_messages_data(event.wa_id, response_text)
+                )
+            for msg in response_messages:
+                send_message(msg, event.wa_id)
+
+
+async def astream_reply(app, event, bot, llm_input, started_at):
+    """
+    Async counterpart of whatsapp_utils.stream_reply.
+    """
+    if event.message_id is not None:
+        send_message(
+            TEMPLATES["typing_indicator"].fill(message_id=event.message_id),
+            event.wa_id,
+        )
+
+    first_message = True
+
+    async def on_text(text):
+        nonlocal first_message
+        if first_message:
+            METRICS.observe(
+                "llm.time_to_first_message_seconds", time.monotonic() - started_at
+            )
+            first_message = False
+        for msg in get_text_messages_data(event.wa_id, text):
+            send_message(msg, event.wa_id)
+
+    await bot.astream_respond_to_user(llm_input, on_text)
+
+
+async def _run_message_task(app, event):
+    # Messages from the same wa_id are answered one after another so replies
+    # stay in order; different conversations run concurrently.
+    conversations = app[CONVERSATIONS]
+    entry = conversations.get(event.wa_id)
+    if entry is None:
+        entry = conversations[event.wa_id] = [asyncio.Lock(), 0]
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            await aprocess_whatsapp_message(app, event)
+    except Exception:
+        METRICS.incr("webhook_async.failed")
+        logging.exception("Async webhook job failed")
+        with app[FLASK_APP].app_context():
+            forget_message(event)
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            del conversations[event.wa_id]
+
+
+async def webhook_get(request):
+    config = request.app[FLASK_APP].config
+    mode = request.query.get("hub.mode")
+    token = request.query.get("hub.verify_token")
+    challenge = request.query.get("hub.challenge")
+    if mode and token:
+        if mode == "subscribe" and token == config["VERIFY_TOKEN"]:
+            logging.info("WEBHOOK_VERIFIED")
+            return web.Response(text=challenge or "")
+        logging.info("VERIFICATION_FAILED")
+        return web.json_response(
+            {"status": "error", "message": "Verification failed"}, status=403
+        )
+    logging.info("MISSING_PARAMETER")
+    return web.json_response(
+        {"status": "error", "message": "Missing parameters"}, status=400
+    )
+
+
+async def webhook_post(request):
+    app = request.app
+    raw_body = await request.read()
+    signature = request.headers.get("X-Hub-Signature-256", "")[7:]
+
+    def dispatch(event):
+        # Acknowledge right away; the reply is produced on its own task. Past
+        # the in-flight limit the webhook answers 503 and Meta redelivers later
+        if len(app[TASKS]) >= app[FLASK_APP].config["ASYNC_MAX_INFLIGHT"]:
+            METRICS.incr("webhook_async.rejected")
+            logging.warning("Too many messages in flight, rejecting webhook")
+            return False
+        task = asyncio.create_task(_run_message_task(app, event))
+        app[TASKS].add(task)
+        task.add_done_callback(app[TASKS].discard)
+        return True
+
+    with app[FLASK_APP].app_context():
+        if not validate_signature(raw_body, signature):
+            logging.info("Signature verification failed!")
+            return web.json_response(
+                {"status": "error", "message": "Invalid signature"}, status=403
+            )
+        response, status_code = handle_webhook_payload(raw_body, dispatch)
+    return web.json_response(response, status=status_code)
+
+
+async def metrics(request):
+    token = request.app[FLASK_APP].config["VERIFY_TOKEN"]
+    if not bearer_token_valid(request.headers.get("Authorization"), token):
+        logging.info("Metrics request without a valid token")
+        return web.json_response(
+            {"status": "error", "message": "Unauthorized"}, status=401
+        )
+    return web.json_response(METRICS.snapshot())
+
+
+async def _drain_ctx(app):
+    yield
+    # Finish the replies in progress, then wait for them to be delivered
+    if app[TASKS]:
+        await asyncio.gather(*app[TASKS], return_exceptions=True)
+    dispatcher = app[FLASK_APP].extensions.get("outbound_dispatcher")
+    if dispatcher is not None:
+        await asyncio.get_running_loop().run_in_executor(None, dispatcher.join)
+
+
+def create_async_app():
+    """
+    Create the aiohttp application serving the same /webhook contract as
+    webhook_blueprint, with non-blocking LLM calls. Replies are sent by the
+    same outbound dispatcher as the Flask server.
+    """
+    flask_app = Flask(__name__)
+    load_configurations(flask_app)
+    configure_logging()
+
+    app = web.Application()
+    app[FLASK_APP] = flask_app
+    app[TASKS] = set()
+    app[CONVERSATIONS] = {}
+    METRICS.register_gauge("webhook_async.inflight", lambda: len(app[TASKS]))
+    app.cleanup_ctx.append(_drain_ctx)
+
+    app.router.add_get("/webhook", webhook_get)
+    app.router.add_post("/webhook", webhook_post)
+    app.router.add_get("/metrics", metrics)
+    return app
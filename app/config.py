@@ -14,6 +14,99 @@ def load_configurations(app):
     app.config["VERSION"] = os.getenv("VERSION")
     app.config["PHONE_NUMBER_ID"] = os.getenv("PHONE_NUMBER_ID")
     app.config["VERIFY_TOKEN"] = os.getenv("VERIFY_TOKEN")
+    app.config["OPENAI_MODEL"] = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo-0125")
+    # Model tiers: simple turns go to MODEL_FAST, turns the MODEL_ROUTING_POLICY
+    # scores as complex to MODEL_LARGE. The policy is "heuristic", a tier name
+    # to always use it, or "package.module:factory". Costs are USD per million
+    # input,output tokens
+    app.config["MODEL_FAST"] = os.getenv("MODEL_FAST", app.config["OPENAI_MODEL"])
+    app.config["MODEL_LARGE"] = os.getenv("MODEL_LARGE", "gpt-4o")
+    app.config["MODEL_FAST_COST"] = tuple(
+        float(cost) for cost in os.getenv("MODEL_FAST_COST", "0.5,1.5").split(",")
+    )
+    app.config["MODEL_LARGE_COST"] = tuple(
+        float(cost) for cost in os.getenv("MODEL_LARGE_COST", "2.5,10").split(",")
+    )
+    app.config["MODEL_ROUTING_POLICY"] = os.getenv("MODEL_ROUTING_POLICY", "heuristic")
+    app.config["MODEL_ROUTING_THRESHOLD"] = float(
+        os.getenv("MODEL_ROUTING_THRESHOLD", "3")
+    )
+    # Give up on the LLM after this long and send a canned reply
+    app.config["LLM_DEADLINE_SECONDS"] = float(os.getenv("LLM_DEADLINE_SECONDS", "30"))
+    # Send a hedged request if the model hasn't answered by its p95 latency
+    # (at most LLM_HEDGE_AFTER_SECONDS), to LLM_HEDGE_MODEL / LLM_HEDGE_BASE_URL
+    # or, if unset, to the same model again
+    app.config["LLM_HEDGE"] = os.getenv("LLM_HEDGE", "true").lower() == "true"
+    app.config["LLM_HEDGE_AFTER_SECONDS"] = float(
+        os.getenv("LLM_HEDGE_AFTER_SECONDS", "8")
+    )
+    app.config["LLM_HEDGE_MODEL"] = os.getenv("LLM_HEDGE_MODEL", "")
+    app.config["LLM_HEDGE_BASE_URL"] = os.getenv("LLM_HEDGE_BASE_URL", "")
+    # A streamed reply that has started is only cut off (and flagged as
+    # truncated) when no chunk arrives for this long
+    app.config["LLM_STREAM_IDLE_SECONDS"] = float(
+        os.getenv("LLM_STREAM_IDLE_SECONDS", "10")
+    )
+    # Stream LLM replies and send each sentence as soon as it's ready
+    app.config["LLM_STREAMING"] = os.getenv("LLM_STREAMING", "false").lower() == "true"
+    # Catalog data files (JSON or CSV), their validated snapshots and hot reload
+    app.config["CATALOG_DIR"] = os.getenv("CATALOG_DIR", "data/catalogs")
+    app.config["CATALOG_NAME"] = os.getenv("CATALOG_NAME", "pixz")
+    app.config["CATALOG_SNAPSHOT_DIR"] = os.getenv(
+        "CATALOG_SNAPSHOT_DIR", "catalog_snapshots"
+    )
+    app.config["CATALOG_RELOAD_INTERVAL"] = float(
+        os.getenv("CATALOG_RELOAD_INTERVAL", "5")
+    )
+    # Let the chatbot call the product_search tool; each turn lists only the
+    # TOOLS_TOP_K products most relevant to the customer's message
+    app.config["LLM_TOOLS"] = os.getenv("LLM_TOOLS", "true").lower() == "true"
+    app.config["TOOLS_TOP_K"] = int(os.getenv("TOOLS_TOP_K", "5"))
+    # Concurrent tool calls and how long their results are reused
+    app.config["TOOL_WORKERS"] = int(os.getenv("TOOL_WORKERS", "4"))
+    app.config["TOOL_CACHE_TTL"] = float(os.getenv("TOOL_CACHE_TTL", "300"))
+    # Answer simple price/option/menu questions from the catalog without the LLM
+    app.config["INTENT_ROUTER"] = os.getenv("INTENT_ROUTER", "true").lower() == "true"
+    # Cache of replies to repeated questions (exact and chromadb semantic tiers)
+    app.config["RESPONSE_CACHE"] = os.getenv("RESPONSE_CACHE", "true").lower() == "true"
+    app.config["RESPONSE_CACHE_PATH"] = os.getenv("RESPONSE_CACHE_PATH", "")
+    app.config["RESPONSE_CACHE_THRESHOLD"] = float(
+        os.getenv("RESPONSE_CACHE_THRESHOLD", "0.88")
+    )
+    app.config["RESPONSE_CACHE_TTL"] = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+    # Prompt tokens per LLM call; older turns are folded into a summary
+    app.config["CONTEXT_TOKEN_BUDGET"] = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+    # Per-customer chat sessions kept in memory, the rest spilled to SQLite
+    app.config["SESSION_MAX_RESIDENT"] = int(os.getenv("SESSION_MAX_RESIDENT", "1000"))
+    app.config["SESSION_STORE_PATH"] = os.getenv("SESSION_STORE_PATH", "chat_sessions.db")
+    # Pooled keep-alive connections to graph.facebook.com
+    app.config["GRAPH_POOL_SIZE"] = int(os.getenv("GRAPH_POOL_SIZE", "10"))
+    app.config["GRAPH_TIMEOUT"] = float(os.getenv("GRAPH_TIMEOUT", "10"))
+    # Uploaded media ids for product images
+    app.config["MEDIA_CACHE_PATH"] = os.getenv("MEDIA_CACHE_PATH", "media_db")
+    # Rate-limited outbound send queue (messages per second tier, retries)
+    app.config["OUTBOUND_RATE"] = float(os.getenv("OUTBOUND_RATE", "80"))
+    app.config["OUTBOUND_BURST"] = float(os.getenv("OUTBOUND_BURST", "80"))
+    # Messages are ordered per recipient, different chats are sent concurrently
+    app.config["OUTBOUND_WORKERS"] = int(os.getenv("OUTBOUND_WORKERS", "8"))
+    app.config["OUTBOUND_MAX_RETRIES"] = int(os.getenv("OUTBOUND_MAX_RETRIES", "5"))
+    app.config["DEAD_LETTER_PATH"] = os.getenv("DEAD_LETTER_PATH", "dead_letters.db")
+    # Acknowledge webhooks immediately and process them on a background pool
+    app.config["WEBHOOK_ASYNC"] = os.getenv("WEBHOOK_ASYNC", "false").lower() == "true"
+    app.config["WEBHOOK_WORKERS"] = int(os.getenv("WEBHOOK_WORKERS", "4"))
+    app.config["WEBHOOK_QUEUE_SIZE"] = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+    # aiohttp server mode (run_async.py): messages being answered at once;
+    # past this the webhook answers 503 so Meta redelivers later
+    app.config["ASYNC_MAX_INFLIGHT"] = int(os.getenv("ASYNC_MAX_INFLIGHT", "500"))
+    # Deduplication of redelivered webhook messages ("memory" or "sqlite")
+    app.config["DEDUP_BACKEND"] = os.getenv("DEDUP_BACKEND", "memory")
+    app.config["DEDUP_SQLITE_PATH"] = os.getenv("DEDUP_SQLITE_PATH", "seen_messages.db")
+    app.config["DEDUP_TTL_SECONDS"] = int(os.getenv("DEDUP_TTL_SECONDS", "86400"))
+    app.config["DEDUP_MAX_SIZE"] = int(os.getenv("DEDUP_MAX_SIZE", "10000"))
+    # Aggregated sent/delivered/read status callbacks
+    app.config["STATUS_STORE_PATH"] = os.getenv("STATUS_STORE_PATH", "message_statuses.db")
+    app.config["STATUS_FLUSH_SIZE"] = int(os.getenv("STATUS_FLUSH_SIZE", "500"))
+    app.config["STATUS_FLUSH_INTERVAL"] = float(os.getenv("STATUS_FLUSH_INTERVAL", "5"))
 
 
 def configure_logging():
@@ -1,25 +1,67 @@
-from functools import wraps
+from functools import lru_cache, wraps
 from flask import current_app, jsonify, request
 import logging
 import hashlib
 import hmac
 
 
-def validate_signature(payload, signature):
+@lru_cache(maxsize=4)
+def _hmac_for_secret(app_secret):
+    # Keyed HMAC state is built once per secret and copied for every request
+    return hmac.new(bytes(app_secret, "latin-1"), digestmod=hashlib.sha256)
+
+
+def validate_signature(payload, signature, app_secret=None):
     """
     Validate the incoming payload's signature against our expected signature
+
+    :param payload: The raw request body as bytes, exactly as received.
+    :param signature: The hex digest from the X-Hub-Signature-256 header.
+    :param app_secret: Defaults to the APP_SECRET of the current app.
     """
+    if app_secret is None:
+        app_secret = current_app.config["APP_SECRET"]
+
     # Use the App Secret to hash the payload
-    expected_signature = hmac.new(
-        bytes(current_app.config["APP_SECRET"], "latin-1"),
-        msg=payload.encode("utf-8"),
-        digestmod=hashlib.sha256,
-    ).hexdigest()
+    mac = _hmac_for_secret(app_secret).copy()
+    mac.update(payload)
+    expected_signature = mac.hexdigest()
 
     # Check if the signature matches
     return hmac.compare_digest(expected_signature, signature)
 
 
+def bearer_token_valid(authorization, token=None):
+    """
+    Check an Authorization header against "Bearer <token>".
+
+    :param authorization: The Authorization header, or None if missing.
+    :param token: Defaults to the VERIFY_TOKEN of the current app. Requests
+        are always rejected when it isn't configured.
+    """
+    if token is None:
+        token = current_app.config["VERIFY_TOKEN"]
+    if not token or not authorization:
+        return False
+    return hmac.compare_digest(authorization, f"Bearer {token}")
+
+
+def token_required(f):
+    """
+    Decorator for internal endpoints such as /metrics, which must be called
+    with an "Authorization: Bearer <VERIFY_TOKEN>" header.
+    """
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not bearer_token_valid(request.headers.get("Authorization")):
+            logging.info("Request without a valid bearer token")
+            return jsonify({"status": "error", "message": "Unauthorized"}), 401
+        return f(*args, **kwargs)
+
+    return decorated_function
+
+
 def signature_required(f):
     """
     Decorator to ensure that the incoming requests to our webhook are valid and signed with the correct signature.
@@ -30,7 +72,8 @@ def signature_required(f):
         signature = request.headers.get("X-Hub-Signature-256", "")[
             7:
         ]  # Removing 'sha256='
-        if not validate_signature(request.data.decode("utf-8"), signature):
+        # The body is read once and cached on the request for the view to parse
+        if not validate_signature(request.get_data(cache=True), signature):
             logging.info("Signature verification failed!")
             return jsonify({"status": "error", "message": "Invalid signature"}), 403
         return f(*args, **kwargs)
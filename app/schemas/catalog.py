@@ -1,6 +1,9 @@
 from decimal import Decimal
+from types import MappingProxyType
+from typing import Iterable
 
-from pydantic import BaseModel, validator
+import numpy as np
+from pydantic import BaseModel, PrivateAttr, validator
 
 # from app.schemas.types import ItemQuanity
 
@@ -20,8 +23,42 @@ class PriceInfo(BaseModel):
     subtotal: float
     delivery_price: float | None = None
 
+    @property
+    def total(self) -> float:
+        return self.subtotal + (self.delivery_price or 0.0)
 
-class CatalogItem(BaseModel):
+
+def _readonly(array):
+    array.flags.writeable = False
+    return array
+
+
+class _IndexedModel(BaseModel):
+    """
+    Base for models with read-only private indexes that survive pickling
+    (MappingProxyType can't be pickled and unpickled arrays are writable).
+    """
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        private = state.get("__pydantic_private__") or {}
+        state["__pydantic_private__"] = {
+            key: dict(value) if isinstance(value, MappingProxyType) else value
+            for key, value in private.items()
+        }
+        return state
+
+    def __setstate__(self, state):
+        private = state.get("__pydantic_private__") or {}
+        for key, value in private.items():
+            if isinstance(value, dict):
+                private[key] = MappingProxyType(value)
+            elif isinstance(value, np.ndarray):
+                _readonly(value)
+        super().__setstate__(state)
+
+
+class CatalogItem(_IndexedModel):
     id: int
     item_name: str
     item_description: str | None = None
@@ -29,6 +66,16 @@ class CatalogItem(BaseModel):
     options: list[Option]
     price_map: list[tuple[PriceInfo, list[OptionValue]]]
 
+    # Read-only indexes over price_map, built once after validation
+    _option_values: MappingProxyType = PrivateAttr()
+    _price_rows: MappingProxyType = PrivateAttr()
+    _prices: MappingProxyType = PrivateAttr()
+    # Dense price matrices with one axis per option (NaN for combinations
+    # missing from price_map) and the price_map row of every cell (-1 if none)
+    _subtotals: np.ndarray = PrivateAttr()
+    _delivery_prices: np.ndarray = PrivateAttr()
+    _row_index: np.ndarray = PrivateAttr()
+
     @validator("price_map")
     def validate_price_map(cls, price_map, values):
         options = values.get("options")
@@ -54,72 +101,190 @@ class CatalogItem(BaseModel):
 
         return price_map
 
+    def model_post_init(self, __context):
+        option_values = {option.id: {} for option in self.options}
+        price_rows = {}
+        for row in self.price_map:
+            for option_value in row[1]:
+                # dicts keep first-seen order and drop duplicates
+                option_values[option_value.option_id].setdefault(
+                    option_value.id, option_value
+                )
+                price_rows.setdefault(option_value.id, []).append(row)
+        self._option_values = MappingProxyType(
+            {
+                option_id: tuple(values.values())
+                for option_id, values in option_values.items()
+            }
+        )
+        self._price_rows = MappingProxyType(
+            {value_id: tuple(rows) for value_id, rows in price_rows.items()}
+        )
+        self._prices = MappingProxyType(
+            {
+                frozenset(option_value.id for option_value in values): price_info
+                for price_info, values in self.price_map
+            }
+        )
+        self._build_price_matrix()
+
+    def _build_price_matrix(self):
+        axes = [self.option_values(option.id) for option in self.options]
+        positions = {
+            option_value.id: (axis, i)
+            for axis, values in enumerate(axes)
+            for i, option_value in enumerate(values)
+        }
+        shape = tuple(len(values) for values in axes)
+        subtotals = np.full(shape, np.nan)
+        delivery_prices = np.full(shape, np.nan)
+        row_index = np.full(shape, -1, dtype=np.int64)
+        for row, (price_info, values) in enumerate(self.price_map):
+            cell = [0] * len(axes)
+            for option_value in values:
+                axis, i = positions[option_value.id]
+                cell[axis] = i
+            cell = tuple(cell)
+            subtotals[cell] = price_info.subtotal
+            if price_info.delivery_price is not None:
+                delivery_prices[cell] = price_info.delivery_price
+            row_index[cell] = row
+        self._subtotals = _readonly(subtotals)
+        self._delivery_prices = _readonly(delivery_prices)
+        self._row_index = _readonly(row_index)
+
+    def option_values(self, option_id: int) -> tuple[OptionValue, ...]:
+        """Distinct values of an option, in price_map order."""
+        return self._option_values.get(option_id, ())
 
-class Catalog(BaseModel):
+    def price_rows(
+        self, option_value_id: int
+    ) -> tuple[tuple[PriceInfo, list[OptionValue]], ...]:
+        """Every price_map row that includes the given option value."""
+        return self._price_rows.get(option_value_id, ())
+
+    def quote(self, option_value_ids: Iterable[int]) -> PriceInfo | None:
+        """
+        Price of the combination with exactly these option values.
+
+        :param option_value_ids: One OptionValue id per option, in any order.
+        :return: The PriceInfo, or None if the combination isn't offered.
+        """
+        return self._prices.get(frozenset(option_value_ids))
+
+    def price_matrix(self, include_delivery: bool = False) -> np.ndarray:
+        """
+        Prices as an array with one axis per option, in `options` order, and
+        axis positions following `option_values`. Missing combinations are NaN.
+        """
+        if not include_delivery:
+            return self._subtotals
+        return self._subtotals + np.nan_to_num(self._delivery_prices)
+
+    def cheapest_under(
+        self, max_price: float, include_delivery: bool = False, limit: int | None = None
+    ) -> list[tuple[PriceInfo, list[OptionValue]]]:
+        """
+        Combinations priced at or below `max_price`, cheapest first.
+        """
+        prices = self.price_matrix(include_delivery).ravel()
+        rows = self._row_index.ravel()
+        # NaN (missing combinations) never compares <= max_price
+        candidates = np.flatnonzero(prices <= max_price)
+        candidates = candidates[np.argsort(prices[candidates], kind="stable")]
+        if limit is not None:
+            candidates = candidates[:limit]
+        return [self.price_map[row] for row in rows[candidates]]
+
+    def unit_prices(
+        self, quantity_option_id: int, include_delivery: bool = False
+    ) -> list[tuple[OptionValue, float]]:
+        """
+        Lowest price per piece for every value (tier) of a numeric quantity
+        option, across all combinations of the other options.
+        """
+        axis = next(
+            i for i, option in enumerate(self.options) if option.id == quantity_option_id
+        )
+        tiers = self.option_values(quantity_option_id)
+        quantities = np.array([float(tier.value) for tier in tiers])
+        prices = np.moveaxis(self.price_matrix(include_delivery), axis, 0)
+        prices = prices.reshape(len(tiers), -1)
+        with np.errstate(invalid="ignore"):
+            # All-NaN tiers (never offered) stay NaN
+            cheapest = np.fmin.reduce(prices, axis=1)
+        return list(zip(tiers, (cheapest / quantities).tolist()))
+
+
+class Catalog(_IndexedModel):
     id: int
     catalog_name: str
     items: list[CatalogItem]
 
+    _items_by_id: MappingProxyType = PrivateAttr()
+    _version: str | None = PrivateAttr(default=None)
+    # Every combination of every item, flattened for catalog-wide queries
+    _all_subtotals: np.ndarray = PrivateAttr()
+    _all_totals: np.ndarray = PrivateAttr()
+    _all_items: np.ndarray = PrivateAttr()
+    _all_rows: np.ndarray = PrivateAttr()
+
+    def model_post_init(self, __context):
+        self._items_by_id = MappingProxyType({item.id: item for item in self.items})
+        subtotals, totals, items, rows = [], [], [], []
+        for position, item in enumerate(self.items):
+            offered = item._row_index.ravel() >= 0
+            subtotals.append(item.price_matrix().ravel()[offered])
+            totals.append(item.price_matrix(include_delivery=True).ravel()[offered])
+            rows.append(item._row_index.ravel()[offered])
+            items.append(np.full(int(offered.sum()), position, dtype=np.int64))
+        self._all_subtotals = _readonly(np.concatenate(subtotals or [np.empty(0)]))
+        self._all_totals = _readonly(np.concatenate(totals or [np.empty(0)]))
+        self._all_items = _readonly(np.concatenate(items or [np.empty(0, np.int64)]))
+        self._all_rows = _readonly(np.concatenate(rows or [np.empty(0, np.int64)]))
+
+    @property
+    def version(self) -> str | None:
+        """
+        Content hash of the file the catalog was loaded from, the same value
+        as CatalogStore.version; None for a catalog built in code.
+        """
+        return self._version
+
     def get_item_by_id(self, item_id: int) -> CatalogItem | None:
-        for item in self.items:
-            if item.id == item_id:
-                return item
-        return None
-
-
-# Create options
-size_option = Option(id=1, name="Tamaño")
-quantity_option = Option(id=2, name="Piezas")
-
-# Create option values
-size_21_5x14_cm = OptionValue(id=1, option_id=1, value="21.5 x 14 cm")
-quantity_1000 = OptionValue(id=2, option_id=2, value="1000")
-quantity_2000 = OptionValue(id=3, option_id=2, value="2000")
-quantity_3000 = OptionValue(id=4, option_id=2, value="3000")
-quantity_4000 = OptionValue(id=5, option_id=2, value="4000")
-quantity_5000 = OptionValue(id=6, option_id=2, value="5000")
-
-# Create the catalog item
-RECETAS_ECONOMICAS_CATALOG_ITEM = CatalogItem(
-    id=1,
-    item_name="Recetas Medicas Económicas",
-    item_description="""Si eres Médico ahora puedes imprimir tus recetas médicas en una forma muy sencilla y económica. Selecciona algunos de nuestros diseños de recetas médicas que tenemos y personalizalos con toda tu información sin ningún costo!
-
-- Impresión a 1 tinta color azul en Papel Bond de 90g
-
-- Terminado en blocks de 50 recetas.
-
-""",
-    item_category="Medical Forms",
-    options=[size_option, quantity_option],
-    price_map=[
-        (
-            PriceInfo(subtotal=1590.00, delivery_price=280.00),
-            [size_21_5x14_cm, quantity_1000],
-        ),
-        (
-            PriceInfo(subtotal=1850.00, delivery_price=390.00),
-            [size_21_5x14_cm, quantity_2000],
-        ),
-        (
-            PriceInfo(subtotal=2090.00, delivery_price=780.00),
-            [size_21_5x14_cm, quantity_3000],
-        ),
-        (
-            PriceInfo(subtotal=2350.00, delivery_price=780.00),
-            [size_21_5x14_cm, quantity_4000],
-        ),
-        (
-            PriceInfo(subtotal=2610.00, delivery_price=780.00),
-            [size_21_5x14_cm, quantity_5000],
-        ),
-    ],
-)
-
-
-CATALOG_PIXZ = Catalog(
-    id=1, catalog_name="pixz", items=[RECETAS_ECONOMICAS_CATALOG_ITEM]
-)
+        return self._items_by_id.get(item_id)
+
+    def quote(self, item_id: int, option_value_ids: Iterable[int]) -> PriceInfo | None:
+        """Price of an item with the given option values, or None."""
+        item = self._items_by_id.get(item_id)
+        if item is None:
+            return None
+        return item.quote(option_value_ids)
+
+    def cheapest_under(
+        self, max_price: float, include_delivery: bool = False, limit: int | None = None
+    ) -> list[tuple[CatalogItem, PriceInfo, list[OptionValue]]]:
+        """
+        The cheapest combination of every item that has one priced at or
+        below `max_price`, cheapest first.
+        """
+        prices = self._all_totals if include_delivery else self._all_subtotals
+        candidates = np.flatnonzero(prices <= max_price)
+        # Sort by item, then price, and keep the first combination of each item
+        order = candidates[
+            np.lexsort((prices[candidates], self._all_items[candidates]))
+        ]
+        _, first = np.unique(self._all_items[order], return_index=True)
+        best = order[first]
+        best = best[np.argsort(prices[best], kind="stable")]
+        if limit is not None:
+            best = best[:limit]
+        results = []
+        for i in best:
+            item = self.items[self._all_items[i]]
+            price_info, values = item.price_map[self._all_rows[i]]
+            results.append((item, price_info, values))
+        return results
 
 
 # pan_con_semillas = CatalogItem(
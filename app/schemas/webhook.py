@@ -0,0 +1,36 @@
+from dataclasses import dataclass
+
+
+# Plain slotted dataclasses rather than pydantic models: these are built for
+# every item of every webhook POST and never need validation.
+
+
+@dataclass(frozen=True, slots=True)
+class MessageEvent:
+    phone_number_id: str | None
+    wa_id: str
+    customer_name: str | None
+    message: dict
+
+    @property
+    def message_id(self) -> str | None:
+        return self.message.get("id")
+
+
+@dataclass(frozen=True, slots=True)
+class StatusEvent:
+    phone_number_id: str | None
+    status: dict
+
+    @property
+    def message_id(self) -> str | None:
+        return self.status.get("id")
+
+
+@dataclass(frozen=True, slots=True)
+class ErrorEvent:
+    phone_number_id: str | None
+    error: dict
+
+
+WebhookEvent = MessageEvent | StatusEvent | ErrorEvent
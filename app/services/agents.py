@@ -1,15 +1,30 @@
+import importlib
+import logging
 import os
+import time
+from dataclasses import dataclass, replace
+from typing import Any
 
 from dotenv import load_dotenv
 
 from langchain.memory import ChatMessageHistory
 from langchain.tools import BaseTool
+from langchain_core.language_models import BaseChatModel
 from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
 from langchain_openai import ChatOpenAI
 
 import numpy as np
 
 from app.schemas.catalog import Catalog
+from app.services.context import ContextWindow
+from app.services.hedging import is_fallback
+from app.services.intent_router import OPTION_KEYWORDS, PRICE_KEYWORDS
+from app.services.response_cache import ResponseCache
+from app.services.tool_executor import ToolExecutor
+from app.tools import ItemRetriever
+from app.utils.metrics import METRICS
+from app.utils.text import key_words, normalize_text, word_set
+from app.utils.whatsapp_formatting import pop_complete_text
 
 load_dotenv()  # Load environment variables from a .env file
 
@@ -46,73 +61,454 @@ Don't be pushy and if they don't directly ask about products, just answer their
 """
 
 
+# Model calls allowed to request more tools before we stop and reply with text
+MAX_TOOL_ROUNDS = 3
+
+@dataclass(frozen=True, slots=True)
+class ModelTier:
+    """
+    A chat model the ModelRouter can pick for a turn.
+
+    :param name: Tier name used by routing policies and metrics, e.g. "fast".
+    :param chat_model: The model serving the tier.
+    :param input_cost: USD per million prompt tokens.
+    :param output_cost: USD per million completion tokens.
+    """
+
+    name: str
+    chat_model: Any
+    input_cost: float = 0.0
+    output_cost: float = 0.0
+
+
+class HeuristicRoutingPolicy:
+    """
+    Sends a message to the `large` tier when its score reaches `threshold`,
+    and to the `fast` tier otherwise.
+
+    A message scores a point for being at least `long_words` words long (and
+    another at twice that), for every catalog product it mentions (up to
+    two), for asking about prices or options (likely tool calls) and for
+    asking more than one question; quantities add half a point. Greetings,
+    thanks and single-product questions stay on the fast tier.
+    """
+
+    def __init__(self, fast="fast", large="large", threshold=3.0, long_words=25):
+        self.fast = fast
+        self.large = large
+        self.threshold = threshold
+        self.long_words = long_words
+        # (catalog version, word -> ids of the items whose name has it)
+        self._vocabulary = (None, {})
+
+    def _item_words(self, catalog):
+        version, vocabulary = self._vocabulary
+        if version == catalog.version:
+            return vocabulary
+        vocabulary = {}
+        for item in catalog.items:
+            for word in key_words(item.item_name):
+                vocabulary.setdefault(word, set()).add(item.id)
+        self._vocabulary = (catalog.version, vocabulary)
+        return vocabulary
+
+    def score(self, text: str, catalog: Catalog | None) -> float:
+        normalized = normalize_text(text)
+        words = word_set(normalized)
+        n_words = len(normalized.split())
+        score = 0.0
+        if n_words >= self.long_words:
+            score += 1 if n_words < 2 * self.long_words else 2
+        if catalog is not None:
+            vocabulary = self._item_words(catalog)
+            items = set()
+            for word in words:
+                items |= vocabulary.get(word, set())
+            score += min(len(items), 2)
+        if words & PRICE_KEYWORDS or words & OPTION_KEYWORDS:
+            score += 1
+        if text.count("?") > 1:
+            score += 1
+        if any(char.isdigit() for char in text):
+            score += 0.5
+        return score
+
+    def __call__(self, text: str, catalog: Catalog | None) -> str:
+        if self.score(text, catalog) >= self.threshold:
+            return self.large
+        return self.fast
+
+
+class FixedRoutingPolicy:
+    """Sends every message to the same tier."""
+
+    def __init__(self, tier: str):
+        self.tier = tier
+
+    def __call__(self, text: str, catalog: Catalog | None) -> str:
+        return self.tier
+
+
+def load_routing_policy(spec: str, threshold: float = 3.0):
+    """
+    Build the routing policy named by `spec`.
+
+    :param spec: "heuristic", a tier name ("fast" or "large") to always use
+        that tier, or "package.module:factory" for a custom policy. A factory
+        is called without arguments and returns a callable
+        policy(text, catalog) -> tier name.
+    """
+    if spec == "heuristic":
+        return HeuristicRoutingPolicy(threshold=threshold)
+    if ":" in spec:
+        module_name, _, attr = spec.partition(":")
+        return getattr(importlib.import_module(module_name), attr)()
+    return FixedRoutingPolicy(spec)
+
+
+class _MeteredChatModel:
+    """
+    The chat model of a tier, recording latency, tokens and cost of each call.
+    """
+
+    def __init__(self, tier: ModelTier):
+        self.tier = tier
+
+    def _record(self, response, start):
+        prefix = f"models.{self.tier.name}"
+        METRICS.observe(f"{prefix}.seconds", time.monotonic() - start)
+        METRICS.incr(f"{prefix}.calls")
+        usage = getattr(response, "usage_metadata", None)
+        if not usage:
+            return
+        input_tokens, output_tokens = usage["input_tokens"], usage["output_tokens"]
+        METRICS.incr(f"{prefix}.input_tokens", input_tokens)
+        METRICS.incr(f"{prefix}.output_tokens", output_tokens)
+        # Costs are per million tokens, so this is in millionths of a dollar
+        cost = input_tokens * self.tier.input_cost + output_tokens * self.tier.output_cost
+        METRICS.incr(f"{prefix}.cost_microusd", round(cost))
+
+    def invoke(self, input, config=None, **kwargs):
+        start = time.monotonic()
+        response = self.tier.chat_model.invoke(input, config, **kwargs)
+        self._record(response, start)
+        return response
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        start = time.monotonic()
+        response = await self.tier.chat_model.ainvoke(input, config, **kwargs)
+        self._record(response, start)
+        return response
+
+    def stream(self, input, config=None, **kwargs):
+        start = time.monotonic()
+        response = None
+        for chunk in self.tier.chat_model.stream(input, config, **kwargs):
+            response = chunk if response is None else response + chunk
+            yield chunk
+        self._record(response, start)
+
+    async def astream(self, input, config=None, **kwargs):
+        start = time.monotonic()
+        response = None
+        async for chunk in self.tier.chat_model.astream(input, config, **kwargs):
+            response = chunk if response is None else response + chunk
+            yield chunk
+        self._record(response, start)
+
+
+class ModelRouter:
+    """
+    Picks the model tier for each customer message.
+
+    `policy(text, catalog)` returns the name of a tier; unknown names and
+    policy errors fall back to the `default` tier. Per-tier latency, token
+    and cost counters are recorded under "models.<tier>".
+    """
+
+    def __init__(self, tiers: list[ModelTier], policy, default: str = "fast"):
+        self.tiers = {tier.name: tier for tier in tiers}
+        self.policy = policy
+        self.default = default
+
+    def bind_tools(self, tools, **kwargs):
+        return ModelRouter(
+            [
+                replace(tier, chat_model=tier.chat_model.bind_tools(tools, **kwargs))
+                for tier in self.tiers.values()
+            ],
+            self.policy,
+            self.default,
+        )
+
+    def select(self, text: str, catalog: Catalog | None) -> _MeteredChatModel:
+        """The chat model for the turn answering `text`."""
+        try:
+            name = self.policy(text, catalog)
+        except Exception:
+            logging.exception("Model routing policy failed")
+            name = self.default
+        tier = self.tiers.get(name)
+        if tier is None:
+            logging.warning(f"Routing policy chose unknown model tier {name}")
+            tier = self.tiers[self.default]
+        METRICS.incr(f"models.{tier.name}.turns")
+        return _MeteredChatModel(tier)
+
+
 class OpenAIChatbot:
 
     def __init__(
         self,
         openai_model: str,
         chat_history: ChatMessageHistory | None = None,
-        tools: list[BaseTool] | None = None,
+        tools: list[BaseTool | dict] | None = None,
         catalog: Catalog | None = None,
+        chat_model: BaseChatModel | None = None,
+        context_window: ContextWindow | None = None,
+        response_cache: ResponseCache | None = None,
+        item_retriever: ItemRetriever | None = None,
+        tool_executor: ToolExecutor | None = None,
+        model_router: ModelRouter | None = None,
     ):
-        self.chat_model = ChatOpenAI(model=openai_model)
+        # Sessions share one chat model (and its HTTP client) instead of each
+        # creating their own
+        self.chat_model = (
+            chat_model if chat_model is not None else ChatOpenAI(model=openai_model)
+        )
         self.chat_history = (
             chat_history
             if chat_history is not None
             else ChatMessageHistory(messages=[SystemMessage(content=SYSTEM_MESSAGE)])
         )
         self.tools = tools
+        self.model_router = model_router
         if tools is not None:
             self.chat_model = self.chat_model.bind_tools(tools)
+            if model_router is not None:
+                self.model_router = model_router.bind_tools(tools)
         self.catalog = catalog
+        self.context_window = context_window
+        self.response_cache = response_cache
+        self.item_retriever = item_retriever
+        self.tool_executor = tool_executor
+
+    def _catalog(self) -> Catalog | None:
+        # The retriever always holds the latest version of a reloaded catalog
+        if self.item_retriever is not None:
+            return self.item_retriever.catalog
+        return self.catalog
+
+    def _turn_model(self, user_input: str):
+        # The tier picked for this message, or the single chat model
+        if self.model_router is None:
+            return self.chat_model
+        return self.model_router.select(user_input, self._catalog())
+
+    def _context_messages(self) -> list[BaseMessage]:
+        # Only the system prompt, summary and recent turns within the token budget
+        if self.context_window is None:
+            messages = list(self.chat_history.messages)
+        else:
+            messages = self.context_window.select(self.chat_history.messages)
+        if self.item_retriever is not None and isinstance(messages[-1], HumanMessage):
+            # Products relevant to this message go right before it, keeping the
+            # start of the prompt identical across turns
+            products = self.item_retriever.context_message(messages[-1].content)
+            if products is not None:
+                messages.insert(-1, products)
+        return messages
+
+    def _user_turns(self) -> int:
+        return sum(isinstance(m, HumanMessage) for m in self.chat_history.messages)
+
+    def _cached_response(self, user_input: str) -> str | None:
+        # Only the conversation's first question can be answered from the
+        # cache; anything later may depend on the history. A cache hit is
+        # recorded in the history like a normal turn
+        if self.response_cache is None or self._user_turns() > 0:
+            return None
+        response_text = self.response_cache.get(user_input)
+        if response_text is not None:
+            self.chat_history.add_user_message(user_input)
+            self.chat_history.add_ai_message(response_text)
+        return response_text
+
+    def _cache_response(self, user_input: str, model_response: AIMessage):
+        # Replies produced by tool calls depend on the tool result, not only the
+        # question, and replies to later turns on the rest of the conversation
+        if (
+            self.response_cache is not None
+            and self._user_turns() == 1
+            and not model_response.tool_calls
+            and not is_fallback(model_response)
+            and isinstance(model_response.content, str)
+        ):
+            self.response_cache.put(user_input, model_response.content)
+
+    def _run_tools(self, model_response: AIMessage) -> AIMessage | None:
+        """
+        Record a tool-calling response, execute its calls and record their
+        results as ToolMessages.
 
-    def _handle_tool_call(self, model_response: AIMessage):
-        tool_calls = model_response.tool_calls
-        for call in tool_calls:
-            if call["name"] == "product_search":
-                # handle product search call
-                item_id = call["args"]["item_id"]
-                item = self.catalog.get_item_by_id(item_id)
-                options = item.options
-                all_option_value_lists = [x[1] for x in item.price_map]
-                all_option_values = sum(
-                    all_option_value_lists, []
-                )  # flatten all_option_value_lists
-                option_values = [
-                    list(
-                        set(
-                            [
-                                option_value.value
-                                for option_value in all_option_values
-                                if option_value.option_id == option.id
-                            ]
-                        )
-                    )
-                    for option in options
-                ]
-                model_response_content = (
-                    "Me podrías indicar lo siguiente para poder hacer la cotización?\n"
-                )
-                for i, option in enumerate(options):
-                    option_values_string = ", ".join(option_values[i])
-                    model_response_content += f"{i+1}. {option.name}. Las opciones son: {option_values_string}\n"
-                model_response.content = model_response_content
-                return
-            else:
-                pass
-                # handle other calls
+        :return: The reply if every call was a return_direct tool, or None if
+                 the results have to go back to the model.
+        """
+        self.chat_history.add_message(model_response)
+        results = self.tool_executor.run(model_response.tool_calls, self._catalog())
+        return self._record_tool_results(results)
+
+    async def _arun_tools(self, model_response: AIMessage) -> AIMessage | None:
+        # Same as _run_tools, without blocking the event loop
+        self.chat_history.add_message(model_response)
+        results = await self.tool_executor.arun(
+            model_response.tool_calls, self._catalog()
+        )
+        return self._record_tool_results(results)
+
+    def _record_tool_results(self, results) -> AIMessage | None:
+        for result in results:
+            self.chat_history.add_message(result.message)
+        if all(result.return_direct for result in results):
+            return AIMessage(
+                content="\n\n".join(result.message.content for result in results)
+            )
+        return None
+
+    def _without_tool_calls(self, model_response: AIMessage) -> AIMessage:
+        # A tool call we won't answer would make the next request invalid
+        logging.warning("Dropping unanswered tool calls from the model response")
+        return AIMessage(content=model_response.content)
+
+    def _resolve_tool_calls(self, model_response: AIMessage, chat_model) -> AIMessage:
+        """Run tool calls, asking the model again, until it replies with text."""
+        for _ in range(MAX_TOOL_ROUNDS):
+            if not model_response.tool_calls:
+                return model_response
+            if self.tool_executor is None:
+                break
+            reply = self._run_tools(model_response)
+            if reply is not None:
+                return reply
+            model_response = chat_model.invoke(self._context_messages())
+        return self._without_tool_calls(model_response)
+
+    async def _aresolve_tool_calls(
+        self, model_response: AIMessage, chat_model
+    ) -> AIMessage:
+        # Same as _resolve_tool_calls, awaiting the model and the tools
+        for _ in range(MAX_TOOL_ROUNDS):
+            if not model_response.tool_calls:
+                return model_response
+            if self.tool_executor is None:
+                break
+            reply = await self._arun_tools(model_response)
+            if reply is not None:
+                return reply
+            model_response = await chat_model.ainvoke(self._context_messages())
+        return self._without_tool_calls(model_response)
 
     def respond_to_user(self, user_input: str):
+        cached = self._cached_response(user_input)
+        if cached is not None:
+            return cached
         # add user input to messages
         self.chat_history.add_user_message(user_input)
-        model_response = self.chat_model.invoke(self.chat_history.messages)
+        chat_model = self._turn_model(user_input)
+        model_response = chat_model.invoke(self._context_messages())
+        if len(model_response.tool_calls) > 0:
+            model_response = self._resolve_tool_calls(model_response, chat_model)
+        else:
+            self._cache_response(user_input, model_response)
+        self.chat_history.add_ai_message(model_response)
+        return model_response.content
+
+    async def arespond_to_user(self, user_input: str):
+        # Same as respond_to_user, but awaits the model without blocking the event loop
+        cached = self._cached_response(user_input)
+        if cached is not None:
+            return cached
+        self.chat_history.add_user_message(user_input)
+        chat_model = self._turn_model(user_input)
+        model_response = await chat_model.ainvoke(self._context_messages())
         if len(model_response.tool_calls) > 0:
-            self._handle_tool_call(model_response)
+            model_response = await self._aresolve_tool_calls(model_response, chat_model)
         else:
-            pass
+            self._cache_response(user_input, model_response)
         self.chat_history.add_ai_message(model_response)
         return model_response.content
 
+    def stream_respond_to_user(self, user_input: str, on_text):
+        """
+        Stream the reply, calling `on_text` with every complete sentence or
+        paragraph as soon as it has been generated.
+
+        :return: The full response text.
+        """
+        cached = self._cached_response(user_input)
+        if cached is not None:
+            on_text(cached)
+            return cached
+        self.chat_history.add_user_message(user_input)
+        chat_model = self._turn_model(user_input)
+        model_response = None
+        buffer = ""
+        for chunk in chat_model.stream(self._context_messages()):
+            model_response = chunk if model_response is None else model_response + chunk
+            if chunk.content:
+                ready, buffer = pop_complete_text(buffer + chunk.content)
+                if ready:
+                    on_text(ready)
+        model_response = self._stream_message(model_response)
+        if model_response.tool_calls:
+            model_response = self._resolve_tool_calls(model_response, chat_model)
+            buffer = model_response.content
+        else:
+            self._cache_response(user_input, model_response)
+        self.chat_history.add_ai_message(model_response)
+        remainder = buffer.strip()
+        if remainder:
+            on_text(remainder)
+        return model_response.content
+
+    async def astream_respond_to_user(self, user_input: str, on_text):
+        # Same as stream_respond_to_user, with an async `on_text` callback
+        cached = self._cached_response(user_input)
+        if cached is not None:
+            await on_text(cached)
+            return cached
+        self.chat_history.add_user_message(user_input)
+        chat_model = self._turn_model(user_input)
+        model_response = None
+        buffer = ""
+        async for chunk in chat_model.astream(self._context_messages()):
+            model_response = chunk if model_response is None else model_response + chunk
+            if chunk.content:
+                ready, buffer = pop_complete_text(buffer + chunk.content)
+                if ready:
+                    await on_text(ready)
+        model_response = self._stream_message(model_response)
+        if model_response.tool_calls:
+            model_response = await self._aresolve_tool_calls(model_response, chat_model)
+            buffer = model_response.content
+        else:
+            self._cache_response(user_input, model_response)
+        self.chat_history.add_ai_message(model_response)
+        remainder = buffer.strip()
+        if remainder:
+            await on_text(remainder)
+        return model_response.content
+
+    def _stream_message(self, model_response) -> AIMessage:
+        # Turn the aggregated stream chunks into a regular AIMessage
+        if model_response is None:
+            return AIMessage(content="")
+        return AIMessage(
+            content=model_response.content,
+            tool_calls=model_response.tool_calls,
+            response_metadata=model_response.response_metadata,
+        )
+
 
 # bot = OpenAIChatbot(openai_model="gpt-3.5-turbo-0125")
 
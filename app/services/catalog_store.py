@@ -0,0 +1,257 @@
+import csv
+import hashlib
+import io
+import logging
+import os
+import pickle
+import tempfile
+import threading
+from pathlib import Path
+
+from app.schemas.catalog import Catalog
+from app.utils import jsonlib
+from app.utils.metrics import METRICS
+
+# Bump whenever the pickled form of Catalog changes, so old snapshots are rebuilt
+SNAPSHOT_FORMAT = 2
+
+# Columns of a CSV price sheet that aren't options
+CSV_ITEM_COLUMNS = ("item_id", "item_name", "item_description", "item_category")
+CSV_PRICE_COLUMNS = ("subtotal", "delivery_price")
+
+
+def _catalog_from_csv(name, text):
+    """
+    Build catalog data from a CSV price sheet with one row per combination.
+
+    Columns are item_id, item_name, item_description, item_category, subtotal
+    and delivery_price; every other column is an option, named by its header,
+    and the cell is that option's value. Option and value ids are assigned in
+    order of appearance.
+    """
+    reader = csv.DictReader(io.StringIO(text))
+    option_names = [
+        column
+        for column in reader.fieldnames or ()
+        if column not in CSV_ITEM_COLUMNS and column not in CSV_PRICE_COLUMNS
+    ]
+    options = [{"id": i + 1, "name": n} for i, n in enumerate(option_names)]
+    value_ids = {}
+    items = {}
+    for row in reader:
+        item_id = int(row["item_id"])
+        item = items.get(item_id)
+        if item is None:
+            item = items[item_id] = {
+                "id": item_id,
+                "item_name": row["item_name"],
+                "item_description": row.get("item_description") or None,
+                "item_category": row.get("item_category") or None,
+                "options": [],
+                "price_map": [],
+            }
+        option_values = []
+        for option in options:
+            value = row[option["name"]]
+            if not value:
+                # Options an item doesn't use are left blank
+                continue
+            value_id = value_ids.setdefault((option["id"], value), len(value_ids) + 1)
+            option_values.append(
+                {"id": value_id, "option_id": option["id"], "value": value}
+            )
+            if option not in item["options"]:
+                item["options"].append(option)
+        price_info = {"subtotal": float(row["subtotal"])}
+        if row.get("delivery_price"):
+            price_info["delivery_price"] = float(row["delivery_price"])
+        item["price_map"].append((price_info, option_values))
+    return {"id": 1, "catalog_name": name, "items": list(items.values())}
+
+
+def source_version(source: bytes) -> str:
+    """Content hash of a catalog file, used as the catalog's version."""
+    return hashlib.sha256(source).hexdigest()[:16]
+
+
+def load_catalog_file(path: str | Path, source: bytes | None = None) -> Catalog:
+    """
+    Load and validate a catalog from a .json file (the Catalog schema) or a
+    .csv price sheet. The catalog's version is the hash of the file.
+    """
+    path = Path(path)
+    if source is None:
+        source = path.read_bytes()
+    if path.suffix == ".csv":
+        data = _catalog_from_csv(path.stem, source.decode("utf-8-sig"))
+    else:
+        data = jsonlib.loads(source)
+    catalog = Catalog.model_validate(data)
+    catalog._version = source_version(source)
+    return catalog
+
+
+class CatalogStore:
+    """
+    Catalogs loaded from the data files in `data_dir`, keyed by file stem
+    (data/catalogs/pixz.json -> "pixz").
+
+    Each file is validated once; the validated and indexed Catalog is pickled
+    into `snapshot_dir` keyed by a hash of the file, so later starts load the
+    snapshot instead of re-validating. `reload()` picks up changed files and
+    swaps in the new catalogs with a single assignment, so requests in flight
+    keep the catalog object they already have.
+    """
+
+    PATTERNS = ("*.json", "*.csv")
+
+    def __init__(self, data_dir, snapshot_dir=None):
+        self.data_dir = Path(data_dir)
+        self.snapshot_dir = Path(snapshot_dir) if snapshot_dir else None
+        # name -> (catalog, version, source signature)
+        self._entries = {}
+        # name -> signature of a file that failed to load, so it's retried
+        # only once it changes again
+        self._failed = {}
+        self._reload_lock = threading.Lock()
+        self._listeners = []
+        self._watcher = None
+        self._stop = threading.Event()
+        self.reload()
+
+    def get(self, name: str) -> Catalog:
+        return self._entries[name][0]
+
+    def version(self, name: str) -> str:
+        """Content hash of the catalog's source file."""
+        return self._entries[name][1]
+
+    def names(self) -> list[str]:
+        return sorted(self._entries)
+
+    def subscribe(self, listener):
+        """Call `listener(name, catalog, version)` whenever a catalog is (re)loaded."""
+        self._listeners.append(listener)
+
+    def _files(self):
+        files = {}
+        for pattern in self.PATTERNS:
+            for path in self.data_dir.glob(pattern):
+                files[path.stem] = path
+        return files
+
+    def reload(self) -> list[str]:
+        """
+        Load new or changed catalog files.
+
+        A file that fails to load or validate is logged and the previous
+        version of that catalog is kept.
+
+        :return: The names of the catalogs that changed.
+        """
+        with self._reload_lock:
+            entries = dict(self._entries)
+            changed = []
+            for name, path in self._files().items():
+                signature = None
+                try:
+                    stat = path.stat()
+                    signature = (stat.st_mtime_ns, stat.st_size)
+                    if name in entries and entries[name][2] == signature:
+                        continue
+                    if self._failed.get(name) == signature:
+                        continue
+                    source = path.read_bytes()
+                    version = source_version(source)
+                    if name in entries and entries[name][1] == version:
+                        # Touched but unchanged
+                        entries[name] = (*entries[name][:2], signature)
+                        continue
+                    catalog = self._load(name, path, source, version)
+                except Exception:
+                    logging.exception(f"Failed to load catalog {path}")
+                    METRICS.incr("catalogs.load_failures")
+                    self._failed[name] = signature
+                    continue
+                self._failed.pop(name, None)
+                entries[name] = (catalog, version, signature)
+                changed.append(name)
+            # Readers see either the old or the new dict, never a partial update
+            self._entries = entries
+
+        for name in changed:
+            logging.info(f"Loaded catalog {name} ({self.version(name)})")
+            METRICS.incr("catalogs.reloads")
+            catalog, version, _ = self._entries[name]
+            for listener in self._listeners:
+                try:
+                    listener(name, catalog, version)
+                except Exception:
+                    logging.exception(f"Catalog listener failed for {name}")
+        return changed
+
+    def _snapshot_path(self, name):
+        return self.snapshot_dir / f"{name}.catalog.pickle"
+
+    def _load(self, name, path, source, version):
+        if self.snapshot_dir is not None:
+            catalog = self._read_snapshot(name, version)
+            if catalog is not None:
+                METRICS.incr("catalogs.snapshot_hits")
+                return catalog
+        catalog = load_catalog_file(path, source)
+        if self.snapshot_dir is not None:
+            self._write_snapshot(name, version, catalog)
+        return catalog
+
+    def _read_snapshot(self, name, version):
+        # Snapshots are only ever written by this process' own code
+        try:
+            with open(self._snapshot_path(name), "rb") as f:
+                snapshot_format, snapshot_version, catalog = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            logging.warning(f"Ignoring unreadable catalog snapshot for {name}")
+            return None
+        if snapshot_format != SNAPSHOT_FORMAT or snapshot_version != version:
+            return None
+        return catalog
+
+    def _write_snapshot(self, name, version, catalog):
+        # A snapshot only speeds up the next start, so failing to write one
+        # (unpicklable catalog, full disk) is logged and the reload goes on
+        tmp_path = None
+        try:
+            self.snapshot_dir.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.snapshot_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(
+                    (SNAPSHOT_FORMAT, version, catalog),
+                    f,
+                    protocol=pickle.HIGHEST_PROTOCOL,
+                )
+            os.replace(tmp_path, self._snapshot_path(name))
+            tmp_path = None
+        except Exception:
+            logging.exception(f"Failed to write catalog snapshot for {name}")
+        finally:
+            if tmp_path is not None:
+                Path(tmp_path).unlink(missing_ok=True)
+
+    def start_watcher(self, interval: float = 5.0):
+        """Poll the data files every `interval` seconds and reload changes."""
+        if self._watcher is not None:
+            return
+
+        def watch():
+            while not self._stop.wait(interval):
+                self.reload()
+
+        self._watcher = threading.Thread(
+            target=watch, name="catalog-watcher", daemon=True
+        )
+        self._watcher.start()
+
+    def stop_watcher(self):
+        self._stop.set()
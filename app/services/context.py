@@ -0,0 +1,159 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import tiktoken
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage, ToolMessage
+
+from app.services.hedging import is_fallback
+from app.utils.metrics import METRICS
+
+SUMMARY_PROMPT = """Resume brevemente la siguiente conversación entre un cliente y el asistente de Pixz.
+Conserva los productos, cantidades, precios y datos del cliente que se hayan mencionado.
+
+Resumen anterior:
+{summary}
+
+Conversación:
+{conversation}"""
+
+# Every chat message carries a few tokens of framing on top of its content
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Summaries are produced off the request path on a small shared pool
+_SUMMARY_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix="summarizer")
+
+
+class TokenCounter:
+    """
+    Counts message tokens with tiktoken, falling back to a length estimate if
+    the encoding for the model can't be loaded.
+    """
+
+    def __init__(self, model: str):
+        try:
+            self._encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            self._encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            logging.warning(f"Could not load tiktoken encoding, estimating: {e}")
+            self._encoding = None
+
+    def count_text(self, text: str) -> int:
+        if self._encoding is None:
+            return len(text) // 4 + 1
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+    def count(self, message: BaseMessage) -> int:
+        content = message.content
+        if not isinstance(content, str):
+            content = str(content)
+        tokens = MESSAGE_OVERHEAD_TOKENS + self.count_text(content)
+        for call in getattr(message, "tool_calls", None) or ():
+            tokens += self.count_text(call["name"]) + self.count_text(str(call["args"]))
+        return tokens
+
+
+class ContextWindow:
+    """
+    Selects the part of a chat history that is sent to the model.
+
+    The request contains the system prompt, a running summary of older turns
+    and the most recent messages that fit in `budget` tokens. Token counts are
+    computed once per message as the history grows. Turns that fall out of the
+    window are folded into the summary on a background thread, so summarizing
+    never adds latency to the reply.
+    """
+
+    def __init__(
+        self,
+        counter: TokenCounter,
+        budget: int = 3000,
+        summarizer: BaseChatModel | None = None,
+    ):
+        self.counter = counter
+        self.budget = budget
+        self.summarizer = summarizer
+        self.summary = ""
+        self._summary_tokens = 0
+        self._summarized_upto = 1
+        self._summarizing = False
+        self._counts = []
+        self._lock = threading.Lock()
+
+    def _update_counts(self, messages):
+        if len(messages) < len(self._counts):
+            # The history was replaced (e.g. a restored session)
+            self._counts = []
+        for message in messages[len(self._counts) :]:
+            self._counts.append(self.counter.count(message))
+
+    def select(self, messages: list[BaseMessage]) -> list[BaseMessage]:
+        """Return the messages to send for the next model call."""
+        self._update_counts(messages)
+        has_system = bool(messages) and isinstance(messages[0], SystemMessage)
+        first = 1 if has_system else 0
+
+        with self._lock:
+            summary, summary_tokens = self.summary, self._summary_tokens
+        remaining = self.budget - summary_tokens
+        if has_system:
+            remaining -= self._counts[0]
+
+        start = len(messages)
+        # Always keep the latest message, even if it alone exceeds the budget
+        while start > first and (
+            start == len(messages) or self._counts[start - 1] <= remaining
+        ):
+            start -= 1
+            remaining -= self._counts[start]
+        # Never start the window on a tool result without its tool call
+        while start < len(messages) - 1 and isinstance(messages[start], ToolMessage):
+            start += 1
+
+        METRICS.observe("context.tokens", self.budget - remaining)
+        if start > self._summarized_upto:
+            self._schedule_summary(messages, start)
+
+        selected = messages[:first]
+        if summary:
+            selected.append(
+                SystemMessage(content=f"Resumen de la conversación anterior:\n{summary}")
+            )
+        selected.extend(messages[start:])
+        return selected
+
+    def _schedule_summary(self, messages, start):
+        if self.summarizer is None:
+            return
+        with self._lock:
+            if self._summarizing:
+                return
+            self._summarizing = True
+            to_fold = messages[self._summarized_upto : start]
+        _SUMMARY_EXECUTOR.submit(self._summarize, to_fold, start)
+
+    def _summarize(self, to_fold, upto):
+        try:
+            conversation = "\n".join(
+                f"{message.type}: {message.content}" for message in to_fold
+            )
+            prompt = SUMMARY_PROMPT.format(
+                summary=self.summary or "(ninguno)", conversation=conversation
+            )
+            response = self.summarizer.invoke([HumanMessage(content=prompt)])
+            if is_fallback(response):
+                # No model answered; keep the old summary and retry next turn
+                return
+            summary = response.content
+            with self._lock:
+                self.summary = summary
+                self._summary_tokens = self.counter.count_text(summary)
+                self._summarized_upto = upto
+            METRICS.incr("context.summaries")
+        except Exception:
+            logging.exception("Failed to summarize conversation")
+        finally:
+            with self._lock:
+                self._summarizing = False
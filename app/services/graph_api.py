@@ -0,0 +1,68 @@
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class GraphAPIClient:
+    """
+    Shared, keep-alive client for the WhatsApp Cloud (Graph) API.
+
+    One requests.Session is reused for every outbound call so replies don't pay
+    a new TCP+TLS handshake to graph.facebook.com each time. The underlying
+    urllib3 pool is thread-safe, so a single client can be shared by all worker
+    threads. The messages URL and headers are built once.
+    """
+
+    def __init__(
+        self, access_token, version, phone_number_id, pool_size=10, timeout=10
+    ):
+        self.timeout = timeout
+        self.base_url = f"https://graph.facebook.com/{version}/{phone_number_id}"
+        self.messages_url = f"{self.base_url}/messages"
+        self.media_url = f"{self.base_url}/media"
+        self.headers = {
+            "Content-type": "application/json",
+            "Authorization": f"Bearer {access_token}",
+        }
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def post_message(self, data):
+        """
+        POST a serialized message payload to the messages endpoint.
+
+        Raises requests.HTTPError for unsuccessful status codes.
+        """
+        response = self.session.post(
+            self.messages_url, data=data, headers=self.headers, timeout=self.timeout
+        )
+        response.raise_for_status()
+        return response
+
+    def upload_media(self, content, filename, mime_type):
+        """
+        Upload a file to the media endpoint and return its media id.
+        """
+        response = self.session.post(
+            self.media_url,
+            data={"messaging_product": "whatsapp", "type": mime_type},
+            files={"file": (filename, content, mime_type)},
+            headers={"Authorization": self.headers["Authorization"]},
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        return response.json()["id"]
+
+    def close(self):
+        self.session.close()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            config["ACCESS_TOKEN"],
+            config["VERSION"],
+            config["PHONE_NUMBER_ID"],
+            pool_size=config["GRAPH_POOL_SIZE"],
+            timeout=config["GRAPH_TIMEOUT"],
+        )
@@ -0,0 +1,363 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+from app.utils.metrics import METRICS
+
+FALLBACK_REPLY = (
+    "Perdón, estoy tardando más de lo normal en responder. "
+    "¿Me lo podrías repetir en un momento?"
+)
+
+# Latency samples needed before the hedge delay follows the observed p95
+MIN_SAMPLES_FOR_P95 = 20
+
+# Requests run on threads for the sync API; losers can't be interrupted, so
+# the pool is sized for a hedge pair per concurrent conversation
+_HEDGE_EXECUTOR = ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm-hedge")
+
+
+def is_fallback(message) -> bool:
+    """
+    True for the canned reply sent when no model answered in time, and for a
+    streamed reply that was cut short.
+    """
+    return bool(getattr(message, "response_metadata", {}).get("fallback"))
+
+
+class HedgedChatModel:
+    """
+    Chat model wrapper with a per-request deadline and hedged requests.
+
+    The request goes to `primary`; if it hasn't answered (or produced its
+    first streamed chunk) after the hedge delay, or fails, the same request
+    is sent to `secondary` and whichever answers first wins. The hedge delay
+    is the primary's observed p95 latency once enough samples exist, capped
+    at `hedge_after`, which is also used until then. When `deadline` passes
+    with no answer the canned `fallback_reply` is returned instead, marked so
+    it isn't cached.
+
+    Once a streamed reply has started it is no longer held to the deadline,
+    only to `idle_timeout` between chunks; a stream that stalls or fails
+    midway ends with an empty chunk marked as a truncated fallback.
+
+    It implements the parts of the chat model interface the chatbot uses:
+    invoke, ainvoke, stream, astream and bind_tools.
+    """
+
+    def __init__(
+        self,
+        primary,
+        secondary,
+        deadline: float = 30.0,
+        hedge_after: float = 5.0,
+        idle_timeout: float = 10.0,
+        fallback_reply: str = FALLBACK_REPLY,
+        name: str = "llm",
+    ):
+        self.primary = primary
+        self.secondary = secondary
+        self.deadline = deadline
+        self.hedge_after = hedge_after
+        self.idle_timeout = idle_timeout
+        self.fallback_reply = fallback_reply
+        self.name = name
+
+    def bind_tools(self, tools, **kwargs):
+        return HedgedChatModel(
+            self.primary.bind_tools(tools, **kwargs),
+            self.secondary.bind_tools(tools, **kwargs),
+            deadline=self.deadline,
+            hedge_after=self.hedge_after,
+            idle_timeout=self.idle_timeout,
+            fallback_reply=self.fallback_reply,
+            name=self.name,
+        )
+
+    def _hedge_delay(self, metric):
+        name = f"{self.name}.primary.{metric}"
+        if METRICS.timing_count(name) < MIN_SAMPLES_FOR_P95:
+            return self.hedge_after
+        return min(METRICS.percentile(name, 0.95), self.hedge_after)
+
+    def _record(self, role, metric, start):
+        METRICS.observe(f"{self.name}.{role}.{metric}", time.monotonic() - start)
+
+    def _fallback(self, chunk=False):
+        logging.warning(f"No model answered within {self.deadline}s, sending fallback")
+        METRICS.incr(f"{self.name}.fallbacks")
+        cls = AIMessageChunk if chunk else AIMessage
+        return cls(content=self.fallback_reply, response_metadata={"fallback": True})
+
+    def _truncated(self, role):
+        logging.warning(f"{role} model stopped streaming midway, reply truncated")
+        METRICS.incr(f"{self.name}.truncated")
+        return AIMessageChunk(
+            content="", response_metadata={"fallback": True, "truncated": True}
+        )
+
+    def _won(self, role, start):
+        METRICS.incr(f"{self.name}.wins.{role}")
+        METRICS.observe(f"{self.name}.latency_seconds", time.monotonic() - start)
+
+    def invoke(self, input, config=None, **kwargs):
+        start = time.monotonic()
+        deadline = start + self.deadline
+        hedge_at = start + self._hedge_delay("seconds")
+
+        def call(role, model):
+            call_start = time.monotonic()
+            result = model.invoke(input, config, **kwargs)
+            self._record(role, "seconds", call_start)
+            return result
+
+        roles = {_HEDGE_EXECUTOR.submit(call, "primary", self.primary): "primary"}
+        pending = set(roles)
+        hedged = False
+        while time.monotonic() < deadline:
+            wake_at = deadline if hedged else min(hedge_at, deadline)
+            done, pending = wait(
+                pending,
+                timeout=max(wake_at - time.monotonic(), 0),
+                return_when=FIRST_COMPLETED,
+            )
+            for future in done:
+                if future.exception() is None:
+                    self._won(roles[future], start)
+                    return future.result()
+                logging.warning(f"{roles[future]} model failed: {future.exception()!r}")
+                METRICS.incr(f"{self.name}.errors.{roles[future]}")
+            if not hedged and (not pending or time.monotonic() >= hedge_at):
+                METRICS.incr(f"{self.name}.hedged")
+                future = _HEDGE_EXECUTOR.submit(call, "secondary", self.secondary)
+                roles[future] = "secondary"
+                pending.add(future)
+                hedged = True
+            elif not pending:
+                break
+        return self._fallback()
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        # Same as invoke; the losing request is cancelled
+        start = time.monotonic()
+        deadline = start + self.deadline
+        hedge_at = start + self._hedge_delay("seconds")
+
+        async def call(role, model):
+            call_start = time.monotonic()
+            result = await model.ainvoke(input, config, **kwargs)
+            self._record(role, "seconds", call_start)
+            return result
+
+        roles = {asyncio.ensure_future(call("primary", self.primary)): "primary"}
+        pending = set(roles)
+        hedged = False
+        try:
+            while time.monotonic() < deadline:
+                wake_at = deadline if hedged else min(hedge_at, deadline)
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=max(wake_at - time.monotonic(), 0),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                for task in done:
+                    if task.exception() is None:
+                        self._won(roles[task], start)
+                        return task.result()
+                    logging.warning(f"{roles[task]} model failed: {task.exception()!r}")
+                    METRICS.incr(f"{self.name}.errors.{roles[task]}")
+                if not hedged and (not pending or time.monotonic() >= hedge_at):
+                    METRICS.incr(f"{self.name}.hedged")
+                    task = asyncio.ensure_future(call("secondary", self.secondary))
+                    roles[task] = "secondary"
+                    pending.add(task)
+                    hedged = True
+                elif not pending:
+                    break
+            return self._fallback()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stream(self, input, config=None, **kwargs):
+        """
+        Stream from whichever model produces the first chunk; the hedge is
+        based on time to first chunk.
+        """
+        start = time.monotonic()
+        deadline = start + self.deadline
+        hedge_at = start + self._hedge_delay("first_chunk_seconds")
+        events = queue.Queue()
+        stops = {}
+
+        def produce(role, model):
+            call_start = time.monotonic()
+            first = True
+            try:
+                for chunk in model.stream(input, config, **kwargs):
+                    if stops[role].is_set():
+                        return
+                    if first:
+                        self._record(role, "first_chunk_seconds", call_start)
+                        first = False
+                    events.put(("chunk", role, chunk))
+                events.put(("done", role, None))
+            except Exception as e:
+                events.put(("error", role, e))
+
+        def launch(role, model):
+            stops[role] = threading.Event()
+            _HEDGE_EXECUTOR.submit(produce, role, model)
+
+        launch("primary", self.primary)
+        winner = None
+        failed = set()
+        try:
+            while True:
+                hedged = "secondary" in stops
+                if winner is not None:
+                    # A reply that is streaming is only held to the gap
+                    # between chunks, not to the deadline
+                    wake_at = time.monotonic() + self.idle_timeout
+                elif hedged:
+                    wake_at = deadline
+                else:
+                    wake_at = min(hedge_at, deadline)
+                try:
+                    kind, role, payload = events.get(
+                        timeout=max(wake_at - time.monotonic(), 0)
+                    )
+                except queue.Empty:
+                    if winner is not None:
+                        yield self._truncated(winner)
+                        return
+                    if hedged:
+                        if time.monotonic() >= deadline:
+                            break
+                        continue
+                    METRICS.incr(f"{self.name}.hedged")
+                    launch("secondary", self.secondary)
+                    continue
+                if winner is not None and role != winner:
+                    continue
+                if kind == "chunk":
+                    if winner is None:
+                        winner = role
+                        self._won(role, start)
+                        for other, stop in stops.items():
+                            if other != role:
+                                stop.set()
+                    yield payload
+                elif kind == "done":
+                    if winner is None:
+                        self._won(role, start)
+                    return
+                else:
+                    logging.warning(f"{role} model failed: {payload!r}")
+                    METRICS.incr(f"{self.name}.errors.{role}")
+                    if winner is not None:
+                        yield self._truncated(role)
+                        return
+                    failed.add(role)
+                    if "secondary" not in stops:
+                        METRICS.incr(f"{self.name}.hedged")
+                        launch("secondary", self.secondary)
+                    elif len(failed) == len(stops):
+                        break
+            if winner is None:
+                yield self._fallback(chunk=True)
+        finally:
+            for stop in stops.values():
+                stop.set()
+
+    async def astream(self, input, config=None, **kwargs):
+        # Same as stream, with the loser's task cancelled
+        start = time.monotonic()
+        deadline = start + self.deadline
+        hedge_at = start + self._hedge_delay("first_chunk_seconds")
+        events = asyncio.Queue()
+        tasks = {}
+
+        async def produce(role, model):
+            call_start = time.monotonic()
+            first = True
+            try:
+                async for chunk in model.astream(input, config, **kwargs):
+                    if first:
+                        self._record(role, "first_chunk_seconds", call_start)
+                        first = False
+                    await events.put(("chunk", role, chunk))
+                await events.put(("done", role, None))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await events.put(("error", role, e))
+
+        def launch(role, model):
+            tasks[role] = asyncio.ensure_future(produce(role, model))
+
+        launch("primary", self.primary)
+        winner = None
+        failed = set()
+        try:
+            while True:
+                hedged = "secondary" in tasks
+                if winner is not None:
+                    # A reply that is streaming is only held to the gap
+                    # between chunks, not to the deadline
+                    wake_at = time.monotonic() + self.idle_timeout
+                elif hedged:
+                    wake_at = deadline
+                else:
+                    wake_at = min(hedge_at, deadline)
+                try:
+                    kind, role, payload = await asyncio.wait_for(
+                        events.get(), timeout=max(wake_at - time.monotonic(), 0)
+                    )
+                except asyncio.TimeoutError:
+                    if winner is not None:
+                        yield self._truncated(winner)
+                        return
+                    if hedged:
+                        if time.monotonic() >= deadline:
+                            break
+                        continue
+                    METRICS.incr(f"{self.name}.hedged")
+                    launch("secondary", self.secondary)
+                    continue
+                if winner is not None and role != winner:
+                    continue
+                if kind == "chunk":
+                    if winner is None:
+                        winner = role
+                        self._won(role, start)
+                        for other, task in tasks.items():
+                            if other != role:
+                                task.cancel()
+                    yield payload
+                elif kind == "done":
+                    if winner is None:
+                        self._won(role, start)
+                    return
+                else:
+                    logging.warning(f"{role} model failed: {payload!r}")
+                    METRICS.incr(f"{self.name}.errors.{role}")
+                    if winner is not None:
+                        yield self._truncated(role)
+                        return
+                    failed.add(role)
+                    if "secondary" not in tasks:
+                        METRICS.incr(f"{self.name}.hedged")
+                        launch("secondary", self.secondary)
+                    elif len(failed) == len(tasks):
+                        break
+            if winner is None:
+                yield self._fallback(chunk=True)
+        finally:
+            for task in tasks.values():
+                task.cancel()
@@ -8,14 +8,16 @@ load_dotenv()
 HUBSPOT_API_KEY = os.getenv("HUBSPOT_API_KEY")
 
 
-def get_hubspot_owner_data():
-    url = "https://api.hubapi.com/crm/v3/owners"
-    headers = {
+def _hubspot_headers():
+    return {
         "Authorization": f"Bearer {HUBSPOT_API_KEY}",
         "Content-Type": "application/json",
     }
 
-    response = requests.get(url, headers=headers)
+
+def get_hubspot_owner_data():
+    url = "https://api.hubapi.com/crm/v3/owners"
+    response = requests.get(url, headers=_hubspot_headers())
     if response.status_code == 200:
         owners = response.json()
         onwer_list = [
@@ -39,11 +41,6 @@ def get_hubspot_owner_data():
 
 def create_hubspot_contact(phone_number=None, first_name=None, last_name=None):
     url = "https://api.hubapi.com/crm/v3/objects/contacts"
-    headers = {
-        "Authorization": f"Bearer {HUBSPOT_API_KEY}",
-        "Content-Type": "application/json",
-    }
-
     data = {
         "properties": {
             "phone": phone_number,
@@ -51,7 +48,7 @@ def create_hubspot_contact(phone_number=None, first_name=None, last_name=None):
             "lastname": last_name,
         }
     }
-    response = requests.post(url, json=data, headers=headers)
+    response = requests.post(url, json=data, headers=_hubspot_headers())
     if response.status_code == 201:
         logging.info(response.json())
         return response.json()
@@ -61,10 +58,6 @@ def create_hubspot_contact(phone_number=None, first_name=None, last_name=None):
 
 def create_hubspot_note_on_contact(contact_id, note):
     url = "https://api.hubapi.com/crm/v3/objects/notes"
-    headers = {
-        "Authorization": f"Bearer {HUBSPOT_API_KEY}",
-        "Content-Type": "application/json",
-    }
     owner_data = get_hubspot_owner_data()
     data = {
         "properties": {
@@ -81,7 +74,7 @@ def create_hubspot_note_on_contact(contact_id, note):
             }
         ],
     }
-    response = requests.post(url, json=data, headers=headers)
+    response = requests.post(url, json=data, headers=_hubspot_headers())
     if response.status_code == 201:
         return response.json()
     else:
@@ -0,0 +1,235 @@
+import re
+import time
+
+from app.schemas.catalog import Catalog, CatalogItem
+from app.utils.metrics import METRICS
+from app.utils.text import STOPWORDS, key_words, normalize_text, stem_word, word_set
+
+# 2,000 / 2.000 (thousands), 21.5 (decimal) and 2000, optionally followed by "mil"
+_NUMBER = re.compile(r"(?:(\d{1,3}(?:[.,]\d{3})+)|(\d+\.\d+)|(\d+))(?!\d)(\s*mil\b)?")
+
+
+# Keywords are matched against accent-folded, plural-folded words
+PRICE_KEYWORDS = frozenset(
+    map(
+        stem_word,
+        ["cuanto", "cuesta", "cuestan", "precio", "costo", "cotizacion", "cotizar",
+         "cotiza", "vale", "valen", "sale", "salen"],
+    )
+)
+OPTION_KEYWORDS = frozenset(
+    map(
+        stem_word,
+        ["opciones", "tamano", "medida", "cantidad", "presentaciones", "piezas"],
+    )
+)
+MENU_PHRASES = ("menu", "catalogo", "productos", "que venden", "que manejan")
+
+# Greetings, politeness and question words that don't change the answer. A
+# message with any other word the router doesn't know ("a color", "urgente",
+# "monterrey") goes to the chatbot
+FILLER_WORDS = frozenset(
+    map(
+        stem_word,
+        ["hola", "buenas", "buenos", "buen", "dia", "tarde", "noche", "por", "favor",
+         "gracias", "me", "podrias", "podria", "puedes", "puede", "quisiera", "quiero",
+         "queria", "saber", "informacion", "info", "que", "cual", "cuales", "como",
+         "es", "son", "seria", "serian", "tienen", "tiene", "hay", "manejan",
+         "venden", "ofrecen", "ver", "su", "sus", "tu", "tus", "mil", "pesos",
+         "envio", "total", "uno", "unos", "unas", "dar", "das", "decir", "dices",
+         "gustaria", "necesito"],
+    )
+) | STOPWORDS
+# Words that change what's being asked: the chatbot has to read these
+NEGATIONS_AND_QUALIFIERS = frozenset(
+    ["no", "ni", "sin", "nunca", "tampoco", "excepto", "menos", "pero", "mas",
+     "solo", "aproximadamente", "maximo", "minimo", "otro", "otra", "diferente"]
+)
+
+
+def _numbers(text):
+    numbers = []
+    for match in _NUMBER.finditer(text):
+        grouped, decimal, plain, thousands = match.groups()
+        if grouped is not None:
+            value = float(grouped.replace(",", "").replace(".", ""))
+        else:
+            value = float(decimal or plain)
+        if thousands:
+            value *= 1000
+        numbers.append(value)
+    return numbers
+
+
+def format_price(amount):
+    return f"${amount:,.2f}"
+
+
+def option_prompt(item: CatalogItem, options=None):
+    """
+    Ask the customer for the options still needed to quote `item`.
+
+    :param options: The options to ask for, defaults to all of the item's options.
+    """
+    if options is None:
+        options = item.options
+    text = "Me podrías indicar lo siguiente para poder hacer la cotización?\n"
+    for i, option in enumerate(options):
+        values = ", ".join(value.value for value in item.option_values(option.id))
+        text += f"{i+1}. {option.name}. Las opciones son: {values}\n"
+    return text
+
+
+class _ItemMatcher:
+    """Accent-insensitive matchers for one catalog item and its option values."""
+
+    def __init__(self, item: CatalogItem):
+        self.item = item
+        self.words = key_words(item.item_name)
+        self.option_words = set()
+        for option in item.options:
+            self.option_words |= word_set(normalize_text(option.name))
+        # Every word a message about this item may use and still be understood
+        self.known_words = (
+            word_set(normalize_text(item.item_name))
+            | self.option_words
+            | PRICE_KEYWORDS
+            | OPTION_KEYWORDS
+            | FILLER_WORDS
+        )
+        # option id -> list of (value numbers, folded value, OptionValue)
+        self.values = {option.id: [] for option in item.options}
+        for option in item.options:
+            for option_value in item.option_values(option.id):
+                folded = normalize_text(option_value.value)
+                self.values[option.id].append(
+                    (tuple(_numbers(folded)), folded, option_value)
+                )
+                self.known_words |= word_set(folded)
+
+    def match_values(self, text, numbers):
+        """
+        Resolve the option values mentioned in `text`.
+
+        :return: (selected, used_numbers) where selected maps option id to the
+                 matched OptionValues, or None if an option matched ambiguously.
+        """
+        selected = {}
+        used = set()
+        for option_id, candidates in self.values.items():
+            matched = []
+            for value_numbers, folded, option_value in candidates:
+                if value_numbers:
+                    if all(n in numbers for n in value_numbers):
+                        matched.append(option_value)
+                        used.update(value_numbers)
+                elif re.search(rf"\b{re.escape(folded)}\b", text):
+                    matched.append(option_value)
+            if len(matched) > 1:
+                return None, used
+            if matched:
+                selected[option_id] = matched[0]
+            elif len(candidates) == 1:
+                # Options with a single value never need to be asked for
+                selected[option_id] = candidates[0][2]
+        return selected, used
+
+    def price_for(self, selected):
+        return self.item.quote(option_value.id for option_value in selected.values())
+
+
+class IntentRouter:
+    """
+    Rule-based router that answers simple catalog questions without the LLM.
+
+    Matchers for item names, option names and option values are built once
+    from the catalog. `route` answers price lookups, option questions and menu
+    requests from templates and returns None whenever it isn't sure, so the
+    message falls through to the chatbot. Messages with negations or
+    qualifiers, or with any word that isn't part of the item, its options or
+    the known question words, are never answered from a template.
+    """
+
+    def __init__(self, catalog: Catalog):
+        self.catalog = catalog
+        self._items = [_ItemMatcher(item) for item in catalog.items]
+        # Words that identify exactly one item
+        counts = {}
+        for matcher in self._items:
+            for word in matcher.words:
+                counts[word] = counts.get(word, 0) + 1
+        self._item_words = {
+            word: matcher
+            for matcher in self._items
+            for word in matcher.words
+            if counts[word] == 1
+        }
+        self._menu_words = FILLER_WORDS | word_set(" ".join(MENU_PHRASES))
+
+    def route(self, text: str) -> str | None:
+        """Return a templated reply for `text`, or None to use the chatbot."""
+        start = time.perf_counter()
+        reply = self._route(normalize_text(text))
+        METRICS.observe("router.route_seconds", time.perf_counter() - start)
+        METRICS.incr("router.routed" if reply is not None else "router.fallthrough")
+        return reply
+
+    def _route(self, text):
+        words = word_set(text)
+        if words & NEGATIONS_AND_QUALIFIERS:
+            return None
+        matchers = {id(m): m for w in words if (m := self._item_words.get(w))}
+        wants_price = bool(words & PRICE_KEYWORDS)
+
+        if not matchers:
+            if (
+                not wants_price
+                and any(phrase in text for phrase in MENU_PHRASES)
+                and words <= self._menu_words
+            ):
+                return self._menu()
+            return None
+        if len(matchers) > 1:
+            return None
+        matcher = next(iter(matchers.values()))
+        if not words <= matcher.known_words:
+            # Something the templates can't account for, e.g. "a color"
+            return None
+
+        wants_options = bool(words & (OPTION_KEYWORDS | matcher.option_words))
+        if not (wants_price or wants_options):
+            return None
+        numbers = _numbers(text)
+        selected, used = matcher.match_values(text, numbers)
+        if selected is None or any(n not in used for n in numbers):
+            # Ambiguous or unknown values (e.g. 2500 piezas) need the chatbot
+            return None
+        if not wants_price:
+            return option_prompt(matcher.item)
+        missing = [o for o in matcher.item.options if o.id not in selected]
+        if missing:
+            return option_prompt(matcher.item, missing)
+        price_info = matcher.price_for(selected)
+        if price_info is None:
+            return None
+        return self._quote(matcher.item, selected, price_info)
+
+    def _quote(self, item, selected, price_info):
+        # Markdown, like chatbot replies; converted by format_for_whatsapp
+        lines = [f"**{item.item_name}**"]
+        for option in item.options:
+            lines.append(f"• {option.name}: {selected[option.id].value}")
+        price = f"Precio: {format_price(price_info.subtotal)}"
+        if price_info.delivery_price is not None:
+            price += f" + envío {format_price(price_info.delivery_price)}"
+        lines.append(price)
+        lines.append("")
+        lines.append("¿Te gustaría hacer el pedido?")
+        return "\n".join(lines)
+
+    def _menu(self):
+        lines = ["Estos son nuestros productos:"]
+        lines.extend(f"• {item.item_name}" for item in self.catalog.items)
+        lines.append("")
+        lines.append("¿Cuál te interesa?")
+        return "\n".join(lines)
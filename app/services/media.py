@@ -0,0 +1,100 @@
+import logging
+import mimetypes
+import shelve
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+
+from app.utils.metrics import METRICS
+
+# WhatsApp keeps uploaded media for 30 days; re-upload a day early
+MEDIA_TTL_SECONDS = 29 * 24 * 60 * 60
+
+
+class MediaManager:
+    """
+    Uploads product images to the WhatsApp media endpoint once and sends them by id.
+
+    Sending `{"image": {"link": ...}}` makes WhatsApp fetch the image from the
+    third-party host on every send. Instead each image is uploaded once and the
+    returned media id is cached with its expiry, in memory and in a shelve file
+    so it survives restarts. Expired ids are re-uploaded lazily on next use.
+    """
+
+    def __init__(self, client, cache_path, ttl_seconds=MEDIA_TTL_SECONDS):
+        self.client = client
+        self.cache_path = cache_path
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._upload_locks = {}
+        with shelve.open(cache_path) as media_shelf:
+            self._cache = dict(media_shelf)
+
+    def _cached_id(self, link):
+        entry = self._cache.get(link)
+        if entry is not None and entry[1] > time.time():
+            return entry[0]
+        return None
+
+    def get_media_id(self, link):
+        """
+        Return a valid media id for the image at `link`, uploading it if needed.
+
+        :return: The media id, or None if the upload failed.
+        """
+        media_id = self._cached_id(link)
+        if media_id is not None:
+            METRICS.incr("media.cache_hits")
+            return media_id
+
+        with self._lock:
+            upload_lock = self._upload_locks.setdefault(link, threading.Lock())
+        # Only one thread uploads a given image; the others wait for its result
+        with upload_lock:
+            media_id = self._cached_id(link)
+            if media_id is not None:
+                return media_id
+            try:
+                media_id = self._upload(link)
+            except (requests.RequestException, KeyError, ValueError) as e:
+                logging.error(f"Failed to upload media {link}: {e}")
+                METRICS.incr("media.upload_failures")
+                return None
+            entry = (media_id, time.time() + self.ttl_seconds)
+            with self._lock:
+                self._cache[link] = entry
+                with shelve.open(self.cache_path) as media_shelf:
+                    media_shelf[link] = entry
+        METRICS.incr("media.uploads")
+        return media_id
+
+    def invalidate(self, link):
+        """Forget the media id for `link`, e.g. after WhatsApp rejected it."""
+        with self._lock:
+            self._cache.pop(link, None)
+            with shelve.open(self.cache_path) as media_shelf:
+                media_shelf.pop(link, None)
+
+    def replace_rejected(self, link, media_id):
+        """
+        Upload the image at `link` again after WhatsApp rejected `media_id`
+        for it, unless another thread already replaced that id.
+
+        :return: The new media id, or None if the upload failed.
+        """
+        entry = self._cache.get(link)
+        if entry is not None and entry[0] == media_id:
+            METRICS.incr("media.rejected")
+            self.invalidate(link)
+        return self.get_media_id(link)
+
+    def _upload(self, link):
+        response = self.client.session.get(link, timeout=self.client.timeout)
+        response.raise_for_status()
+        mime_type = response.headers.get("Content-Type", "").split(";")[0]
+        if not mime_type.startswith("image/"):
+            mime_type = mimetypes.guess_type(link)[0] or "image/png"
+        filename = urlparse(link).path.rsplit("/", 1)[-1] or "image"
+        return self.client.upload_media(response.content, filename, mime_type)
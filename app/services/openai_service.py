@@ -1,4 +1,6 @@
-from openai import OpenAI
+from functools import lru_cache
+import httpx
+from openai import APITimeoutError, OpenAI, OpenAIError
 import shelve
 from dotenv import load_dotenv
 import os
@@ -6,11 +8,29 @@ import json
 import time
 import logging
 
+from app.utils.metrics import METRICS
+
 load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_ASSISTANT_ID = os.getenv("OPENAI_ASSISTANT_ID")
+# Give up on an assistant run (and cancel it) after this many seconds
+ASSISTANT_RUN_DEADLINE = float(os.getenv("ASSISTANT_RUN_DEADLINE", "60"))
 client = OpenAI(api_key=OPENAI_API_KEY)
 
+# Stream events of runs that ended without completing
+FAILED_RUN_EVENTS = frozenset(
+    [
+        "thread.run.failed",
+        "thread.run.expired",
+        "thread.run.cancelled",
+        "thread.run.incomplete",
+    ]
+)
+
+
+class AssistantRunError(Exception):
+    """An assistant run failed, expired, was cancelled or missed its deadline."""
+
 
 def upload_file(path):
     # Upload a file with an "assistants" purpose
@@ -44,55 +64,130 @@ def store_thread(wa_id, thread_id):
         threads_shelf[wa_id] = thread_id
 
 
-def run_assistant(thread, name):
-    # Retrieve the Assistant
-    assistant = client.beta.assistants.retrieve(OPENAI_ASSISTANT_ID)
+@lru_cache(maxsize=1)
+def get_assistant():
+    # The assistant definition doesn't change while the process runs
+    return client.beta.assistants.retrieve(OPENAI_ASSISTANT_ID)
+
 
-    # Run the assistant
-    run = client.beta.threads.runs.create(
-        thread_id=thread.id,
-        assistant_id=assistant.id,
-        # instructions=f"You are having a conversation with {name}",
+def _tool_outputs(tool_calls, products):
+    # Every call needs an output, or the run can't continue
+    outputs = []
+    for call in tool_calls:
+        outcome = "failure"
+        if call.function.name == "get_product":
+            try:
+                products.append(json.loads(call.function.arguments)["product_name"])
+                outcome = "success"
+            except (ValueError, KeyError, TypeError):
+                pass
+        outputs.append({"tool_call_id": call.id, "output": outcome})
+    return outputs
+
+
+def _message_text(message):
+    return next(
+        (block.text.value for block in message.content if block.type == "text"), None
     )
+
+
+def _cancel_run(thread_id, run_id):
+    # A thread with an active run doesn't accept new messages
+    try:
+        client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run_id)
+    except OpenAIError:
+        logging.exception(f"Failed to cancel run {run_id}")
+
+
+def run_assistant(thread, name, deadline=ASSISTANT_RUN_DEADLINE):
+    """
+    Run the assistant on the thread and return its reply.
+
+    The run is consumed as a stream of events rather than polled: tool calls
+    are answered as soon as the run asks for them, and the reply is taken
+    from the completed message event.
+
+    :raises AssistantRunError: If the run failed, expired or was cancelled,
+        or didn't finish within `deadline` seconds, in which case it is
+        cancelled.
+    """
+    start = time.monotonic()
+    expires_at = start + deadline
+    outcome = "failed"
+
+    def remaining():
+        nonlocal outcome
+        left = expires_at - time.monotonic()
+        if left <= 0:
+            outcome = "timeout"
+            raise AssistantRunError(f"Run didn't finish within {deadline}s")
+        return left
+
     products = []
-    tool_outcome = []
-
-    # Wait for completion
-    # https://platform.openai.com/docs/assistants/how-it-works/runs-and-run-steps#:~:text=under%20failed_at.-,Polling%20for%20updates,-In%20order%20to
-    while run.status != "completed":
-        # Be nice to the API
-        time.sleep(0.25)
-        logging.info(run.status)
-        if run.status == "requires_action":
-            logging.info("ACTION REQUIRED")
-            tool_calls = run.required_action.submit_tool_outputs.tool_calls
-            call_ids = [x.id for x in tool_calls]
-            for call in tool_calls:
-                if call.function.name == "get_product":
-                    try:
-                        products.append(
-                            json.loads(call.function.arguments)["product_name"]
+    new_message = None
+    run_id = None
+    try:
+        # Run the assistant
+        stream = client.beta.threads.runs.create(
+            thread_id=thread.id,
+            assistant_id=get_assistant().id,
+            # instructions=f"You are having a conversation with {name}",
+            stream=True,
+            timeout=remaining(),
+        )
+        while stream is not None:
+            events, stream = stream, None
+            with events:
+                for event in events:
+                    if event.event == "thread.run.created":
+                        run_id = event.data.id
+                    elif event.event == "thread.run.requires_action":
+                        logging.info("ACTION REQUIRED")
+                        run_id = event.data.id
+                        action = event.data.required_action
+                        tool_calls = action.submit_tool_outputs.tool_calls
+                        stream = client.beta.threads.runs.submit_tool_outputs(
+                            thread_id=thread.id,
+                            run_id=run_id,
+                            tool_outputs=_tool_outputs(tool_calls, products),
+                            stream=True,
+                            timeout=remaining(),
+                        )
+                        break
+                    elif event.event == "thread.message.completed":
+                        new_message = _message_text(event.data)
+                    elif event.event == "thread.run.completed":
+                        outcome = "completed"
+                    elif event.event in FAILED_RUN_EVENTS:
+                        run_id = None
+                        raise AssistantRunError(
+                            f"Run {event.data.id} {event.data.status}: "
+                            f"{event.data.last_error or event.data.incomplete_details}"
                         )
-                        tool_outcome.append("success")
-                    except:
-                        tool_outcome.append("failure")
-            run = client.beta.threads.runs.submit_tool_outputs(
-                thread_id=thread.id,
-                run_id=run.id,
-                tool_outputs=[
-                    {
-                        "tool_call_id": call_ids[i],
-                        "output": tool_outcome[i],
-                    }
-                    for i in range(len(call_ids))
-                ],
-            )
-        else:
-            run = client.beta.threads.runs.retrieve(thread_id=thread.id, run_id=run.id)
-    logging.info(f"Run: {run}")
-    # Retrieve the Messages
-    messages = client.beta.threads.messages.list(thread_id=thread.id)
-    new_message = messages.data[0].content[0].text.value
+                    elif event.event == "error":
+                        raise AssistantRunError(event.data.message)
+                    if outcome != "completed":
+                        remaining()
+        if outcome != "completed":
+            raise AssistantRunError("Run stream ended before the run completed")
+    except (APITimeoutError, httpx.TimeoutException) as e:
+        # The latter is raised by reads that stall mid-stream
+        outcome = "timeout"
+        if run_id is not None:
+            _cancel_run(thread.id, run_id)
+        raise AssistantRunError(f"Run didn't finish within {deadline}s") from e
+    except AssistantRunError:
+        if run_id is not None and outcome != "completed":
+            _cancel_run(thread.id, run_id)
+        raise
+    finally:
+        METRICS.incr(f"assistant.runs.{outcome}")
+        METRICS.observe("assistant.run_seconds", time.monotonic() - start)
+
+    if new_message is None:
+        # Only possible if the reply had no text; read it back from the thread
+        messages = client.beta.threads.messages.list(thread_id=thread.id, limit=1)
+        new_message = _message_text(messages.data[0])
     logging.info(f"Generated message: {new_message}")
     logging.info(f"Products: {products}")
     return {"new_message": new_message, "products": products}
@@ -0,0 +1,248 @@
+import logging
+import queue
+import random
+import sqlite3
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+import requests
+
+from app.utils.metrics import METRICS
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled at `rate` tokens per second.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available and take it."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated_at) * self.rate
+                )
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class DeadLetterStore:
+    """
+    SQLite table of outbound messages that exhausted their retries.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS dead_letters ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, recipient TEXT, "
+                "payload BLOB NOT NULL, error TEXT, attempts INTEGER, "
+                "failed_at REAL NOT NULL)"
+            )
+
+    def add(self, recipient, payload, error, attempts):
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO dead_letters "
+                "(recipient, payload, error, attempts, failed_at) VALUES (?, ?, ?, ?, ?)",
+                (recipient, payload, error, attempts, time.time()),
+            )
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM dead_letters").fetchone()[0]
+
+
+def _retry_after_seconds(response):
+    """Parse a Retry-After header given either in seconds or as an HTTP date."""
+    if response is None:
+        return None
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_retriable(error):
+    if isinstance(error, (requests.Timeout, requests.ConnectionError)):
+        return True
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        return status == 429 or status >= 500
+    return False
+
+
+class OutboundDispatcher:
+    """
+    Rate-limited outbound send queue for the Graph API.
+
+    Messages are queued in one lane per recipient. A lane is only ever drained
+    by one worker at a time, so messages within a chat are delivered in order
+    while different chats are sent concurrently.
+
+    Messages are sent by background workers at most `rate` per second (the
+    phone number's messages-per-second tier). 429s, 5xx responses, timeouts and
+    connection errors are retried with exponential backoff and full jitter,
+    honouring Retry-After when the API sends one. Messages that exhaust their
+    retries, or fail with a non-retriable error, go to the dead-letter store.
+    """
+
+    def __init__(
+        self,
+        client,
+        dead_letters,
+        rate=80,
+        burst=None,
+        workers=8,
+        max_retries=5,
+        base_delay=0.5,
+        max_delay=30.0,
+    ):
+        self.client = client
+        self.dead_letters = dead_letters
+        self.bucket = TokenBucket(rate, burst)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # recipient -> deque of payloads; a lane stays registered while a worker
+        # is sending from it so new messages queue behind the in-flight one
+        self._lanes = {}
+        self._ready = queue.Queue()
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(
+                target=self._worker, name=f"outbound-worker-{i}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+        METRICS.register_gauge("outbound.queue_depth", lambda: self._pending)
+        METRICS.register_gauge("outbound.active_lanes", lambda: len(self._lanes))
+
+    def submit(self, data, recipient=None, on_rejected=None):
+        """
+        Queue a serialized message payload for delivery.
+
+        :param recipient: The wa_id the message is for; messages with the same
+                          recipient are delivered in submission order.
+        :param on_rejected: Called once if the API rejects the payload with a
+                            non-retriable error; may return a replacement
+                            payload to send instead (e.g. with a new media id).
+        """
+        with self._lock:
+            lane = self._lanes.get(recipient)
+            if lane is None:
+                self._lanes[recipient] = deque([(data, on_rejected)])
+                self._ready.put(recipient)
+            else:
+                lane.append((data, on_rejected))
+            self._pending += 1
+        METRICS.incr("outbound.enqueued")
+
+    def join(self):
+        """Block until every queued message was sent or dead-lettered."""
+        with self._idle:
+            self._idle.wait_for(lambda: self._pending == 0)
+
+    def _worker(self):
+        while True:
+            recipient = self._ready.get()
+            with self._lock:
+                data, on_rejected = self._lanes[recipient].popleft()
+            try:
+                self.deliver(data, recipient, on_rejected)
+            except Exception:
+                logging.exception("Unexpected error in outbound worker")
+            finally:
+                with self._lock:
+                    if self._lanes[recipient]:
+                        self._ready.put(recipient)
+                    else:
+                        del self._lanes[recipient]
+                    self._pending -= 1
+                    if self._pending == 0:
+                        self._idle.notify_all()
+
+    def backoff_delay(self, attempt, error):
+        retry_after = _retry_after_seconds(getattr(error, "response", None))
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    def deliver(self, data, recipient=None, on_rejected=None):
+        """
+        Send one payload, retrying as needed.
+
+        :param on_rejected: See submit.
+
+        :return: The Graph API response, or None if the message was dead-lettered.
+        """
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            started_at = time.monotonic()
+            try:
+                response = self.client.post_message(data)
+            except requests.RequestException as e:
+                METRICS.observe("outbound.send_seconds", time.monotonic() - started_at)
+                if on_rejected is not None and not _is_retriable(e):
+                    replacement, on_rejected = on_rejected(), None
+                    if replacement is not None:
+                        logging.warning(f"Message rejected ({e}), sending a rebuilt payload")
+                        METRICS.incr("outbound.rebuilt")
+                        data = replacement
+                        continue
+                if not _is_retriable(e) or attempt >= self.max_retries:
+                    logging.error(f"Giving up on message after {attempt + 1} attempts: {e}")
+                    self.dead_letters.add(recipient, data, str(e), attempt + 1)
+                    METRICS.incr("outbound.dead_lettered")
+                    return None
+                delay = self.backoff_delay(attempt, e)
+                logging.warning(f"Send failed ({e}), retrying in {delay:.2f}s")
+                METRICS.incr("outbound.retries")
+                attempt += 1
+                time.sleep(delay)
+            else:
+                METRICS.observe("outbound.send_seconds", time.monotonic() - started_at)
+                METRICS.incr("outbound.sent")
+                logging.debug(f"Status: {response.status_code}, Body: {response.text}")
+                return response
+
+    @classmethod
+    def from_config(cls, client, config):
+        return cls(
+            client,
+            DeadLetterStore(config["DEAD_LETTER_PATH"]),
+            rate=config["OUTBOUND_RATE"],
+            burst=config["OUTBOUND_BURST"],
+            workers=config["OUTBOUND_WORKERS"],
+            max_retries=config["OUTBOUND_MAX_RETRIES"],
+        )
@@ -0,0 +1,251 @@
+import hashlib
+import logging
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+import chromadb
+import numpy as np
+
+from app.utils.metrics import METRICS
+from app.utils.text import normalize_text
+
+_WORD = re.compile(r"\w+")
+_NUMBER = re.compile(r"\d+(?:[.,]\d+)*")
+
+# Words that point back at earlier turns ("cuánto cuesta eso?", "y el envío?"),
+# matched against normalized text: anywhere, or as the first word
+FOLLOW_UP_WORDS = frozenset(
+    ["eso", "esos", "esas", "ese", "aquel", "aquella", "mismo", "misma", "mismos",
+     "mismas", "igual", "anterior", "otro", "otra", "otros", "otras", "ellos",
+     "ellas", "lo", "le", "les", "that", "those", "it", "them", "same"]
+)
+FOLLOW_UP_OPENERS = frozenset(
+    ["y", "e", "pero", "entonces", "tambien", "ademas", "ok", "va", "si", "no",
+     "and", "also", "so", "but"]
+)
+# Words about the customer themselves or their orders
+PERSONAL_WORDS = frozenset(
+    ["mi", "mis", "mio", "mia", "yo", "pedido", "orden", "nombre", "correo",
+     "telefono", "direccion", "my", "order"]
+)
+# Email addresses, and 7+ digits in a row or split by spaces, dashes or
+# parentheses (phone or order numbers, but not prices like 12500.00)
+_PERSONAL_DATA = re.compile(r"\S+@\S+|\d(?:[ ()-]?\d){6,}")
+
+
+def _numbers(normalized: str) -> str:
+    # Quantities and sizes must match exactly: "2000 recetas" and "3000 recetas"
+    # are lexically almost identical but have different answers
+    return " ".join(sorted(_NUMBER.findall(normalized)))
+
+
+class HashingEmbeddingFunction:
+    """
+    Local embedding function: word and character trigram features hashed into
+    a fixed size, L2-normalized vector.
+
+    It needs no model download or API call, so the semantic cache works
+    offline. It captures lexical similarity (reworded questions, typos, word
+    order), not meaning; pass a model-backed embedding function for that.
+    """
+
+    def __init__(self, dimensions: int = 512):
+        self.dimensions = dimensions
+
+    def _features(self, text):
+        for word in _WORD.findall(text):
+            yield "w:" + word
+            padded = f" {word} "
+            for i in range(len(padded) - 2):
+                yield padded[i : i + 3]
+
+    def __call__(self, input: list[str]) -> list[list[float]]:
+        vectors = np.zeros((len(input), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(input):
+            for feature in self._features(text):
+                # crc32 is stable across processes, unlike hash()
+                vectors[row, zlib.crc32(feature.encode()) % self.dimensions] += 1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (vectors / norms).tolist()
+
+
+class ResponseCache:
+    """
+    Two-tier cache of chatbot replies to standalone questions.
+
+    Only questions that pass `is_cacheable` are looked up or stored; callers
+    are expected to also only use it for the first question of a conversation
+    (see OpenAIChatbot), since later replies depend on the history.
+
+    The exact tier is an LRU dict keyed by the normalized question. The
+    semantic tier is a chromadb collection queried by embedding; a stored
+    reply is reused when its question's cosine similarity is at least
+    `threshold` and both mention the same numbers. Every entry expires after
+    `ttl_seconds` and is tagged with the catalog version it was generated for,
+    so changing the catalog (see `set_catalog_version`) invalidates replies
+    quoting old prices.
+
+    :param path: Directory for a persistent chromadb store, or None to keep
+        the semantic tier in memory.
+    :param embedding_function: Callable mapping a list of texts to a list of
+        vectors. Defaults to HashingEmbeddingFunction.
+    """
+
+    COLLECTION_NAME = "response_cache"
+
+    def __init__(
+        self,
+        catalog_version: str,
+        path: str | None = None,
+        threshold: float = 0.88,
+        ttl_seconds: float = 3600,
+        max_exact: int = 10000,
+        min_length: int = 12,
+        embedding_function=None,
+    ):
+        self.catalog_version = catalog_version
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_exact = max_exact
+        self.min_length = min_length
+        self.embedding_function = embedding_function or HashingEmbeddingFunction()
+        self._exact = OrderedDict()
+        self._lock = threading.Lock()
+
+        client = (
+            chromadb.PersistentClient(path=path)
+            if path
+            else chromadb.EphemeralClient()
+        )
+        # Embeddings are computed here, so chromadb's default model is never loaded
+        self._collection = client.get_or_create_collection(
+            self.COLLECTION_NAME,
+            embedding_function=None,
+            metadata={"hnsw:space": "cosine"},
+        )
+        self._purge_other_versions()
+
+    def is_cacheable(self, normalized: str) -> bool:
+        """
+        Whether a normalized question has the same answer for every customer:
+        long enough to stand on its own ("si" or "2000" only make sense in
+        context), with no follow-up cues and nothing about the customer.
+        """
+        if len(normalized) < self.min_length or _PERSONAL_DATA.search(normalized):
+            return False
+        words = _WORD.findall(normalized)
+        # Punctuation or symbols only, nothing to answer the same way twice
+        if not words or words[0] in FOLLOW_UP_OPENERS:
+            return False
+        words = set(words)
+        return not (words & FOLLOW_UP_WORDS or words & PERSONAL_WORDS)
+
+    def get(self, text: str) -> str | None:
+        """Return a cached reply for the question, or None."""
+        key = normalize_text(text)
+        if not self.is_cacheable(key):
+            return None
+        now = time.time()
+
+        with self._lock:
+            entry = self._exact.get(key)
+            if entry is not None:
+                response, expires_at = entry
+                if expires_at > now:
+                    self._exact.move_to_end(key)
+                    METRICS.incr("response_cache.exact_hits")
+                    return response
+                del self._exact[key]
+
+        response = self._semantic_get(key, now)
+        if response is None:
+            METRICS.incr("response_cache.misses")
+            return None
+        METRICS.incr("response_cache.semantic_hits")
+        self._exact_put(key, response, now + self.ttl_seconds)
+        return response
+
+    def _semantic_get(self, key, now):
+        try:
+            result = self._collection.query(
+                query_embeddings=self.embedding_function([key]),
+                n_results=1,
+                where={
+                    "$and": [
+                        {"catalog_version": self.catalog_version},
+                        {"numbers": _numbers(key)},
+                        {"expires_at": {"$gt": now}},
+                    ]
+                },
+                include=["metadatas", "distances"],
+            )
+        except Exception:
+            logging.exception("Semantic cache lookup failed")
+            return None
+        if not result["ids"][0]:
+            return None
+        # cosine distance is 1 - cosine similarity
+        if 1.0 - result["distances"][0][0] < self.threshold:
+            return None
+        return result["metadatas"][0][0]["response"]
+
+    def put(self, text: str, response: str):
+        """Cache the reply to a question."""
+        key = normalize_text(text)
+        if not self.is_cacheable(key) or not response:
+            return
+        if _PERSONAL_DATA.search(response):
+            # e.g. a reply that repeats the customer's phone number
+            return
+        expires_at = time.time() + self.ttl_seconds
+        self._exact_put(key, response, expires_at)
+        try:
+            self._collection.upsert(
+                ids=[hashlib.sha1(f"{self.catalog_version}:{key}".encode()).hexdigest()],
+                embeddings=self.embedding_function([key]),
+                documents=[key],
+                metadatas=[
+                    {
+                        "response": response,
+                        "catalog_version": self.catalog_version,
+                        "numbers": _numbers(key),
+                        "expires_at": expires_at,
+                    }
+                ],
+            )
+        except Exception:
+            logging.exception("Failed to store reply in the semantic cache")
+
+    def _exact_put(self, key, response, expires_at):
+        with self._lock:
+            self._exact[key] = (response, expires_at)
+            self._exact.move_to_end(key)
+            while len(self._exact) > self.max_exact:
+                self._exact.popitem(last=False)
+
+    def set_catalog_version(self, catalog_version: str):
+        """Drop every reply generated for a different catalog version."""
+        if catalog_version == self.catalog_version:
+            return
+        with self._lock:
+            self.catalog_version = catalog_version
+            self._exact.clear()
+        self._purge_other_versions()
+        METRICS.incr("response_cache.invalidations")
+
+    def _purge_other_versions(self):
+        try:
+            self._collection.delete(
+                where={
+                    "$or": [
+                        {"catalog_version": {"$ne": self.catalog_version}},
+                        {"expires_at": {"$lte": time.time()}},
+                    ]
+                }
+            )
+        except Exception:
+            logging.exception("Failed to purge the semantic cache")
@@ -0,0 +1,114 @@
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from langchain.memory import ChatMessageHistory
+from langchain_core.messages import messages_from_dict, messages_to_dict
+
+from app.utils import jsonlib
+from app.utils.metrics import METRICS
+
+
+class _Session:
+    __slots__ = ("bot", "lock", "pins")
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.lock = threading.Lock()
+        self.pins = 0
+
+
+class SessionManager:
+    """
+    Per-customer chatbot sessions keyed by wa_id.
+
+    Sessions are created lazily by `factory(chat_history)`, where chat_history
+    is None for a brand new customer. At most `max_sessions` stay resident; the
+    least recently used ones are spilled to SQLite and transparently restored on
+    the customer's next message.
+    """
+
+    def __init__(self, factory, store_path, max_sessions=1000):
+        self.factory = factory
+        self.store_path = store_path
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(store_path, check_same_thread=False, timeout=5)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS chat_sessions ("
+                "wa_id TEXT PRIMARY KEY, messages BLOB NOT NULL, updated_at REAL NOT NULL)"
+            )
+        METRICS.register_gauge("sessions.resident", lambda: len(self._sessions))
+
+    @contextmanager
+    def session(self, wa_id):
+        """
+        Yield the chatbot for `wa_id`, holding its lock for the whole turn.
+
+        A session in use is pinned and never evicted.
+        """
+        with self._lock:
+            entry = self._sessions.get(wa_id)
+            if entry is None:
+                entry = self._sessions[wa_id] = _Session(self._load(wa_id))
+                self._evict()
+            else:
+                self._sessions.move_to_end(wa_id)
+                METRICS.incr("sessions.hits")
+            entry.pins += 1
+        try:
+            with entry.lock:
+                yield entry.bot
+        finally:
+            with self._lock:
+                entry.pins -= 1
+
+    def _load(self, wa_id):
+        # Called with self._lock held
+        row = self._conn.execute(
+            "SELECT messages FROM chat_sessions WHERE wa_id = ?", (wa_id,)
+        ).fetchone()
+        if row is None:
+            METRICS.incr("sessions.created")
+            return self.factory(None)
+        with self._conn:
+            self._conn.execute("DELETE FROM chat_sessions WHERE wa_id = ?", (wa_id,))
+        METRICS.incr("sessions.restored")
+        messages = messages_from_dict(jsonlib.loads(row[0]))
+        return self.factory(ChatMessageHistory(messages=messages))
+
+    def _evict(self):
+        # Called with self._lock held
+        if len(self._sessions) <= self.max_sessions:
+            return
+        for wa_id in list(self._sessions):
+            if len(self._sessions) <= self.max_sessions:
+                break
+            entry = self._sessions[wa_id]
+            if entry.pins:
+                continue
+            del self._sessions[wa_id]
+            self._spill(wa_id, entry.bot)
+            METRICS.incr("sessions.evicted")
+
+    def _spill(self, wa_id, bot):
+        payload = jsonlib.dumps(messages_to_dict(bot.chat_history.messages))
+        try:
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO chat_sessions VALUES (?, ?, ?)",
+                    (wa_id, payload, time.time()),
+                )
+        except sqlite3.Error:
+            logging.exception(f"Failed to spill session {wa_id}")
+
+    def flush(self):
+        """Persist every resident session, e.g. at shutdown."""
+        with self._lock:
+            for wa_id, entry in self._sessions.items():
+                self._spill(wa_id, entry.bot)
@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable
+
+from langchain_core.messages import ToolMessage
+
+from app.schemas.catalog import Catalog
+from app.utils import jsonlib
+from app.utils.metrics import METRICS
+
+
+@dataclass(frozen=True, slots=True)
+class ToolHandler:
+    """
+    A registered tool.
+
+    :param fn: Called as fn(catalog, **args) and returns the result text.
+    :param return_direct: Use the result as the reply to the customer instead
+        of sending it back to the model for another turn.
+    :param cacheable: Results only depend on the arguments and the catalog.
+    """
+
+    fn: Callable[..., str]
+    return_direct: bool = False
+    cacheable: bool = True
+
+
+@dataclass(frozen=True, slots=True)
+class ToolResult:
+    message: ToolMessage
+    return_direct: bool
+
+
+class ToolExecutor:
+    """
+    Runs the tool calls of a model response.
+
+    Independent calls run concurrently on a bounded thread pool. Results of
+    cacheable tools are memoized per (tool, arguments, catalog version) for
+    `cache_ttl` seconds. Unknown tools and handler errors are reported back to
+    the model as error ToolMessages rather than dropped.
+    """
+
+    def __init__(self, max_workers: int = 4, cache_ttl: float = 300, max_cache: int = 1024):
+        self.cache_ttl = cache_ttl
+        self.max_cache = max_cache
+        self._handlers = {}
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tools")
+
+    def register(self, name: str, fn, return_direct: bool = False, cacheable: bool = True):
+        self._handlers[name] = ToolHandler(fn, return_direct, cacheable)
+
+    def _cache_key(self, call, catalog):
+        args = jsonlib.dumps(dict(sorted(call["args"].items())))
+        return (call["name"], args, catalog.version)
+
+    def _cached(self, key):
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            result, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+            return result
+
+    def _store(self, key, result):
+        with self._lock:
+            self._cache[key] = (result, time.monotonic() + self.cache_ttl)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_cache:
+                self._cache.popitem(last=False)
+
+    def _execute(self, call, catalog: Catalog) -> ToolResult:
+        name = call["name"]
+        handler = self._handlers.get(name)
+        if handler is None:
+            logging.warning(f"Model called unknown tool {name}")
+            METRICS.incr("tools.unknown")
+            return ToolResult(
+                ToolMessage(
+                    content=f"Error: la herramienta {name} no existe.",
+                    tool_call_id=call["id"],
+                    status="error",
+                ),
+                False,
+            )
+
+        key = self._cache_key(call, catalog) if handler.cacheable else None
+        content = self._cached(key) if key is not None else None
+        if content is not None:
+            METRICS.incr(f"tools.{name}.cache_hits")
+        else:
+            start = time.perf_counter()
+            try:
+                content = handler.fn(catalog, **call["args"])
+            except Exception as e:
+                logging.exception(f"Tool {name} failed")
+                METRICS.incr(f"tools.{name}.errors")
+                return ToolResult(
+                    ToolMessage(
+                        content=f"Error: {e}", tool_call_id=call["id"], status="error"
+                    ),
+                    False,
+                )
+            finally:
+                METRICS.observe_histogram(
+                    f"tools.{name}.seconds", time.perf_counter() - start
+                )
+            if key is not None:
+                self._store(key, content)
+        return ToolResult(
+            ToolMessage(content=content, tool_call_id=call["id"], name=name),
+            handler.return_direct,
+        )
+
+    def run(self, tool_calls, catalog: Catalog) -> list[ToolResult]:
+        """Execute the calls, concurrently if there's more than one."""
+        if len(tool_calls) == 1:
+            return [self._execute(tool_calls[0], catalog)]
+        futures = [self._pool.submit(self._execute, call, catalog) for call in tool_calls]
+        return [future.result() for future in futures]
+
+    async def arun(self, tool_calls, catalog: Catalog) -> list[ToolResult]:
+        # Same as run, without blocking the event loop
+        loop = asyncio.get_running_loop()
+        return await asyncio.gather(
+            *(
+                loop.run_in_executor(self._pool, self._execute, call, catalog)
+                for call in tool_calls
+            )
+        )
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
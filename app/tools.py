@@ -1,19 +1,127 @@
-from langchain_core.pydantic_v1 import BaseModel, Field
+import math
+import threading
 
-from app.schemas.catalogs import bulle_pan_y_cafe
+from langchain_core.messages import SystemMessage
+from langchain_core.utils.function_calling import convert_to_openai_tool
 
-product_names = [x.item_name for x in bulle_pan_y_cafe.items]
-product_names_str = ", ".join(product_names)
+from app.schemas.catalog import Catalog
+from app.services.context import TokenCounter
+from app.services.intent_router import option_prompt
+from app.utils import jsonlib
+from app.utils.text import key_words
 
+PRODUCT_SEARCH_TOOL = "product_search"
 
-# Note that the docstrings here are crucial, as they will be passed along
-# to the model along with the class name.
-class GetProductInfo(BaseModel):
-    f"""Fetch information about a product. Possible Products are: {product_names_str}"""
 
-    product_name: str = Field(..., description="The product name")
+def build_tools(catalog: Catalog) -> list[dict]:
+    """
+    Tool definitions for the chatbot, generated from the catalog.
 
-def create_produc
+    The schemas don't list the catalog's products: they are sent with every
+    request, so they stay small and identical from turn to turn. The products
+    relevant to each message are provided by ItemRetriever instead.
+    """
+    return [
+        {
+            "type": "function",
+            "function": {
+                "name": PRODUCT_SEARCH_TOOL,
+                "description": (
+                    f"Obtiene las opciones de un producto de {catalog.catalog_name} "
+                    "para cotizarlo."
+                ),
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "item_id": {
+                            "type": "integer",
+                            "description": "item_id de la lista de productos relevantes",
+                        }
+                    },
+                    "required": ["item_id"],
+                },
+            },
+        }
+    ]
 
 
-TOOLS = [GetProductInfo]
+def product_search(catalog: Catalog, item_id: int) -> str:
+    """Options of an item, phrased as the questions needed to quote it."""
+    item = catalog.get_item_by_id(int(item_id))
+    if item is None:
+        raise ValueError(f"No existe un producto con item_id {item_id}")
+    return option_prompt(item)
+
+
+def register_tools(executor):
+    """Register the handlers of every tool in build_tools."""
+    # The option questions are the reply itself, no follow-up model call needed
+    executor.register(PRODUCT_SEARCH_TOOL, product_search, return_direct=True)
+
+
+def count_tool_tokens(tools, counter: TokenCounter) -> int:
+    """Approximate prompt tokens the tool schemas add to every request."""
+    return sum(
+        counter.count_text(jsonlib.dumps(convert_to_openai_tool(tool)).decode())
+        for tool in tools
+    )
+
+
+class ItemRetriever:
+    """
+    Picks the catalog items relevant to a message, so the model only sees the
+    top `k` products instead of the whole catalog.
+
+    Items are scored by IDF-weighted overlap between the message's words and
+    the item's name (weighted double), category and description. Catalogs
+    with at most `k` items are always listed in full.
+    """
+
+    def __init__(self, catalog: Catalog, k: int = 5):
+        self.k = k
+        self._lock = threading.Lock()
+        self.set_catalog(catalog)
+
+    def set_catalog(self, catalog: Catalog):
+        """Rebuild the index, e.g. after the catalog is reloaded."""
+        postings = {}
+        for item in catalog.items:
+            weights = dict.fromkeys(
+                key_words(f"{item.item_category or ''} {item.item_description or ''}"),
+                1.0,
+            )
+            weights.update(dict.fromkeys(key_words(item.item_name), 2.0))
+            for word, weight in weights.items():
+                postings.setdefault(word, []).append((item, weight))
+        n_items = max(len(catalog.items), 1)
+        index = {
+            word: [
+                (item, weight * math.log(1 + n_items / len(items)))
+                for item, weight in items
+            ]
+            for word, items in postings.items()
+        }
+        # Swapped in together so readers never mix two catalogs
+        with self._lock:
+            self.catalog, self._index = catalog, index
+
+    def top_items(self, text: str):
+        with self._lock:
+            catalog, index = self.catalog, self._index
+        if len(catalog.items) <= self.k:
+            return list(catalog.items)
+        scores = {}
+        for word in key_words(text):
+            for item, weight in index.get(word, ()):
+                scores[item.id] = scores.get(item.id, 0.0) + weight
+        ranked = sorted(scores, key=scores.get, reverse=True)[: self.k]
+        return [catalog.get_item_by_id(item_id) for item_id in ranked]
+
+    def context_message(self, text: str) -> SystemMessage | None:
+        """System message listing the products relevant to `text`, if any."""
+        items = self.top_items(text)
+        if not items:
+            return None
+        lines = ["Productos relevantes (item_id: nombre):"]
+        lines.extend(f"{item.id}: {item.item_name}" for item in items)
+        return SystemMessage(content="\n".join(lines))
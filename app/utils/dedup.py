@@ -0,0 +1,121 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from app.utils.metrics import METRICS
+
+
+class MessageDeduplicator:
+    """
+    Bounded TTL/LRU seen-set of WhatsApp message ids.
+
+    Meta redelivers webhooks on timeouts and 5xx responses; remembering the ids
+    we already handled lets us skip the duplicate LLM turn and reply.
+    """
+
+    def __init__(self, max_size=10000, ttl_seconds=24 * 60 * 60):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+
+    def seen(self, message_id):
+        """
+        Record `message_id` and return True if it was already seen within the TTL.
+        """
+        now = time.time()
+        with self._lock:
+            seen_at = self._seen.get(message_id)
+            if seen_at is not None and now - seen_at < self.ttl_seconds:
+                self._seen.move_to_end(message_id)
+                self.hits += 1
+                METRICS.incr("dedup.hits")
+                return True
+            self._seen[message_id] = now
+            self._seen.move_to_end(message_id)
+            while len(self._seen) > self.max_size:
+                self._seen.popitem(last=False)
+            self.misses += 1
+            METRICS.incr("dedup.misses")
+            return False
+
+    def forget(self, message_id):
+        """
+        Drop `message_id`, e.g. when it couldn't be processed, so Meta's
+        redelivery of it is handled instead of skipped.
+        """
+        with self._lock:
+            self._seen.pop(message_id, None)
+        METRICS.incr("dedup.forgotten")
+
+
+class SQLiteMessageDeduplicator(MessageDeduplicator):
+    """
+    SQLite-backed seen-set so several gunicorn workers share the same view.
+    """
+
+    def __init__(self, path, max_size=10000, ttl_seconds=24 * 60 * 60):
+        super().__init__(max_size=max_size, ttl_seconds=ttl_seconds)
+        self.path = path
+        self._local = threading.local()
+        self._inserts = 0
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS seen_messages "
+                "(id TEXT PRIMARY KEY, seen_at REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def seen(self, message_id):
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            # Claim the id atomically; an expired row is reclaimed in place.
+            cursor = conn.execute(
+                "INSERT INTO seen_messages (id, seen_at) VALUES (?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET seen_at = excluded.seen_at "
+                "WHERE seen_messages.seen_at < ?",
+                (message_id, now, now - self.ttl_seconds),
+            )
+            is_duplicate = cursor.rowcount == 0
+        prune = False
+        with self._lock:
+            if is_duplicate:
+                self.hits += 1
+            else:
+                self.misses += 1
+                self._inserts += 1
+                prune = self._inserts % 1000 == 0
+        METRICS.incr("dedup.hits" if is_duplicate else "dedup.misses")
+        if not is_duplicate and prune:
+            self._prune(conn, now)
+        return is_duplicate
+
+    def forget(self, message_id):
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM seen_messages WHERE id = ?", (message_id,))
+        METRICS.incr("dedup.forgotten")
+
+    def _prune(self, conn, now):
+        with conn:
+            conn.execute(
+                "DELETE FROM seen_messages WHERE seen_at < ?",
+                (now - self.ttl_seconds,),
+            )
+            conn.execute(
+                "DELETE FROM seen_messages WHERE id NOT IN "
+                "(SELECT id FROM seen_messages ORDER BY seen_at DESC LIMIT ?)",
+                (self.max_size,),
+            )
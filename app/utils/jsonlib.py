@@ -0,0 +1,32 @@
+import json
+
+# orjson is an optional, faster drop-in for the webhook and send hot paths.
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+
+if orjson is not None:
+    JSONDecodeError = orjson.JSONDecodeError
+
+    def loads(data):
+        """Parse JSON from bytes or str."""
+        return orjson.loads(data)
+
+    def dumps(obj):
+        """Serialize `obj` to compact UTF-8 JSON bytes."""
+        return orjson.dumps(obj)
+
+else:
+    JSONDecodeError = json.JSONDecodeError
+
+    def loads(data):
+        """Parse JSON from bytes or str."""
+        return json.loads(data)
+
+    def dumps(obj):
+        """Serialize `obj` to compact UTF-8 JSON bytes."""
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode(
+            "utf-8"
+        )
@@ -0,0 +1,105 @@
+import bisect
+import threading
+from collections import deque
+
+# Upper bounds (seconds) of the latency histogram buckets, plus +Inf
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _percentile(window, q):
+    if not window:
+        return None
+    return window[int(q * (len(window) - 1))]
+
+
+class MetricsRegistry:
+    """
+    Minimal in-process metrics registry.
+
+    Counters are monotonically increasing integers, gauges are callables that
+    are evaluated when a snapshot is taken, and timings keep a bounded window
+    of recent samples so that percentiles can be reported cheaply. Histograms
+    count every sample into fixed latency buckets.
+    """
+
+    def __init__(self, max_samples=2048):
+        self._lock = threading.Lock()
+        self._max_samples = max_samples
+        self._counters = {}
+        self._gauges = {}
+        self._timings = {}
+        self._histograms = {}
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def register_gauge(self, name, fn):
+        with self._lock:
+            self._gauges[name] = fn
+
+    def observe(self, name, value):
+        with self._lock:
+            samples = self._timings.get(name)
+            if samples is None:
+                samples = self._timings[name] = [0, 0.0, deque(maxlen=self._max_samples)]
+            samples[0] += 1
+            samples[1] += value
+            samples[2].append(value)
+
+    def observe_histogram(self, name, value, buckets=LATENCY_BUCKETS):
+        """Record a timing sample and count it into a bucket of `buckets`."""
+        self.observe(name, value)
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = (buckets, [0] * (len(buckets) + 1))
+            histogram[1][bisect.bisect_left(histogram[0], value)] += 1
+
+    def counter(self, name):
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def timing_count(self, name):
+        with self._lock:
+            samples = self._timings.get(name)
+            return samples[0] if samples else 0
+
+    def percentile(self, name, q):
+        with self._lock:
+            samples = self._timings.get(name)
+            window = sorted(samples[2]) if samples else []
+        return _percentile(window, q)
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            timings = {
+                name: (count, total, sorted(window))
+                for name, (count, total, window) in self._timings.items()
+            }
+            histograms = {
+                name: dict(zip([str(b) for b in buckets] + ["+Inf"], counts))
+                for name, (buckets, counts) in self._histograms.items()
+            }
+
+        summary = {}
+        for name, (count, total, window) in timings.items():
+            summary[name] = {
+                "count": count,
+                "mean": total / count if count else 0.0,
+                "p50": _percentile(window, 0.50),
+                "p95": _percentile(window, 0.95),
+                "max": window[-1] if window else None,
+            }
+
+        return {
+            "counters": counters,
+            "gauges": {name: fn() for name, fn in gauges.items()},
+            "timings": summary,
+            "histograms": histograms,
+        }
+
+
+METRICS = MetricsRegistry()
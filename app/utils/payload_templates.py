@@ -0,0 +1,116 @@
+import json
+import re
+
+from app.utils import jsonlib
+from app.utils.whatsapp_message_templates import INTRO_MESSAGE, YES_NO_BUTTONS
+
+
+class Slot:
+    """Placeholder for a string value filled in when a template is used."""
+
+    def __init__(self, name):
+        self.name = name
+
+
+_SLOT_MARKER = "\x1fslot:{}\x1f"
+_SLOT_PATTERN = re.compile(rb'"\\u001fslot:(\w+)\\u001f"')
+
+
+class PayloadTemplate:
+    """
+    A message payload compiled once into JSON bytes with named string slots.
+
+    Filling a template escapes each slot value and concatenates it with the
+    pre-serialized fragments, so static content (list sections, buttons...) is
+    never re-serialized.
+    """
+
+    def __init__(self, payload):
+        serialized = json.dumps(
+            payload,
+            ensure_ascii=False,
+            separators=(",", ":"),
+            default=lambda slot: _SLOT_MARKER.format(slot.name),
+        ).encode("utf-8")
+        # Alternating literal fragments and slot names
+        self._parts = _SLOT_PATTERN.split(serialized)
+        self.slots = frozenset(name.decode() for name in self._parts[1::2])
+
+    def fill(self, **values):
+        parts = self._parts
+        out = [parts[0]]
+        for i in range(1, len(parts), 2):
+            # jsonlib.dumps of a str is the quoted, escaped JSON string
+            out.append(jsonlib.dumps(values[parts[i].decode()]))
+            out.append(parts[i + 1])
+        return b"".join(out)
+
+
+class PayloadTemplateRegistry:
+    def __init__(self):
+        self._templates = {}
+
+    def register(self, name, payload):
+        template = self._templates[name] = PayloadTemplate(payload)
+        return template
+
+    def __getitem__(self, name):
+        return self._templates[name]
+
+
+def _message(recipient, message_type, **content):
+    return {
+        "messaging_product": "whatsapp",
+        "recipient_type": "individual",
+        "to": recipient,
+        "type": message_type,
+        **content,
+    }
+
+
+TEMPLATES = PayloadTemplateRegistry()
+
+TEMPLATES.register(
+    "text",
+    _message(Slot("to"), "text", text={"preview_url": False, "body": Slot("body")}),
+)
+TEMPLATES.register("image_link", _message(Slot("to"), "image", image={"link": Slot("link")}))
+TEMPLATES.register("image_id", _message(Slot("to"), "image", image={"id": Slot("id")}))
+# Marks the inbound message as read and shows "typing..." until we reply
+TEMPLATES.register(
+    "typing_indicator",
+    {
+        "messaging_product": "whatsapp",
+        "status": "read",
+        "message_id": Slot("message_id"),
+        "typing_indicator": {"type": "text"},
+    },
+)
+TEMPLATES.register(
+    "intro_list",
+    _message(
+        Slot("to"),
+        "interactive",
+        interactive={
+            "type": "list",
+            "header": {"type": "text", "text": INTRO_MESSAGE["header_text"]},
+            "body": {"text": INTRO_MESSAGE["body_text"]},
+            "action": {
+                "button": "Select an option",
+                "sections": INTRO_MESSAGE["sections"],
+            },
+        },
+    ),
+)
+TEMPLATES.register(
+    "yes_no_buttons",
+    _message(
+        Slot("to"),
+        "interactive",
+        interactive={
+            "type": "button",
+            "body": {"text": Slot("body")},
+            "action": {"buttons": YES_NO_BUTTONS},
+        },
+    ),
+)
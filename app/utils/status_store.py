@@ -0,0 +1,151 @@
+import logging
+import sqlite3
+import threading
+import time
+
+from app.utils.metrics import METRICS
+
+# Order of the timestamp columns kept per (message id, recipient)
+STATUS_COLUMNS = ("sent", "delivered", "read", "failed")
+
+# Merging keeps the earliest non-null timestamp of either side
+_UPSERT_SQL = (
+    "INSERT INTO message_statuses VALUES (?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT(message_id, recipient_id) DO UPDATE SET "
+    + ", ".join(
+        f"{name}_at = MIN(COALESCE({name}_at, excluded.{name}_at), "
+        f"COALESCE(excluded.{name}_at, {name}_at))"
+        for name in STATUS_COLUMNS
+    )
+)
+
+
+class StatusStore:
+    """
+    Aggregates sent/delivered/read status callbacks and persists them in batches.
+
+    Every outbound message triggers three or four status webhooks. Rather than
+    doing per-request work for each one, the timestamps are merged in memory per
+    (message id, recipient) and flushed to SQLite once `flush_size` rows are
+    pending or `flush_interval` seconds have passed.
+    """
+
+    def __init__(self, path, flush_size=500, flush_interval=5.0, latency_max_age=60.0):
+        self.path = path
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.latency_max_age = latency_max_age
+        # (monotonic time computed, latency_percentiles() result)
+        self._latency = (None, None)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS message_statuses ("
+                "message_id TEXT NOT NULL, recipient_id TEXT NOT NULL, "
+                "sent_at INTEGER, delivered_at INTEGER, read_at INTEGER, "
+                "failed_at INTEGER, PRIMARY KEY (message_id, recipient_id))"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS message_statuses_sent_at "
+                "ON message_statuses (sent_at)"
+            )
+        conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def record(self, status):
+        """
+        Merge one status object from a webhook payload into the pending batch.
+
+        A status without a timestamp is recorded at the current time.
+        """
+        try:
+            column = STATUS_COLUMNS.index(status["status"])
+            key = (status["id"], status.get("recipient_id", ""))
+            timestamp = status.get("timestamp")
+            timestamp = int(time.time() if timestamp is None else timestamp)
+        except (KeyError, ValueError, TypeError):
+            METRICS.incr("status.ignored")
+            return
+
+        with self._lock:
+            row = self._pending.get(key)
+            if row is None:
+                row = self._pending[key] = [None, None, None, None]
+            # Keep the earliest timestamp if a callback is redelivered
+            if row[column] is None or timestamp < row[column]:
+                row[column] = timestamp
+            should_flush = (
+                len(self._pending) >= self.flush_size
+                or time.monotonic() - self._last_flush >= self.flush_interval
+            )
+        METRICS.incr(f"status.{status['status']}")
+
+        if should_flush:
+            self.flush()
+
+    def flush(self):
+        """Write all pending rows to SQLite in a single transaction."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                self._last_flush = time.monotonic()
+            if not pending:
+                return
+            rows = [(*key, *row) for key, row in pending.items()]
+            try:
+                conn = self._connect()
+                with conn:
+                    conn.executemany(_UPSERT_SQL, rows)
+                conn.close()
+            except sqlite3.Error:
+                logging.exception("Failed to flush status callbacks")
+                return
+            METRICS.incr("status.flushed_rows", len(rows))
+
+    def latency_percentiles(self, percentiles=(0.5, 0.95, 0.99), limit=10000):
+        """
+        Delivery and read latency percentiles (seconds after "sent") over the
+        most recent `limit` messages.
+        """
+        self.flush()
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT delivered_at - sent_at, read_at - sent_at "
+                "FROM message_statuses WHERE sent_at IS NOT NULL "
+                "ORDER BY sent_at DESC LIMIT ?",
+                (limit,),
+            ).fetchall()
+        finally:
+            conn.close()
+
+        result = {}
+        for i, name in enumerate(("delivered", "read")):
+            latencies = sorted(row[i] for row in rows if row[i] is not None)
+            result[name] = {
+                f"p{int(q * 100)}": (
+                    latencies[int(q * (len(latencies) - 1))] if latencies else None
+                )
+                for q in percentiles
+            }
+        return result
+
+    def cached_latency_percentiles(self):
+        """
+        latency_percentiles(), recomputed at most every `latency_max_age`
+        seconds, so polling the metrics endpoint doesn't hit SQLite each time.
+        """
+        computed_at, result = self._latency
+        now = time.monotonic()
+        if computed_at is None or now - computed_at >= self.latency_max_age:
+            result = self.latency_percentiles()
+            self._latency = (now, result)
+        return result
@@ -0,0 +1,46 @@
+import re
+import unicodedata
+
+_WHITESPACE = re.compile(r"\s+")
+_PUNCTUATION = re.compile(r"[^\w\s$.,]")
+_WORD = re.compile(r"[a-z]+")
+
+# Words too generic to identify a catalog item
+STOPWORDS = frozenset(
+    ["de", "del", "la", "las", "el", "los", "para", "con", "en", "y", "a", "un",
+     "una", "que", "por", "tu", "tus", "mi", "mis", "se", "lo", "al"]
+)
+
+
+def fold_accents(text):
+    """Lowercase and strip accents: "Tamaño Médico" -> "tamano medico"."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def normalize_text(text):
+    """
+    Accent-fold, strip punctuation and collapse whitespace, so that
+    "¿Cuánto cuestan las recetas?" and "cuanto cuestan las  recetas" match.
+    """
+    text = _PUNCTUATION.sub(" ", fold_accents(text))
+    return _WHITESPACE.sub(" ", text).strip(" .,")
+
+
+def stem_word(word):
+    """Crude Spanish plural folding: recetas -> receta, opciones -> opcion."""
+    if len(word) > 4 and word.endswith("es") and word[-3] in "nrdl":
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s"):
+        return word[:-1]
+    return word
+
+
+def word_set(normalized):
+    """Plural-folded words of text already passed through normalize_text."""
+    return {stem_word(w) for w in _WORD.findall(normalized)}
+
+
+def key_words(text):
+    """Plural-folded words of `text` that can identify a catalog item."""
+    return word_set(normalize_text(text)) - STOPWORDS
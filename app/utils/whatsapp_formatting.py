@@ -0,0 +1,149 @@
+import bisect
+import re
+
+# WhatsApp rejects text message bodies longer than this
+WHATSAPP_MAX_BODY_LENGTH = 4096
+
+# One alternation over every Markdown construct we translate, applied in a
+# single left-to-right pass. Code spans and *single-asterisk* spans (already
+# WhatsApp bold) are matched so they are left untouched, which also makes the
+# conversion idempotent.
+_MARKDOWN_PATTERN = re.compile(
+    # Every construct starts with one of these, so other characters are
+    # skipped without trying each alternative
+    r"(?=[【`#*_~\[\n \t+-])"
+    r"(?:(?P<citation>【[^】]*】)"
+    r"|(?P<code_block>```.*?```)"
+    r"|`[^`\n]+`"
+    r"|^(?P<heading>#{1,6})[ \t]+(?P<heading_text>[^\n]+?)[ \t#]*$"
+    r"|^(?P<bullet_indent>[ \t]*)[-*+][ \t]+"
+    r"|(?P<bold_marker>\*\*|__)(?P<bold_text>[^\n]+?)(?P=bold_marker)"
+    r"|(?<![*\w])\*[^*\s](?:[^*\n]*?[^*\s])?\*(?![*\w])"
+    r"|~~(?P<strike_text>[^\n]+?)~~"
+    r"|\[(?P<link_text>[^\]\n]+)\]\((?P<link_url>[^)\s]+)\)"
+    r"|(?P<blank_lines>\n[ \t]*\n(?:[ \t]*\n)+))",
+    re.MULTILINE | re.DOTALL,
+)
+
+# Places a long message may be split, best first: paragraph breaks, the
+# whitespace after a sentence, then any whitespace
+_SPLIT_POINTS = (
+    re.compile(r"\n[ \t]*\n\s*"),
+    re.compile(r"(?<=[.!?…])\s+"),
+    re.compile(r"\s+"),
+)
+# WhatsApp markup spans, which must not be split across two messages
+_MARKUP_SPAN = re.compile(
+    r"(?=[`*_~])(?:```.*?```|`[^`\n]+`|(?<![*\w])\*[^*\n]+\*(?![*\w])"
+    r"|(?<!\w)_[^_\n]+_(?!\w)|(?<!\w)~[^~\n]+~(?!\w))",
+    re.DOTALL,
+)
+# A paragraph break, or whitespace after sentence punctuation followed by more text
+_STREAM_BREAK = re.compile(r"\n[ \t]*\n\s*|(?<=[.!?…])\s+(?=\S)")
+
+
+def _replace(match):
+    kind = match.lastgroup
+    if kind == "citation":
+        return ""
+    if kind == "heading_text":
+        # WhatsApp can't nest bold, so inline markers inside headings are dropped
+        heading = _MARKDOWN_PATTERN.sub(_replace, match["heading_text"])
+        return f"*{heading.replace('*', '').strip()}*"
+    if kind == "bullet_indent":
+        return f"{match['bullet_indent']}• "
+    if kind == "bold_text":
+        return f"*{match['bold_text']}*"
+    if kind == "strike_text":
+        return f"~{match['strike_text']}~"
+    if kind == "link_url":
+        text, url = match["link_text"], match["link_url"]
+        return url if text == url else f"{text} ({url})"
+    if kind == "blank_lines":
+        return "\n\n"
+    # code spans and blocks, and *bold* spans, are kept verbatim
+    return match.group(0)
+
+
+def format_for_whatsapp(text):
+    """
+    Convert LLM Markdown into WhatsApp formatting in a single pass.
+
+    Headings and **bold** become *bold*, ~~strike~~ becomes ~strike~, list
+    bullets become •, links become "text (url)" and 【citation】 markers are
+    dropped. Text that is already WhatsApp formatted (*bold*, _italic_) is
+    kept, so formatting a formatted message changes nothing. Unicode (accents,
+    ñ, emoji) is preserved.
+    """
+    return _MARKDOWN_PATTERN.sub(_replace, text).strip()
+
+
+def _inside_markup(position, spans, span_starts):
+    i = bisect.bisect_left(span_starts, position) - 1
+    return i >= 0 and spans[i][1] > position
+
+
+def _split_point(text, start, limit, split_points, spans, span_starts):
+    # (end of this chunk, start of the next) for the best split point that
+    # leaves at most `limit` characters, preferring points outside markup.
+    # split_points caches, per pattern, the (starts, ends) of its matches in
+    # text; a pattern is only scanned once a chunk needs it.
+    end = start + limit
+    for outside_markup in (True, False):
+        for n, pattern in enumerate(_SPLIT_POINTS):
+            if split_points[n] is None:
+                matches = [match.span() for match in pattern.finditer(text)]
+                split_points[n] = ([m[0] for m in matches], [m[1] for m in matches])
+            starts, ends = split_points[n]
+            i = bisect.bisect_right(starts, end) - 1
+            while i >= 0 and starts[i] > start:
+                position = starts[i]
+                if not (outside_markup and _inside_markup(position, spans, span_starts)):
+                    return position, ends[i]
+                i -= 1
+    return end, end
+
+
+def split_for_whatsapp(text, limit=WHATSAPP_MAX_BODY_LENGTH):
+    """
+    Split a message into ordered chunks of at most `limit` characters.
+
+    Chunks end at the last paragraph break that fits, falling back to
+    sentence and then word boundaries. *bold*, _italic_, ~strike~ and code
+    spans are only split when a single span is longer than `limit`.
+    """
+    if len(text) <= limit:
+        return [text] if text else []
+
+    spans = [match.span() for match in _MARKUP_SPAN.finditer(text)]
+    span_starts = [span_start for span_start, _ in spans]
+    split_points = [None] * len(_SPLIT_POINTS)
+    chunks = []
+    start = 0
+    while len(text) - start > limit:
+        end, next_start = _split_point(text, start, limit, split_points, spans, span_starts)
+        chunks.append(text[start:end].strip())
+        start = next_start
+    chunks.append(text[start:].strip())
+    return [chunk for chunk in chunks if chunk]
+
+
+def pop_complete_text(buffer, min_length=60):
+    """
+    Split a streaming buffer into text that is ready to send and the remainder.
+
+    Text is released at the last paragraph break, or at the last sentence
+    boundary once at least `min_length` characters are buffered, so the
+    customer gets whole sentences instead of token fragments. Nothing is
+    released from inside an unterminated code block.
+
+    :return: A tuple (ready, rest); ready is "" if nothing can be sent yet.
+    """
+    cut = 0
+    for match in _STREAM_BREAK.finditer(buffer):
+        if "\n" in match.group(0) or match.start() >= min_length:
+            if buffer.count("```", 0, match.start()) % 2 == 0:
+                cut = match.end()
+    if not cut:
+        return "", buffer
+    return buffer[:cut].strip(), buffer[cut:]
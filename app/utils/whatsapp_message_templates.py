@@ -24,6 +24,11 @@ INTRO_MESSAGE = {
     ],
 }
 
+YES_NO_BUTTONS = [
+    {"type": "reply", "reply": {"title": "Si", "id": "0"}},
+    {"type": "reply", "reply": {"title": "No", "id": "1"}},
+]
+
 # button_message_payload = {
 #     "messaging_product": "whatsapp",
 #     "recipient_type": "individual",
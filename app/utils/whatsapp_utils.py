@@ -1,17 +1,39 @@
+import atexit
 import logging
-from flask import current_app, jsonify
-import json
-import requests
-
-from app.services.agents import OpenAIChatbot
+import time
+from flask import current_app
+from langchain_openai import ChatOpenAI
+
+from app.schemas.webhook import ErrorEvent, MessageEvent, StatusEvent
+from app.services.agents import (
+    ModelRouter,
+    ModelTier,
+    OpenAIChatbot,
+    load_routing_policy,
+)
+from app.services.catalog_store import CatalogStore
+from app.services.context import ContextWindow, TokenCounter
+from app.services.graph_api import GraphAPIClient
+from app.services.hedging import HedgedChatModel
+from app.services.intent_router import IntentRouter
+from app.services.media import MediaManager
+from app.services.outbound import OutboundDispatcher
+from app.services.response_cache import ResponseCache
+from app.services.sessions import SessionManager
+from app.services.tool_executor import ToolExecutor
 from app.services.openai_service import generate_response_agent
 from app.services.hubspot_service import (
     create_hubspot_contact,
     create_hubspot_note_on_contact,
 )
+from app.utils import jsonlib
+from app.utils.dedup import MessageDeduplicator, SQLiteMessageDeduplicator
+from app.utils.metrics import METRICS
+from app.utils.payload_templates import TEMPLATES
+from app.utils.status_store import StatusStore
+from app.utils.whatsapp_formatting import format_for_whatsapp, split_for_whatsapp
 from app.utils.whatsapp_message_templates import INTRO_MESSAGE
-
-import re
+from app.tools import ItemRetriever, build_tools, count_tool_tokens, register_tools
 
 IMGS = {
     "Caja para Chilaquiles": "https://i.imgur.com/JbYKONs.png",
@@ -30,39 +52,323 @@ PRODUCT_URLS = {
 
 MOST_RECENT_PRODUCT_REQUEST = {"0": None}
 
-BOT = OpenAIChatbot(openai_model="gpt-3.5-turbo-0125")
+
+def get_catalog_store():
+    """
+    Return the app's catalogs loaded from CATALOG_DIR, creating the store and
+    its reload watcher on first use.
+    """
+    store = current_app.extensions.get("catalog_store")
+    if store is None:
+        config = current_app.config
+        store = current_app.extensions.setdefault(
+            "catalog_store",
+            CatalogStore(config["CATALOG_DIR"], config["CATALOG_SNAPSHOT_DIR"] or None),
+        )
+        if store is current_app.extensions["catalog_store"]:
+            if config["CATALOG_RELOAD_INTERVAL"] > 0:
+                store.start_watcher(config["CATALOG_RELOAD_INTERVAL"])
+    return store
 
 
-def log_http_response(response):
-    logging.info(f"Status: {response.status_code}")
-    logging.info(f"Content-type: {response.headers.get('content-type')}")
-    logging.info(f"Body: {response.text}")
+def get_catalog():
+    """Return the current version of the bot's catalog (CATALOG_NAME)."""
+    return get_catalog_store().get(current_app.config["CATALOG_NAME"])
 
 
-def get_text_message_data(recipient, text):
-    text = process_text_for_whatsapp(text)
-    return json.dumps(
-        {
-            "messaging_product": "whatsapp",
-            "recipient_type": "individual",
-            "to": recipient,
-            "type": "text",
-            "text": {"preview_url": False, "body": text},
-        },
-        ensure_ascii=False,
+def get_response_cache():
+    """
+    Return the app's shared reply cache, or None if it's disabled.
+    """
+    config = current_app.config
+    if not config["RESPONSE_CACHE"]:
+        return None
+    cache = current_app.extensions.get("response_cache")
+    if cache is None:
+        store = get_catalog_store()
+        catalog_name = config["CATALOG_NAME"]
+        cache = current_app.extensions.setdefault(
+            "response_cache",
+            ResponseCache(
+                store.version(catalog_name),
+                path=config["RESPONSE_CACHE_PATH"] or None,
+                threshold=config["RESPONSE_CACHE_THRESHOLD"],
+                ttl_seconds=config["RESPONSE_CACHE_TTL"],
+            ),
+        )
+        if cache is current_app.extensions["response_cache"]:
+
+            def on_catalog_reload(name, catalog, version):
+                # Replies quoting the previous catalog are dropped
+                if name == catalog_name:
+                    cache.set_catalog_version(version)
+
+            store.subscribe(on_catalog_reload)
+    return cache
+
+
+def get_intent_router():
+    """
+    Return the app's catalog intent router, or None if it's disabled.
+    """
+    if not current_app.config["INTENT_ROUTER"]:
+        return None
+    catalog = get_catalog()
+    router = current_app.extensions.get("intent_router")
+    if router is None or router.catalog is not catalog:
+        # Built on first use and again after the catalog is reloaded
+        router = current_app.extensions["intent_router"] = IntentRouter(catalog)
+    return router
+
+
+def get_item_retriever():
+    """
+    Return the app's top-k product retriever, kept in sync with catalog reloads.
+    """
+    retriever = current_app.extensions.get("item_retriever")
+    if retriever is None:
+        config = current_app.config
+        store = get_catalog_store()
+        retriever = current_app.extensions.setdefault(
+            "item_retriever",
+            ItemRetriever(get_catalog(), k=config["TOOLS_TOP_K"]),
+        )
+        if retriever is current_app.extensions["item_retriever"]:
+            catalog_name = config["CATALOG_NAME"]
+
+            def on_catalog_reload(name, catalog, version):
+                if name == catalog_name:
+                    retriever.set_catalog(catalog)
+
+            store.subscribe(on_catalog_reload)
+    return retriever
+
+
+def get_tool_executor():
+    """
+    Return the app's tool executor, creating it on first use.
+    """
+    executor = current_app.extensions.get("tool_executor")
+    if executor is None:
+        config = current_app.config
+        executor = ToolExecutor(
+            max_workers=config["TOOL_WORKERS"], cache_ttl=config["TOOL_CACHE_TTL"]
+        )
+        register_tools(executor)
+        executor = current_app.extensions.setdefault("tool_executor", executor)
+    return executor
+
+
+def create_chat_model(config, model=None, name="llm"):
+    """
+    A chat model shared by every session: `model` (OPENAI_MODEL by default)
+    with a request timeout, hedged to LLM_HEDGE_MODEL (or a second request to
+    the same model) when LLM_HEDGE is enabled.
+    """
+    model = model or config["OPENAI_MODEL"]
+    # stream_usage reports token counts for streamed replies too
+    primary = ChatOpenAI(
+        model=model, timeout=config["LLM_DEADLINE_SECONDS"], stream_usage=True
+    )
+    if not config["LLM_HEDGE"]:
+        return primary
+    secondary = ChatOpenAI(
+        model=config["LLM_HEDGE_MODEL"] or model,
+        base_url=config["LLM_HEDGE_BASE_URL"] or None,
+        timeout=config["LLM_DEADLINE_SECONDS"],
+        stream_usage=True,
+    )
+    return HedgedChatModel(
+        primary,
+        secondary,
+        deadline=config["LLM_DEADLINE_SECONDS"],
+        hedge_after=config["LLM_HEDGE_AFTER_SECONDS"],
+        idle_timeout=config["LLM_STREAM_IDLE_SECONDS"],
+        name=name,
     )
 
 
-def get_img_message_data(recipient, link):
-    return json.dumps(
-        {
-            "messaging_product": "whatsapp",
-            "recipient_type": "individual",
-            "to": recipient,
-            "type": "image",
-            "image": {"link": link},
-        }
+def create_model_router(config):
+    """
+    The fast and large model tiers, and the MODEL_ROUTING_POLICY that picks
+    one of them for each message.
+    """
+    tiers = [
+        ModelTier(
+            "fast",
+            create_chat_model(config, config["MODEL_FAST"], name="llm.fast"),
+            *config["MODEL_FAST_COST"],
+        ),
+        ModelTier(
+            "large",
+            create_chat_model(config, config["MODEL_LARGE"], name="llm.large"),
+            *config["MODEL_LARGE_COST"],
+        ),
+    ]
+    policy = load_routing_policy(
+        config["MODEL_ROUTING_POLICY"], threshold=config["MODEL_ROUTING_THRESHOLD"]
     )
+    return ModelRouter(tiers, policy, default="fast")
+
+
+def get_session_manager():
+    """
+    Return the app's per-customer chatbot sessions, creating them on first use.
+    """
+    sessions = current_app.extensions.get("session_manager")
+    if sessions is None:
+        config = current_app.config
+        model_router = create_model_router(config)
+        # Conversation summaries use the fast tier
+        chat_model = model_router.tiers["fast"].chat_model
+        token_counter = TokenCounter(config["OPENAI_MODEL"])
+        response_cache = get_response_cache()
+        tools = item_retriever = tool_executor = None
+        if config["LLM_TOOLS"]:
+            tools = build_tools(get_catalog())
+            item_retriever = get_item_retriever()
+            tool_executor = get_tool_executor()
+            METRICS.register_gauge(
+                "tools.schema_tokens", lambda: count_tool_tokens(tools, token_counter)
+            )
+
+        def create_chatbot(chat_history):
+            return OpenAIChatbot(
+                openai_model=config["OPENAI_MODEL"],
+                chat_history=chat_history,
+                chat_model=chat_model,
+                context_window=ContextWindow(
+                    token_counter,
+                    budget=config["CONTEXT_TOKEN_BUDGET"],
+                    summarizer=chat_model,
+                ),
+                response_cache=response_cache,
+                tools=tools,
+                item_retriever=item_retriever,
+                tool_executor=tool_executor,
+                model_router=model_router,
+            )
+
+        sessions = current_app.extensions.setdefault(
+            "session_manager",
+            SessionManager(
+                create_chatbot,
+                config["SESSION_STORE_PATH"],
+                max_sessions=config["SESSION_MAX_RESIDENT"],
+            ),
+        )
+        if sessions is current_app.extensions["session_manager"]:
+            atexit.register(sessions.flush)
+    return sessions
+
+
+def get_message_deduplicator():
+    """
+    Return the app's seen-set of message ids, creating it on first use.
+    """
+    deduplicator = current_app.extensions.get("message_deduplicator")
+    if deduplicator is None:
+        config = current_app.config
+        if config["DEDUP_BACKEND"] == "sqlite":
+            deduplicator = SQLiteMessageDeduplicator(
+                config["DEDUP_SQLITE_PATH"],
+                max_size=config["DEDUP_MAX_SIZE"],
+                ttl_seconds=config["DEDUP_TTL_SECONDS"],
+            )
+        else:
+            deduplicator = MessageDeduplicator(
+                max_size=config["DEDUP_MAX_SIZE"],
+                ttl_seconds=config["DEDUP_TTL_SECONDS"],
+            )
+        deduplicator = current_app.extensions.setdefault(
+            "message_deduplicator", deduplicator
+        )
+    return deduplicator
+
+
+def is_duplicate_message(event):
+    """
+    Check whether a message event was already received, e.g. a redelivery by Meta.
+    """
+    if event.message_id is None:
+        return False
+    return get_message_deduplicator().seen(event.message_id)
+
+
+def forget_message(event):
+    """
+    Un-mark a message event as received, so a redelivery gets processed.
+
+    Called when the message was rejected or failed to process after
+    is_duplicate_message recorded it.
+    """
+    if event.message_id is not None:
+        get_message_deduplicator().forget(event.message_id)
+
+
+def get_status_store():
+    """
+    Return the app's status callback aggregator, creating it on first use.
+    """
+    store = current_app.extensions.get("status_store")
+    if store is None:
+        config = current_app.config
+        store = current_app.extensions.setdefault(
+            "status_store",
+            StatusStore(
+                config["STATUS_STORE_PATH"],
+                flush_size=config["STATUS_FLUSH_SIZE"],
+                flush_interval=config["STATUS_FLUSH_INTERVAL"],
+            ),
+        )
+        if store is current_app.extensions["status_store"]:
+            atexit.register(store.flush)
+            METRICS.register_gauge(
+                "status.latency_seconds", store.cached_latency_percentiles
+            )
+    return store
+
+
+def record_status_updates(body):
+    """
+    Fast path for payloads that only carry status callbacks.
+
+    Skips event construction and per-status logging and hands the raw status
+    objects straight to the aggregation store.
+    """
+    store = get_status_store()
+    for entry in body.get("entry") or ():
+        for change in entry.get("changes") or ():
+            for status in (change.get("value") or {}).get("statuses") or ():
+                store.record(status)
+
+
+def get_text_message_data(recipient, text):
+    text = process_text_for_whatsapp(text)
+    return TEMPLATES["text"].fill(to=recipient, body=text)
+
+
+def get_media_manager():
+    """
+    Return the app's media id cache, creating it on first use.
+    """
+    manager = current_app.extensions.get("media_manager")
+    if manager is None:
+        manager = current_app.extensions.setdefault(
+            "media_manager",
+            MediaManager(get_graph_client(), current_app.config["MEDIA_CACHE_PATH"]),
+        )
+    return manager
+
+
+def get_text_messages_data(recipient, text):
+    """
+    Build one text payload per chunk for replies longer than WhatsApp's body limit.
+    """
+    return [
+        TEMPLATES["text"].fill(to=recipient, body=chunk)
+        for chunk in split_for_whatsapp(process_text_for_whatsapp(text))
+    ]
 
 
 def get_list_message_data(
@@ -77,7 +383,7 @@ def get_list_message_data(
     :param footer_text: The footer text of the list message.
     :param sections: A list of sections, where each section is a dictionary with keys 'title' and 'rows'.
                      Each 'rows' is a list of dictionaries with keys 'id' and 'title'.
-    :return: A JSON string payload to be sent to the WhatsApp API.
+    :return: A JSON payload (bytes) to be sent to the WhatsApp API.
     """
     list_message_payload = {
         "messaging_product": "whatsapp",
@@ -93,7 +399,7 @@ def get_list_message_data(
     }
     if footer_text is not None:
         list_message_payload["interactive"]["footer"] = footer_text
-    return json.dumps(list_message_payload)
+    return jsonlib.dumps(list_message_payload)
 
 
 def get_button_message_data(recipient, body_text, buttons):
@@ -104,7 +410,7 @@ def get_button_message_data(recipient, body_text, buttons):
     :param body_text: The body text of the button message.
     :param buttons: A list of buttons, where each button is a dictionary with keys 'type' and 'reply'.
                     The 'reply' is a dictionary with keys 'id' and 'title'.
-    :return: A JSON string payload to be sent to the WhatsApp API.
+    :return: A JSON payload (bytes) to be sent to the WhatsApp API.
     """
     button_message_payload = {
         "messaging_product": "whatsapp",
@@ -117,109 +423,130 @@ def get_button_message_data(recipient, body_text, buttons):
             "action": {"buttons": buttons},
         },
     }
-    return json.dumps(button_message_payload)
+    return jsonlib.dumps(button_message_payload)
 
 
-def generate_response(response):
-    messages_out = []
-    if len(BOT.chat_history.messages) == 1:
-        intro_text = "Hola!"
-        intro_text_data = get_text_message_data(
-            current_app.config["RECIPIENT_WAID"], intro_text
+def get_graph_client():
+    """
+    Return the app's shared Graph API client, creating it on first use.
+    """
+    client = current_app.extensions.get("graph_client")
+    if client is None:
+        client = current_app.extensions.setdefault(
+            "graph_client", GraphAPIClient.from_config(current_app.config)
         )
-        messages_out.append(intro_text_data)
+    return client
 
-        intro_button_message_data = get_list_message_data(
-            current_app.config["RECIPIENT_WAID"],
-            INTRO_MESSAGE["header_text"],
-            INTRO_MESSAGE["body_text"],
-            INTRO_MESSAGE["sections"],
-        )
-        messages_out.append(intro_button_message_data)
-        # add messages to agent history
-        BOT.chat_history.add_ai_message(intro_text)
-        BOT.chat_history.add_ai_message(INTRO_MESSAGE["body_text"])
-    else:
-        response_text = BOT.respond_to_user(response)
-        response_text_data = get_text_message_data(
-            current_app.config["RECIPIENT_WAID"], response_text
+
+def get_outbound_dispatcher():
+    """
+    Return the app's outbound send queue, creating it on first use.
+    """
+    dispatcher = current_app.extensions.get("outbound_dispatcher")
+    if dispatcher is None:
+        dispatcher = current_app.extensions.setdefault(
+            "outbound_dispatcher",
+            OutboundDispatcher.from_config(get_graph_client(), current_app.config),
         )
-        messages_out.append(response_text_data)
+    return dispatcher
 
-    return messages_out
 
+def send_message(data, recipient=None, on_rejected=None):
+    """
+    Queue a message payload for delivery.
 
-def send_message(data):
-    headers = {
-        "Content-type": "application/json",
-        "Authorization": f"Bearer {current_app.config['ACCESS_TOKEN']}",
-    }
+    Delivery happens on the outbound dispatcher, which rate-limits, retries on
+    429/5xx and dead-letters messages that can't be delivered.
 
-    url = f"https://graph.facebook.com/{current_app.config['VERSION']}/{current_app.config['PHONE_NUMBER_ID']}/messages"
-    print(f"Bearer {current_app.config['ACCESS_TOKEN']}")
-    print("DATA: ", data)
-    try:
-        response = requests.post(
-            url, data=data, headers=headers, timeout=10
-        )  # 10 seconds timeout as an example
-        response.raise_for_status()  # Raises an HTTPError if the HTTP request returned an unsuccessful status code
-    except requests.Timeout:
-        logging.error("Timeout occurred while sending message")
-        return jsonify({"status": "error", "message": "Request timed out"}), 408
-    except (
-        requests.RequestException
-    ) as e:  # This will catch any general request exception
-        logging.error(f"Request failed due to: {e}")
-        return jsonify({"status": "error", "message": "Failed to send message"}), 500
-    else:
-        # Process the response as normal
-        log_http_response(response)
-        return response
+    :param on_rejected: See OutboundDispatcher.submit.
+    """
+    logging.debug(f"DATA: {data}")
+    get_outbound_dispatcher().submit(data, recipient, on_rejected)
 
 
-def process_text_for_whatsapp(text):
-    # Remove brackets
-    pattern = r"\【.*?\】"
-    # Substitute the pattern with an empty string
-    text = re.sub(pattern, "", text).strip()
+def send_image(recipient, link):
+    """
+    Queue an image message sent by media id, uploading the image again if
+    WhatsApp rejects the cached id. Falls back to the public link if the
+    image can't be uploaded.
 
-    # Pattern to find double asterisks including the word(s) in between
-    pattern = r"\*\*(.*?)\*\*"
+    This is the only way images should be sent; no reply flow sends product
+    images at the moment (see the disabled product flow in
+    process_whatsapp_message).
+    """
+    manager = get_media_manager()
+    media_id = manager.get_media_id(link)
+    if media_id is None:
+        send_message(TEMPLATES["image_link"].fill(to=recipient, link=link), recipient)
+        return
+
+    def on_rejected():
+        new_id = manager.replace_rejected(link, media_id)
+        if new_id is None:
+            return TEMPLATES["image_link"].fill(to=recipient, link=link)
+        return TEMPLATES["image_id"].fill(to=recipient, id=new_id)
+
+    send_message(
+        TEMPLATES["image_id"].fill(to=recipient, id=media_id), recipient, on_rejected
+    )
 
-    # Replacement pattern with single asterisks
-    replacement = r"*\1*"
 
-    # Substitute occurrences of the pattern with the replacement
-    whatsapp_style_text = re.sub(pattern, replacement, text)
-    # Strip non-ASCII characters from the text
-    whatsapp_style_text = re.sub(r"[^\x00-\x7F]+", "", whatsapp_style_text)
+def process_text_for_whatsapp(text):
+    # Single-pass Markdown to WhatsApp conversion that keeps accents and ñ
+    return format_for_whatsapp(text)
 
-    return whatsapp_style_text
 
+def iter_webhook_events(body):
+    """
+    Yield every message, status and error event contained in a webhook payload.
 
-def process_whatsapp_message(body):
-    logging.info(f"BODY: {body}")
-    wa_id = body["entry"][0]["changes"][0]["value"]["contacts"][0]["wa_id"]
-    customer_name = body["entry"][0]["changes"][0]["value"]["contacts"][0]["profile"][
-        "name"
-    ]
+    Meta batches several entries, changes and messages into one POST under load,
+    so the whole payload is walked once instead of only looking at index [0].
+    """
+    for entry in body.get("entry") or ():
+        for change in entry.get("changes") or ():
+            value = change.get("value") or {}
+            phone_number_id = (value.get("metadata") or {}).get("phone_number_id")
+            contacts = value.get("contacts") or ()
+            names = {
+                contact.get("wa_id"): (contact.get("profile") or {}).get("name")
+                for contact in contacts
+            }
+            for message in value.get("messages") or ():
+                wa_id = message.get("from")
+                if wa_id is None and contacts:
+                    wa_id = contacts[0].get("wa_id")
+                yield MessageEvent(phone_number_id, wa_id, names.get(wa_id), message)
+            for status in value.get("statuses") or ():
+                yield StatusEvent(phone_number_id, status)
+            for error in value.get("errors") or ():
+                yield ErrorEvent(phone_number_id, error)
+
+
+def plan_reply(event, bot):
+    """
+    Work out the reply to an inbound message without doing any network I/O.
+
+    The sync (Flask) and async (aiohttp) servers share this and only differ in
+    how they call the chatbot and send the resulting payloads.
 
-    message = body["entry"][0]["changes"][0]["value"]["messages"][0]
+    :param event: A MessageEvent yielded by iter_webhook_events.
+    :param bot: The customer's OpenAIChatbot session.
+    :return: A tuple (messages_out, llm_input). messages_out are payloads that
+             can be sent right away, llm_input is the text the chatbot should
+             respond to, or None if no LLM turn is needed.
+    """
+    wa_id = event.wa_id
+    message = event.message
     if message["type"] == "interactive":
         if message["interactive"]["type"] == "list_reply":
             reply = message["interactive"]["list_reply"]
-            if reply["id"] == "order_status":
-                pass
-            elif reply["id"] == "quote":
+            if reply["id"] == "quote":
                 text = "Genial! Para que producto quieres la cotizacion?"
-                response_text_data = get_text_message_data(
-                    current_app.config["RECIPIENT_WAID"], text
-                )
-                send_message(response_text_data)
-                BOT.chat_history.add_ai_message(text)
-                return
-            elif reply["id"] == "other":
-                pass  # route to agent
+                bot.chat_history.add_ai_message(text)
+                return [get_text_message_data(wa_id, text)], None
+            # order_status and other are routed to the agent
+            message_body = reply["title"]
         else:
             # hardcoded assumption that this is a yes/no reply to request for order
             button_reply = message["interactive"]["button_reply"]
@@ -229,19 +556,99 @@ def process_whatsapp_message(body):
             else:
                 message = "Entendido! Te puedo ayudar con otra cosa?"
             response = process_text_for_whatsapp(message)
-            print("RECIPIENT: ", current_app.config["RECIPIENT_WAID"])
-            text_data = get_text_message_data(
-                current_app.config["RECIPIENT_WAID"], response
-            )
-            send_message(text_data)
-            return
-    else:
+            return [get_text_message_data(wa_id, response)], None
+    elif message["type"] == "text":
         message_body = message["text"]["body"]
+    else:
+        logging.info(f"Ignoring unsupported message type: {message['type']}")
+        return [], None
+
+    if len(bot.chat_history.messages) == 1:
+        intro_text = "Hola!"
+        messages_out = [
+            get_text_message_data(wa_id, intro_text),
+            TEMPLATES["intro_list"].fill(to=wa_id),
+        ]
+        # add messages to agent history
+        bot.chat_history.add_ai_message(intro_text)
+        bot.chat_history.add_ai_message(INTRO_MESSAGE["body_text"])
+        return messages_out, None
+
+    # Simple catalog questions are answered from templates, skipping the LLM
+    router = get_intent_router()
+    routed_text = router.route(message_body) if router is not None else None
+    if routed_text is not None:
+        bot.chat_history.add_user_message(message_body)
+        bot.chat_history.add_ai_message(routed_text)
+        return get_text_messages_data(wa_id, routed_text), None
+
+    return [], message_body
+
+
+def stream_reply(event, bot, llm_input, started_at):
+    """
+    Stream the chatbot's reply, sending each sentence or paragraph as its own
+    text message as soon as it's ready.
+
+    A read receipt with typing indicator is sent first so the customer sees
+    activity right away.
+    """
+    if event.message_id is not None:
+        send_message(
+            TEMPLATES["typing_indicator"].fill(message_id=event.message_id),
+            event.wa_id,
+        )
+
+    first_message = True
+
+    def on_text(text):
+        nonlocal first_message
+        if first_message:
+            METRICS.observe(
+                "llm.time_to_first_message_seconds", time.monotonic() - started_at
+            )
+            first_message = False
+        for msg in get_text_messages_data(event.wa_id, text):
+            send_message(msg, event.wa_id)
+
+    bot.stream_respond_to_user(llm_input, on_text)
+
+
+def process_whatsapp_message(event):
+    """
+    Reply to a single inbound WhatsApp message.
+
+    :param event: A MessageEvent yielded by iter_webhook_events.
+    """
+    logging.info(f"Processing message {event.message_id} from {event.wa_id}")
+    wa_id = event.wa_id
+    customer_name = event.customer_name
+
+    started_at = time.monotonic()
 
     # TODO: implement custom function here
-    response_messages = generate_response(message_body)
-    for msg in response_messages:
-        send_message(msg)
+    try:
+        with get_session_manager().session(wa_id) as bot:
+            response_messages, llm_input = plan_reply(event, bot)
+            if llm_input is not None and current_app.config["LLM_STREAMING"]:
+                for msg in response_messages:
+                    send_message(msg, wa_id)
+                response_messages = []
+                stream_reply(event, bot, llm_input, started_at)
+            elif llm_input is not None:
+                response_text = bot.respond_to_user(llm_input)
+                METRICS.observe(
+                    "llm.time_to_first_message_seconds", time.monotonic() - started_at
+                )
+                response_messages.extend(get_text_messages_data(wa_id, response_text))
+            # Sent before the session is released, so the replies to two
+            # back-to-back messages from one customer can't overtake each other
+            for msg in response_messages:
+                send_message(msg, wa_id)
+    except Exception:
+        # Don't let the failed message's redelivery be skipped as a duplicate
+        forget_message(event)
+        raise
     # response_clean = process_text_for_whatsapp(response)
     # print(f"response clean: {response_clean}")
     # response_text_data = get_text_message_data(
@@ -268,20 +675,11 @@ def process_whatsapp_message(body):
     #     )
     #     send_message(text_data)
     #     # Send image of product
-    #     image_data = get_img_message_data(
-    #         current_app.config["RECIPIENT_WAID"], IMGS[product]
-    #     )
-    #     send_message(image_data)
+    #     send_image(current_app.config["RECIPIENT_WAID"], IMGS[product])
     #     # Send options for initiating order flow or not
-    #     buttons = [
-    #         {"type": "reply", "reply": {"title": "Si", "id": "0"}},
-    #         {"type": "reply", "reply": {"title": "No", "id": "1"}},
-    #     ]
-
-    #     button_data = get_button_message_data(
-    #         current_app.config["RECIPIENT_WAID"],
-    #         "Te gustaría hacer un pedido?",
-    #         buttons,
+    #     button_data = TEMPLATES["yes_no_buttons"].fill(
+    #         to=current_app.config["RECIPIENT_WAID"],
+    #         body="Te gustaría hacer un pedido?",
     #     )
     #     send_message(button_data)
     #     # Create Contact in Hubspot CRM
@@ -300,15 +698,66 @@ def process_whatsapp_message(body):
     #     send_message(data)
 
 
+def handle_webhook_payload(raw_body, dispatch):
+    """
+    Parse a verified webhook body and dispatch every event it contains.
+
+    Shared by the Flask view and the aiohttp server; must run inside an app context.
+
+    :param raw_body: The raw request body as bytes.
+    :param dispatch: Callable taking a MessageEvent; returns False if it could
+                     not be accepted right now (e.g. the work queue is full).
+    :return: A tuple of a JSON-serializable response body and an HTTP status code.
+    """
+    try:
+        body = jsonlib.loads(raw_body)
+    except (jsonlib.JSONDecodeError, UnicodeDecodeError):
+        # The stdlib parser raises UnicodeDecodeError on invalid UTF-8
+        logging.error("Failed to decode JSON")
+        return {"status": "error", "message": "Invalid JSON provided"}, 400
+    # logging.info(f"request body: {body}")
+
+    if not isinstance(body, dict) or not body.get("object"):
+        # if the request is not a WhatsApp API event, return an error
+        return {"status": "error", "message": "Not a WhatsApp API event"}, 404
+
+    # Status callbacks are ~75% of the traffic: aggregate them and return
+    if b'"messages"' not in raw_body and b'"errors"' not in raw_body:
+        if b'"statuses"' in raw_body:
+            record_status_updates(body)
+            return {"status": "ok"}, 200
+
+    # A single POST can batch several messages, statuses and errors, each of
+    # which is dispatched on its own.
+    recognized = False
+    for event in iter_webhook_events(body):
+        recognized = True
+        if isinstance(event, StatusEvent):
+            get_status_store().record(event.status)
+        elif isinstance(event, ErrorEvent):
+            logging.error(f"Received a WhatsApp error: {event.error}")
+        elif is_duplicate_message(event):
+            logging.info(f"Skipping redelivered message {event.message_id}")
+        else:
+            try:
+                accepted = dispatch(event)
+            except Exception:
+                forget_message(event)
+                raise
+            if not accepted:
+                # Let Meta redeliver once the backlog has drained
+                forget_message(event)
+                return {"status": "error", "message": "Busy"}, 503
+
+    if not recognized:
+        return {"status": "error", "message": "Not a WhatsApp API event"}, 404
+    return {"status": "ok"}, 200
+
+
 def is_valid_whatsapp_message(body):
     """
     Check if the incoming webhook event has a valid WhatsApp message structure.
     """
-    return (
-        body.get("object")
-        and body.get("entry")
-        and body["entry"][0].get("changes")
-        and body["entry"][0]["changes"][0].get("value")
-        and body["entry"][0]["changes"][0]["value"].get("messages")
-        and body["entry"][0]["changes"][0]["value"]["messages"][0]
+    return bool(body.get("object")) and any(
+        isinstance(event, MessageEvent) for event in iter_webhook_events(body)
     )
@@ -0,0 +1,94 @@
+import logging
+import queue
+import threading
+import time
+
+from app.utils.metrics import METRICS
+
+
+class WebhookWorkerPool:
+    """
+    Background worker pool that drains webhook work off the request thread.
+
+    The webhook view only validates the request and enqueues the parsed event,
+    so Meta gets its 200 right away. A fixed number of worker threads (the
+    concurrency limit) pull jobs from a bounded queue and run them inside an
+    application context so the existing `current_app` based helpers keep working.
+    """
+
+    def __init__(self, app, workers=4, max_queue_size=1000):
+        self.app = app
+        self.workers = workers
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._threads = []
+        METRICS.register_gauge("webhook_queue.depth", self._queue.qsize)
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._worker, name=f"webhook-worker-{i}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, fn, *args):
+        """
+        Enqueue `fn(*args)` for background processing.
+
+        :return: False if the queue is full and the job was rejected.
+        """
+        try:
+            self._queue.put_nowait((time.monotonic(), fn, args))
+        except queue.Full:
+            METRICS.incr("webhook_queue.rejected")
+            logging.warning("Webhook queue is full, rejecting job")
+            return False
+        METRICS.incr("webhook_queue.enqueued")
+        return True
+
+    def join(self):
+        """Block until every queued job has been processed."""
+        self._queue.join()
+
+    def shutdown(self):
+        for _ in self._threads:
+            self._queue.put((None, None, None))
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _worker(self):
+        while True:
+            enqueued_at, fn, args = self._queue.get()
+            if fn is None:
+                self._queue.task_done()
+                return
+            started_at = time.monotonic()
+            METRICS.observe("webhook_queue.wait_seconds", started_at - enqueued_at)
+            try:
+                with self.app.app_context():
+                    fn(*args)
+            except Exception:
+                METRICS.incr("webhook_queue.failed")
+                logging.exception("Background webhook job failed")
+            finally:
+                METRICS.observe(
+                    "webhook_queue.process_seconds", time.monotonic() - started_at
+                )
+                self._queue.task_done()
+
+
+def init_worker_pool(app):
+    """
+    Create and start the webhook worker pool if background processing is enabled.
+    """
+    if not app.config["WEBHOOK_ASYNC"]:
+        return None
+    pool = WebhookWorkerPool(
+        app,
+        workers=app.config["WEBHOOK_WORKERS"],
+        max_queue_size=app.config["WEBHOOK_QUEUE_SIZE"],
+    )
+    pool.start()
+    app.extensions["webhook_worker_pool"] = pool
+    return pool
@@ -1,12 +1,12 @@
 import logging
-import json
 
 from flask import Blueprint, request, jsonify, current_app
 
-from .decorators.security import signature_required
+from .decorators.security import signature_required, token_required
+from .utils.metrics import METRICS
 from .utils.whatsapp_utils import (
+    handle_webhook_payload,
     process_whatsapp_message,
-    is_valid_whatsapp_message,
 )
 
 webhook_blueprint = Blueprint("webhook", __name__)
@@ -17,41 +17,31 @@ def handle_message():
     Handle incoming webhook events from the WhatsApp API.
 
     This function processes incoming WhatsApp messages and other events,
-    such as delivery statuses. If the event is a valid message, it gets
-    processed. If the incoming payload is not a recognized WhatsApp event,
+    such as delivery statuses. Every message in the payload is processed
+    independently. If the incoming payload is not a recognized WhatsApp event,
     an error is returned.
 
     Every message send will trigger 4 HTTP requests to your webhook: message, sent, delivered, read.
 
+    When WEBHOOK_ASYNC is enabled the message is queued on the background
+    worker pool and the webhook is acknowledged without waiting for the reply.
+
     Returns:
         response: A tuple containing a JSON response and an HTTP status code.
     """
-    body = request.get_json()
-    # logging.info(f"request body: {body}")
-
-    # Check if it's a WhatsApp status update
-    if (
-        body.get("entry", [{}])[0]
-        .get("changes", [{}])[0]
-        .get("value", {})
-        .get("statuses")
-    ):
-        logging.info("Received a WhatsApp status update.")
-        return jsonify({"status": "ok"}), 200
-
-    try:
-        if is_valid_whatsapp_message(body):
-            process_whatsapp_message(body)
-            return jsonify({"status": "ok"}), 200
-        else:
-            # if the request is not a WhatsApp API event, return an error
-            return (
-                jsonify({"status": "error", "message": "Not a WhatsApp API event"}),
-                404,
-            )
-    except json.JSONDecodeError:
-        logging.error("Failed to decode JSON")
-        return jsonify({"status": "error", "message": "Invalid JSON provided"}), 400
+    pool = current_app.extensions.get("webhook_worker_pool")
+
+    def dispatch(event):
+        if pool is None:
+            process_whatsapp_message(event)
+            return True
+        return pool.submit(process_whatsapp_message, event)
+
+    # The raw bytes were already read (and cached) by signature_required
+    response, status_code = handle_webhook_payload(
+        request.get_data(cache=True), dispatch
+    )
+    return jsonify(response), status_code
 
 
 # Required webhook verifictaion for WhatsApp
@@ -87,3 +77,9 @@ def webhook_post():
     return handle_message()
 
 
+@webhook_blueprint.route("/metrics", methods=["GET"])
+@token_required
+def metrics():
+    return jsonify(METRICS.snapshot()), 200
+
+
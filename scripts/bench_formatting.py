@@ -0,0 +1,82 @@
+"""
+Throughput of the WhatsApp formatter over a fixed corpus of chatbot replies.
+
+Formats every reply in scripts/reply_corpus.json, plus one reply longer than
+WhatsApp's body limit built from the corpus, and reports replies and MB per
+second for the old three-pass regex chain, format_for_whatsapp, and
+format_for_whatsapp followed by split_for_whatsapp.
+
+    python scripts/bench_formatting.py --repeat 2000
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+# Importing the app package loads the chatbot module, which needs a key
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+
+from app.utils.whatsapp_formatting import (  # noqa: E402
+    WHATSAPP_MAX_BODY_LENGTH,
+    format_for_whatsapp,
+    split_for_whatsapp,
+)
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), "reply_corpus.json")
+
+
+def regex_chain(text):
+    # process_text_for_whatsapp before the single-pass formatter, for reference
+    text = re.sub(r"\【.*?\】", "", text).strip()
+    text = re.sub(r"\*\*(.*?)\*\*", r"*\1*", text)
+    return re.sub(r"[^\x00-\x7F]+", "", text)
+
+
+def format_and_split(text):
+    return split_for_whatsapp(format_for_whatsapp(text))
+
+
+def load_corpus():
+    with open(CORPUS_PATH, encoding="utf-8") as f:
+        replies = json.load(f)
+    long_reply = "\n\n".join(replies)
+    while len(long_reply) <= 2 * WHATSAPP_MAX_BODY_LENGTH:
+        long_reply = f"{long_reply}\n\n{long_reply}"
+    return replies + [long_reply]
+
+
+def bench(fn, corpus, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in corpus:
+            fn(text)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=1000)
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+    n_replies = len(corpus) * args.repeat
+    megabytes = sum(len(text.encode("utf-8")) for text in corpus) * args.repeat / 1e6
+    print(f"{len(corpus)} replies x {args.repeat} ({megabytes:.1f} MB)")
+    for name, fn in (
+        ("regex chain", regex_chain),
+        ("format_for_whatsapp", format_for_whatsapp),
+        ("format + split", format_and_split),
+    ):
+        elapsed = bench(fn, corpus, args.repeat)
+        print(
+            f"{name:>20}: {n_replies / elapsed:10.0f} replies/s "
+            f"{megabytes / elapsed:8.1f} MB/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+Compare webhook throughput of the Flask worker pool and the aiohttp server.
+
+Both servers get the same signed webhooks, one message per customer, and a
+chatbot that takes --llm-latency seconds to answer (time.sleep in the Flask
+workers, asyncio.sleep in aiohttp). Replies go to a Graph API client that
+only counts them, so the numbers measure how many slow LLM turns each server
+mode overlaps, not the network.
+
+    python scripts/bench_server_modes.py --messages 500 --llm-latency 0.2
+"""
+
+import argparse
+import asyncio
+import hashlib
+import hmac
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+
+from langchain.memory import ChatMessageHistory  # noqa: E402
+from langchain_core.messages import AIMessage, SystemMessage  # noqa: E402
+
+from app.utils import jsonlib  # noqa: E402
+
+APP_SECRET = "bench"
+
+
+class _Bot:
+    def __init__(self, latency):
+        self.latency = latency
+        # Past the intro, so every message is an LLM turn
+        self.chat_history = ChatMessageHistory(
+            messages=[SystemMessage(content="system"), AIMessage(content="Hola!")]
+        )
+
+    def respond_to_user(self, text):
+        time.sleep(self.latency)
+        return f"respuesta {text}"
+
+    async def arespond_to_user(self, text):
+        await asyncio.sleep(self.latency)
+        return f"respuesta {text}"
+
+
+class _CountingClient:
+    def __init__(self):
+        self.sent = 0
+        self._lock = threading.Lock()
+
+    def post_message(self, data):
+        with self._lock:
+            self.sent += 1
+        response = requests.Response()
+        response.status_code = 200
+        return response
+
+
+def _webhook(i):
+    wa_id = f"52{i:08d}"
+    body = jsonlib.dumps(
+        {
+            "object": "whatsapp_business_account",
+            "entry": [
+                {
+                    "changes": [
+                        {
+                            "value": {
+                                "metadata": {"phone_number_id": "1"},
+                                "contacts": [{"wa_id": wa_id, "profile": {"name": "A"}}],
+                                "messages": [
+                                    {
+                                        "id": f"bench-{i}",
+                                        "from": wa_id,
+                                        "type": "text",
+                                        "text": {"body": "hola"},
+                                    }
+                                ],
+                            }
+                        }
+                    ]
+                }
+            ],
+        }
+    )
+    signature = hmac.new(APP_SECRET.encode(), body, hashlib.sha256).hexdigest()
+    return body, {"X-Hub-Signature-256": f"sha256={signature}"}
+
+
+def _install(flask_app, latency, directory):
+    from app.services.outbound import DeadLetterStore, OutboundDispatcher
+    from app.services.sessions import SessionManager
+
+    client = _CountingClient()
+    flask_app.extensions["session_manager"] = SessionManager(
+        lambda chat_history: _Bot(latency),
+        os.path.join(directory, "sessions.db"),
+        max_sessions=100000,
+    )
+    flask_app.extensions["outbound_dispatcher"] = OutboundDispatcher(
+        client, DeadLetterStore(os.path.join(directory, "dead.db")), rate=100000
+    )
+    return client
+
+
+def bench_flask(messages, latency, directory):
+    from app import create_app
+
+    app = create_app()
+    client = _install(app, latency, directory)
+    http = app.test_client()
+    start = time.perf_counter()
+    for i in range(messages):
+        body, headers = _webhook(i)
+        assert http.post("/webhook", data=body, headers=headers).status_code == 200
+    app.extensions["webhook_worker_pool"].join()
+    app.extensions["outbound_dispatcher"].join()
+    elapsed = time.perf_counter() - start
+    app.extensions["webhook_worker_pool"].shutdown()
+    return client.sent, elapsed
+
+
+def bench_aiohttp(messages, latency, directory):
+    from aiohttp.test_utils import TestClient, TestServer
+
+    from app.async_server import FLASK_APP, TASKS, create_async_app
+
+    app = create_async_app()
+    client = _install(app[FLASK_APP], latency, directory)
+
+    async def run():
+        async with TestClient(TestServer(app)) as http:
+            start = time.perf_counter()
+            for i in range(messages):
+                body, headers = _webhook(i)
+                response = await http.post("/webhook", data=body, headers=headers)
+                assert response.status == 200
+            await asyncio.gather(*app[TASKS])
+            await asyncio.get_running_loop().run_in_executor(
+                None, app[FLASK_APP].extensions["outbound_dispatcher"].join
+            )
+            return time.perf_counter() - start
+
+    elapsed = asyncio.run(run())
+    return client.sent, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--workers", type=int, default=4, help="Flask WEBHOOK_WORKERS")
+    args = parser.parse_args()
+    # Per-message INFO logs would dominate the timings
+    logging.disable(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ.update(
+            APP_SECRET=APP_SECRET,
+            WEBHOOK_ASYNC="true",
+            WEBHOOK_WORKERS=str(args.workers),
+            WEBHOOK_QUEUE_SIZE=str(args.messages),
+            ASYNC_MAX_INFLIGHT=str(args.messages),
+            INTENT_ROUTER="false",
+            LLM_STREAMING="false",
+            CATALOG_SNAPSHOT_DIR="",
+            CATALOG_RELOAD_INTERVAL="0",
+            DEDUP_BACKEND="memory",
+            STATUS_STORE_PATH=os.path.join(directory, "statuses.db"),
+            MEDIA_CACHE_PATH=os.path.join(directory, "media_db"),
+        )
+        print(
+            f"{args.messages} messages, {args.llm_latency}s per LLM turn, "
+            f"{args.workers} Flask workers"
+        )
+        for name, bench in (("flask", bench_flask), ("aiohttp", bench_aiohttp)):
+            sent, elapsed = bench(args.messages, args.llm_latency, directory)
+            print(
+                f"{name:>8}: {sent} replies in {elapsed:.2f}s "
+                f"({args.messages / elapsed:.1f} messages/s)"
+            )
+
+
+if __name__ == "__main__":
+    main()
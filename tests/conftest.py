@@ -0,0 +1,26 @@
+import os
+
+import pytest
+from flask import Flask
+
+# app.services.agents exports the key at import time
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from app.config import load_configurations  # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path):
+    """A Flask app with the default configuration and its files under tmp_path."""
+    app = Flask("test")
+    load_configurations(app)
+    app.config.update(
+        CATALOG_SNAPSHOT_DIR="",
+        CATALOG_RELOAD_INTERVAL=0,
+        SESSION_STORE_PATH=str(tmp_path / "sessions.db"),
+        DEDUP_SQLITE_PATH=str(tmp_path / "seen.db"),
+        STATUS_STORE_PATH=str(tmp_path / "statuses.db"),
+        MEDIA_CACHE_PATH=str(tmp_path / "media_db"),
+    )
+    with app.app_context():
+        yield app
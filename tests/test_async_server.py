@@ -0,0 +1,169 @@
+import asyncio
+import hashlib
+import hmac
+
+import pytest
+import requests
+from aiohttp.test_utils import TestClient, TestServer
+from langchain.memory import ChatMessageHistory
+from langchain_core.messages import AIMessage, SystemMessage
+
+from app.async_server import (
+    FLASK_APP,
+    TASKS,
+    aprocess_whatsapp_message,
+    create_async_app,
+)
+from app.schemas.webhook import MessageEvent
+from app.services.outbound import DeadLetterStore, OutboundDispatcher
+from app.services.sessions import SessionManager
+from app.utils import jsonlib
+
+
+class _Bot:
+    def __init__(self):
+        # Past the intro, so every text message goes to the chatbot
+        self.chat_history = ChatMessageHistory(
+            messages=[SystemMessage(content="system"), AIMessage(content="Hola!")]
+        )
+
+    async def arespond_to_user(self, text):
+        return f"respuesta {text}"
+
+
+class _GraphClient:
+    """Records posted payloads and answers with the scripted status codes."""
+
+    def __init__(self, statuses=()):
+        self.statuses = list(statuses)
+        self.posted = []
+
+    def post_message(self, data):
+        self.posted.append(data)
+        response = requests.Response()
+        response.status_code = self.statuses.pop(0) if self.statuses else 200
+        response.headers["Retry-After"] = "0"
+        response.raise_for_status()
+        return response
+
+
+def _event(message_id, body):
+    return MessageEvent(
+        "1", "522", "A", {"id": message_id, "type": "text", "text": {"body": body}}
+    )
+
+
+@pytest.fixture
+def async_app(monkeypatch, tmp_path):
+    for name, value in {
+        "SESSION_STORE_PATH": tmp_path / "sessions.db",
+        "DEDUP_SQLITE_PATH": tmp_path / "seen.db",
+        "STATUS_STORE_PATH": tmp_path / "statuses.db",
+        "MEDIA_CACHE_PATH": tmp_path / "media_db",
+        "CATALOG_SNAPSHOT_DIR": "",
+        "CATALOG_RELOAD_INTERVAL": "0",
+        "INTENT_ROUTER": "false",
+        "LLM_STREAMING": "false",
+        "APP_SECRET": "secret",
+        "ASYNC_MAX_INFLIGHT": "1",
+    }.items():
+        monkeypatch.setenv(name, str(value))
+    app = create_async_app()
+    app[FLASK_APP].extensions["session_manager"] = SessionManager(
+        lambda chat_history: _Bot(), str(tmp_path / "sessions.db")
+    )
+    return app
+
+
+def _use_client(app, client, tmp_path):
+    dispatcher = OutboundDispatcher(
+        client, DeadLetterStore(str(tmp_path / "dead_letters.db")), rate=1000, workers=2
+    )
+    app[FLASK_APP].extensions["outbound_dispatcher"] = dispatcher
+    return dispatcher
+
+
+def _process(app, *events):
+    async def run():
+        for event in events:
+            await aprocess_whatsapp_message(app, event)
+
+    asyncio.run(run())
+
+
+def test_replies_are_retried_through_the_dispatcher(async_app, tmp_path):
+    client = _GraphClient([429, 503])
+    dispatcher = _use_client(async_app, client, tmp_path)
+    _process(async_app, _event("m1", "primero"), _event("m2", "segundo"))
+    dispatcher.join()
+
+    # The first reply was retried twice, and the second waited behind it
+    assert [b"primero" in data for data in client.posted] == [True, True, True, False]
+    assert dispatcher.dead_letters.count() == 0
+
+
+def test_undeliverable_replies_are_dead_lettered(async_app, tmp_path):
+    client = _GraphClient([400])
+    dispatcher = _use_client(async_app, client, tmp_path)
+    _process(async_app, _event("m1", "hola"))
+    dispatcher.join()
+
+    assert len(client.posted) == 1
+    assert dispatcher.dead_letters.count() == 1
+
+
+def _webhook(message_id, wa_id):
+    body = jsonlib.dumps(
+        {
+            "object": "whatsapp_business_account",
+            "entry": [
+                {
+                    "changes": [
+                        {
+                            "value": {
+                                "metadata": {"phone_number_id": "1"},
+                                "contacts": [{"wa_id": wa_id, "profile": {"name": "A"}}],
+                                "messages": [
+                                    {
+                                        "id": message_id,
+                                        "from": wa_id,
+                                        "type": "text",
+                                        "text": {"body": "hola"},
+                                    }
+                                ],
+                            }
+                        }
+                    ]
+                }
+            ],
+        }
+    )
+    signature = hmac.new(b"secret", body, hashlib.sha256).hexdigest()
+    return body, {"X-Hub-Signature-256": f"sha256={signature}"}
+
+
+def test_webhook_answers_503_past_the_in_flight_limit(async_app, tmp_path):
+    _use_client(async_app, _GraphClient(), tmp_path)
+
+    async def run():
+        release = asyncio.Event()
+
+        class _SlowBot(_Bot):
+            async def arespond_to_user(self, text):
+                await release.wait()
+                return await super().arespond_to_user(text)
+
+        async_app[FLASK_APP].extensions["session_manager"] = SessionManager(
+            lambda chat_history: _SlowBot(), str(tmp_path / "slow_sessions.db")
+        )
+        async with TestClient(TestServer(async_app)) as client:
+            body, headers = _webhook("m1", "521")
+            assert (await client.post("/webhook", data=body, headers=headers)).status == 200
+            # m1 holds the only slot, so m2 is turned away and can be redelivered
+            body, headers = _webhook("m2", "522")
+            assert (await client.post("/webhook", data=body, headers=headers)).status == 503
+            release.set()
+            await asyncio.gather(*async_app[TASKS])
+            assert (await client.post("/webhook", data=body, headers=headers)).status == 200
+
+    asyncio.run(run())
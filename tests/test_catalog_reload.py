@@ -0,0 +1,77 @@
+import os
+import pickle
+import shutil
+
+import pytest
+
+from app.services.catalog_store import CatalogStore
+from app.utils.whatsapp_utils import get_catalog_store, get_response_cache
+
+QUESTION = "cuanto cuestan 1000 recetas medicas?"
+
+
+@pytest.fixture
+def catalog_dir(app, tmp_path):
+    catalog_dir = tmp_path / "catalogs"
+    catalog_dir.mkdir()
+    shutil.copy("data/catalogs/pixz.json", catalog_dir / "pixz.json")
+    app.config.update(
+        CATALOG_DIR=str(catalog_dir),
+        RESPONSE_CACHE_PATH=str(tmp_path / "response_cache"),
+    )
+    return catalog_dir
+
+
+def _edit_price(path, old, new):
+    path.write_text(path.read_text(encoding="utf-8").replace(old, new), encoding="utf-8")
+    # Make sure the change is seen even within the filesystem's mtime resolution
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def test_reload_invalidates_cached_replies(catalog_dir):
+    cache = get_response_cache()
+    cache.put(QUESTION, "Cuestan $1590")
+    assert cache.get(QUESTION) == "Cuestan $1590"
+
+    _edit_price(catalog_dir / "pixz.json", "1590.0", "1990.0")
+    assert get_catalog_store().reload() == ["pixz"]
+
+    assert cache.catalog_version == get_catalog_store().version("pixz")
+    assert cache.get(QUESTION) is None
+
+
+def test_unchanged_reload_keeps_cached_replies(catalog_dir):
+    cache = get_response_cache()
+    cache.put(QUESTION, "Cuestan $1590")
+    (catalog_dir / "pixz.json").touch()
+    get_catalog_store().reload()
+    assert cache.get(QUESTION) == "Cuestan $1590"
+
+
+def test_catalog_version_is_the_store_version(app, catalog_dir, tmp_path):
+    app.config["CATALOG_SNAPSHOT_DIR"] = str(tmp_path / "snapshots")
+    store = get_catalog_store()
+    assert store.get("pixz").version == store.version("pixz")
+
+    _edit_price(catalog_dir / "pixz.json", "1590.0", "1990.0")
+    store.reload()
+    assert store.get("pixz").version == store.version("pixz")
+
+    # A catalog restored from its snapshot keeps the same version
+    restored = CatalogStore(catalog_dir, snapshot_dir=tmp_path / "snapshots")
+    assert restored.get("pixz").version == store.version("pixz")
+
+
+def test_failed_snapshot_write_does_not_fail_the_reload(catalog_dir, tmp_path, monkeypatch):
+    def dump(*args, **kwargs):
+        raise pickle.PicklingError("cannot pickle")
+
+    monkeypatch.setattr(pickle, "dump", dump)
+    snapshot_dir = tmp_path / "snapshots"
+    store = CatalogStore(catalog_dir, snapshot_dir=snapshot_dir)
+    assert store.get("pixz").version == store.version("pixz")
+
+    _edit_price(catalog_dir / "pixz.json", "1590.0", "1990.0")
+    assert store.reload() == ["pixz"]
+    assert list(snapshot_dir.iterdir()) == []
@@ -0,0 +1,80 @@
+import pytest
+
+from app.utils import jsonlib
+from app.utils.dedup import MessageDeduplicator, SQLiteMessageDeduplicator
+from app.utils.whatsapp_utils import handle_webhook_payload
+
+
+def _payload(message_id, wa_id="522"):
+    return jsonlib.dumps(
+        {
+            "object": "whatsapp_business_account",
+            "entry": [
+                {
+                    "changes": [
+                        {
+                            "value": {
+                                "metadata": {"phone_number_id": "1"},
+                                "contacts": [{"wa_id": wa_id, "profile": {"name": "A"}}],
+                                "messages": [
+                                    {
+                                        "id": message_id,
+                                        "from": wa_id,
+                                        "type": "text",
+                                        "text": {"body": "hola"},
+                                    }
+                                ],
+                            }
+                        }
+                    ]
+                }
+            ],
+        }
+    )
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def deduplicator(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteMessageDeduplicator(str(tmp_path / "seen.db"))
+    return MessageDeduplicator()
+
+
+def test_forget_lets_the_message_be_seen_again(deduplicator):
+    assert not deduplicator.seen("a1")
+    assert deduplicator.seen("a1")
+    deduplicator.forget("a1")
+    assert not deduplicator.seen("a1")
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_redelivery_after_busy_is_processed(app, backend):
+    app.config["DEDUP_BACKEND"] = backend
+    dispatched = []
+    body, status = handle_webhook_payload(_payload("a2"), lambda event: False)
+    assert status == 503
+
+    body, status = handle_webhook_payload(
+        _payload("a2"), lambda event: dispatched.append(event) or True
+    )
+    assert status == 200
+    assert [event.message_id for event in dispatched] == ["a2"]
+
+
+def test_redelivery_after_processing_error_is_processed(app):
+    def fail(event):
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        handle_webhook_payload(_payload("a3"), fail)
+
+    dispatched = []
+    handle_webhook_payload(_payload("a3"), lambda event: dispatched.append(event) or True)
+    assert [event.message_id for event in dispatched] == ["a3"]
+
+
+def test_processed_message_is_skipped_on_redelivery(app):
+    dispatched = []
+    handle_webhook_payload(_payload("a4"), lambda event: dispatched.append(event) or True)
+    handle_webhook_payload(_payload("a4"), lambda event: dispatched.append(event) or True)
+    assert len(dispatched) == 1
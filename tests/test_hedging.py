@@ -0,0 +1,156 @@
+import asyncio
+import itertools
+import re
+import time
+
+import pytest
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
+from langchain_core.outputs import ChatGenerationChunk
+
+from app.services.agents import OpenAIChatbot
+from app.services.hedging import FALLBACK_REPLY, HedgedChatModel, is_fallback
+from app.services.response_cache import ResponseCache
+
+MESSAGES = [HumanMessage(content="hola")]
+
+
+class _SlowChatModel(GenericFakeChatModel):
+    """
+    Fake chat model that waits `delay` before answering and `chunk_delay`
+    between streamed chunks, stalls for a second after `stall_after` chunks and
+    raises after `fail_after` chunks (0 fails at once).
+    """
+
+    delay: float = 0.0
+    chunk_delay: float = 0.0
+    stall_after: int | None = None
+    fail_after: int | None = None
+
+    def _generate(self, *args, **kwargs):
+        time.sleep(self.delay)
+        if self.fail_after == 0:
+            raise RuntimeError("model failed")
+        return super()._generate(*args, **kwargs)
+
+    async def _agenerate(self, *args, **kwargs):
+        await asyncio.sleep(self.delay)
+        if self.fail_after == 0:
+            raise RuntimeError("model failed")
+        return super()._generate(*args, **kwargs)
+
+    def _chunks(self):
+        for i, token in enumerate(re.split(r"(\s)", next(self.messages).content)):
+            if i == self.fail_after:
+                raise RuntimeError("model failed")
+            yield i, ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    def _stream(self, *args, **kwargs):
+        time.sleep(self.delay)
+        for i, chunk in self._chunks():
+            if i:
+                time.sleep(1 if i == self.stall_after else self.chunk_delay)
+            yield chunk
+
+    async def _astream(self, *args, **kwargs):
+        await asyncio.sleep(self.delay)
+        for i, chunk in self._chunks():
+            if i:
+                await asyncio.sleep(1 if i == self.stall_after else self.chunk_delay)
+            yield chunk
+
+
+def _model(text, **kwargs):
+    return _SlowChatModel(messages=itertools.repeat(AIMessage(content=text)), **kwargs)
+
+
+def _hedged(primary, secondary, **kwargs):
+    kwargs = {"deadline": 0.5, "hedge_after": 0.05, "idle_timeout": 0.3, **kwargs}
+    return HedgedChatModel(primary, secondary, **kwargs)
+
+
+def _stream(model):
+    response = None
+    for chunk in model.stream(MESSAGES):
+        response = chunk if response is None else response + chunk
+    return response
+
+
+def _astream(model):
+    async def collect():
+        response = None
+        async for chunk in model.astream(MESSAGES):
+            response = chunk if response is None else response + chunk
+        return response
+
+    return asyncio.run(collect())
+
+
+def _ainvoke(model):
+    return asyncio.run(model.ainvoke(MESSAGES))
+
+
+@pytest.mark.parametrize("call", [lambda m: m.invoke(MESSAGES), _ainvoke, _stream, _astream])
+def test_fast_primary_wins(call):
+    model = _hedged(_model("hola primario"), _model("hola secundario"))
+    response = call(model)
+    assert response.content == "hola primario"
+    assert not is_fallback(response)
+
+
+@pytest.mark.parametrize("call", [lambda m: m.invoke(MESSAGES), _ainvoke, _stream, _astream])
+def test_hedge_goes_to_secondary_when_primary_is_slow(call):
+    model = _hedged(_model("primario", delay=0.4), _model("secundario"))
+    start = time.monotonic()
+    response = call(model)
+    assert response.content == "secundario"
+    assert time.monotonic() - start < 0.3
+
+
+@pytest.mark.parametrize("call", [lambda m: m.invoke(MESSAGES), _ainvoke, _stream, _astream])
+def test_hedge_goes_to_secondary_when_primary_fails(call):
+    model = _hedged(_model("primario", fail_after=0), _model("secundario"))
+    assert call(model).content == "secundario"
+
+
+@pytest.mark.parametrize("call", [lambda m: m.invoke(MESSAGES), _ainvoke, _stream, _astream])
+def test_deadline_sends_the_fallback(call):
+    model = _hedged(_model("primario", delay=1), _model("secundario", delay=1))
+    start = time.monotonic()
+    response = call(model)
+    assert response.content == FALLBACK_REPLY
+    assert is_fallback(response)
+    assert time.monotonic() - start < 0.8
+
+
+@pytest.mark.parametrize("call", [_stream, _astream])
+def test_streaming_reply_is_not_cut_at_the_deadline(call):
+    # 10 chunks 0.1s apart take longer than the deadline, but never stall
+    text = "una respuesta larga que sigue llegando"
+    model = _hedged(_model(text, chunk_delay=0.1), _model("secundario", delay=1))
+    response = call(model)
+    assert response.content == text
+    assert not is_fallback(response)
+
+
+@pytest.mark.parametrize("call", [_stream, _astream])
+@pytest.mark.parametrize("stall", [{"stall_after": 4}, {"fail_after": 4}])
+def test_stalled_stream_is_flagged_as_truncated(call, stall):
+    # The reply stops after its second word and the space that follows it
+    text = "una respuesta que se corta"
+    model = _hedged(_model(text, **stall), _model("secundario", delay=1))
+    response = call(model)
+    assert response.content == "una respuesta "
+    assert is_fallback(response)
+    assert response.response_metadata["truncated"]
+
+
+def test_truncated_reply_is_not_cached(tmp_path):
+    cache = ResponseCache("v1", path=str(tmp_path / "cache"))
+    model = _hedged(_model("una respuesta que se corta", fail_after=4), _model("x"))
+    bot = OpenAIChatbot("test", chat_model=model, response_cache=cache)
+    question = "cuanto cuestan las recetas medicas?"
+    sent = []
+    assert bot.stream_respond_to_user(question, sent.append) == "una respuesta "
+    assert sent == ["una respuesta"]
+    assert cache.get(question) is None
@@ -0,0 +1,42 @@
+import pytest
+
+from app.services.catalog_store import load_catalog_file
+from app.services.intent_router import IntentRouter
+
+
+@pytest.fixture(scope="module")
+def router():
+    return IntentRouter(load_catalog_file("data/catalogs/pixz.json"))
+
+
+def test_quotes_a_fully_specified_item(router):
+    reply = router.route("¿Cuánto cuestan 1000 recetas médicas?")
+    assert "$1,590.00" in reply
+
+
+def test_asks_for_the_options_of_an_item(router):
+    reply = router.route("Hola, ¿qué tamaños de recetas tienen?")
+    assert reply.startswith("Me podrías indicar")
+
+
+def test_lists_the_menu(router):
+    assert router.route("¿Qué productos venden?").startswith("Estos son")
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        # Negated item, asking about something else
+        "no quiero recetas, cuanto cuesta una taza?",
+        # A qualifier the catalog has no option for
+        "tienen recetas a color? cuanto cuestan 1000",
+        # Delivery details the quote doesn't cover
+        "cuanto cuestan 1000 recetas con envío urgente a monterrey?",
+        "cuanto cuestan las recetas, pero en otro tamaño?",
+        "que productos venden para bodas?",
+        # Quantities that aren't in the price list
+        "cuanto cuestan 2500 recetas?",
+    ],
+)
+def test_falls_through_when_unsure(router, text):
+    assert router.route(text) is None
@@ -0,0 +1,136 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app.services.graph_api import GraphAPIClient
+from app.services.media import MediaManager
+from app.services.outbound import OutboundDispatcher
+from app.utils.whatsapp_utils import send_image
+
+
+class _MockGraphAPI(BaseHTTPRequestHandler):
+    """Serves the product image, the media endpoint and the messages endpoint."""
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body, content_type="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.server.image_fetches += 1
+        self._reply(200, b"\x89PNG fake", "image/png")
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.path == "/media":
+            self.server.uploads += 1
+            self._reply(200, json.dumps({"id": f"media-{self.server.uploads}"}).encode())
+        elif any(media_id.encode() in body for media_id in self.server.rejected):
+            self._reply(400, b'{"error": {"message": "Invalid media id"}}')
+        else:
+            self.server.sent.append(json.loads(body))
+            self._reply(200, b"{}")
+
+
+@pytest.fixture
+def graph_api():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _MockGraphAPI)
+    server.uploads = server.image_fetches = 0
+    server.rejected = set()
+    server.sent = []
+    thread = threading.Thread(
+        target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True
+    )
+    thread.start()
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def client(graph_api):
+    client = GraphAPIClient("token", "v18.0", "1")
+    base_url = f"http://127.0.0.1:{graph_api.server_port}"
+    client.media_url = f"{base_url}/media"
+    client.messages_url = f"{base_url}/messages"
+    client.image_link = f"{base_url}/img/mug.png"
+    yield client
+    client.close()
+
+
+def test_cached_media_id_is_reused(client, graph_api, tmp_path):
+    manager = MediaManager(client, str(tmp_path / "media_db"))
+    assert manager.get_media_id(client.image_link) == "media-1"
+    assert manager.get_media_id(client.image_link) == "media-1"
+    assert graph_api.uploads == 1
+    assert graph_api.image_fetches == 1
+
+
+def test_expired_media_id_is_uploaded_again(client, graph_api, tmp_path, monkeypatch):
+    manager = MediaManager(client, str(tmp_path / "media_db"), ttl_seconds=60)
+    now = 1_000_000.0
+    monkeypatch.setattr("app.services.media.time.time", lambda: now)
+    assert manager.get_media_id(client.image_link) == "media-1"
+
+    now += 61
+    assert manager.get_media_id(client.image_link) == "media-2"
+    assert graph_api.uploads == 2
+
+
+def test_rejected_media_id_is_uploaded_again_and_resent(client, graph_api, tmp_path):
+    manager = MediaManager(client, str(tmp_path / "media_db"))
+    media_id = manager.get_media_id(client.image_link)
+    graph_api.rejected.add(media_id)
+    dispatcher = OutboundDispatcher(client, dead_letters=None, workers=0)
+
+    def on_rejected():
+        new_id = manager.replace_rejected(client.image_link, media_id)
+        return json.dumps({"image": {"id": new_id}})
+
+    dispatcher.deliver(json.dumps({"image": {"id": media_id}}), "522", on_rejected)
+
+    assert graph_api.uploads == 2
+    assert graph_api.sent == [{"image": {"id": "media-2"}}]
+    assert manager.get_media_id(client.image_link) == "media-2"
+
+
+def test_media_ids_persist_across_restarts(client, graph_api, tmp_path):
+    cache_path = str(tmp_path / "media_db")
+    assert MediaManager(client, cache_path).get_media_id(client.image_link) == "media-1"
+
+    restarted = MediaManager(client, cache_path)
+    assert restarted.get_media_id(client.image_link) == "media-1"
+    assert graph_api.uploads == 1
+
+
+def test_invalidated_media_id_is_removed_from_disk(client, graph_api, tmp_path):
+    cache_path = str(tmp_path / "media_db")
+    manager = MediaManager(client, cache_path)
+    manager.get_media_id(client.image_link)
+    manager.invalidate(client.image_link)
+
+    assert MediaManager(client, cache_path).get_media_id(client.image_link) == "media-2"
+
+
+def test_send_image_reuploads_a_rejected_id(app, client, graph_api, tmp_path):
+    manager = MediaManager(client, str(tmp_path / "media_db"))
+    dispatcher = OutboundDispatcher(client, dead_letters=None, workers=1)
+    app.extensions.update(
+        graph_client=client, media_manager=manager, outbound_dispatcher=dispatcher
+    )
+    send_image("522", client.image_link)
+    dispatcher.join()
+    graph_api.rejected.add("media-1")
+    send_image("522", client.image_link)
+    dispatcher.join()
+
+    assert [message["image"] for message in graph_api.sent] == [
+        {"id": "media-1"},
+        {"id": "media-2"},
+    ]
@@ -0,0 +1,60 @@
+import threading
+import time
+
+from langchain.memory import ChatMessageHistory
+from langchain_core.messages import AIMessage, SystemMessage
+
+from app.schemas.webhook import MessageEvent
+from app.services.sessions import SessionManager
+from app.utils import whatsapp_utils
+from app.utils.whatsapp_utils import process_whatsapp_message
+
+
+class _Bot:
+    def __init__(self):
+        # Past the intro, so every text message goes to the chatbot
+        self.chat_history = ChatMessageHistory(
+            messages=[SystemMessage(content="system"), AIMessage(content="Hola!")]
+        )
+        self.entered = threading.Event()
+
+    def respond_to_user(self, text):
+        self.entered.set()
+        return f"respuesta {text}"
+
+
+def _event(message_id, body):
+    return MessageEvent(
+        "1", "522", "A", {"id": message_id, "type": "text", "text": {"body": body}}
+    )
+
+
+def test_back_to_back_replies_keep_their_order(app, tmp_path, monkeypatch):
+    app.config["INTENT_ROUTER"] = False
+    bot = _Bot()
+    app.extensions["session_manager"] = SessionManager(
+        lambda chat_history: bot, str(tmp_path / "sessions.db")
+    )
+    sent = []
+
+    def send_message(data, recipient=None):
+        if b"primero" in data:
+            # The first reply is slow to hand off to the outbound queue
+            time.sleep(0.1)
+        sent.append(data)
+
+    monkeypatch.setattr(whatsapp_utils, "send_message", send_message)
+
+    def process(event):
+        with app.app_context():
+            process_whatsapp_message(event)
+
+    first = threading.Thread(target=process, args=(_event("m1", "primero"),))
+    second = threading.Thread(target=process, args=(_event("m2", "segundo"),))
+    first.start()
+    bot.entered.wait()
+    second.start()
+    first.join()
+    second.join()
+
+    assert [b"primero" in data for data in sent] == [True, False]
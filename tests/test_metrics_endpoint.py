@@ -0,0 +1,41 @@
+import time
+
+import pytest
+
+from app.utils.status_store import StatusStore
+from app.views import webhook_blueprint
+
+
+@pytest.fixture
+def client(app):
+    app.config["VERIFY_TOKEN"] = "secret"
+    app.register_blueprint(webhook_blueprint)
+    return app.test_client()
+
+
+def test_metrics_requires_the_verify_token(client):
+    assert client.get("/metrics").status_code == 401
+    wrong = {"Authorization": "Bearer nope"}
+    assert client.get("/metrics", headers=wrong).status_code == 401
+    allowed = {"Authorization": "Bearer secret"}
+    response = client.get("/metrics", headers=allowed)
+    assert response.status_code == 200
+    assert "counters" in response.get_json()
+
+
+def test_metrics_is_closed_without_a_verify_token(app, client):
+    app.config["VERIFY_TOKEN"] = None
+    assert client.get("/metrics", headers={"Authorization": "Bearer "}).status_code == 401
+
+
+def test_latency_gauge_is_cached(tmp_path, monkeypatch):
+    store = StatusStore(str(tmp_path / "statuses.db"), latency_max_age=60)
+    calls = []
+    monkeypatch.setattr(store, "latency_percentiles", lambda: calls.append(1) or {})
+    store.cached_latency_percentiles()
+    store.cached_latency_percentiles()
+    assert len(calls) == 1
+
+    store._latency = (time.monotonic() - 61, {})
+    store.cached_latency_percentiles()
+    assert len(calls) == 2
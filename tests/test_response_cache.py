@@ -0,0 +1,107 @@
+import pytest
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+
+from app.services.agents import OpenAIChatbot
+from app.services.response_cache import ResponseCache
+from app.utils.text import normalize_text
+
+
+class _CountingChatModel(GenericFakeChatModel):
+    calls: int = 0
+
+    def _generate(self, *args, **kwargs):
+        self.calls += 1
+        return super()._generate(*args, **kwargs)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResponseCache("v1", path=str(tmp_path / "cache"))
+
+
+@pytest.fixture
+def chat_model():
+    return _CountingChatModel(
+        messages=iter(AIMessage(content=f"respuesta {i}") for i in range(100))
+    )
+
+
+def _chatbot(chat_model, cache):
+    return OpenAIChatbot("test", chat_model=chat_model, response_cache=cache)
+
+
+def test_first_question_is_shared_between_customers(chat_model, cache):
+    question = "cuanto cuestan las recetas medicas?"
+    first = _chatbot(chat_model, cache).respond_to_user(question)
+    second = _chatbot(chat_model, cache).respond_to_user(question)
+    assert second == first
+    assert chat_model.calls == 1
+
+
+def test_follow_up_is_neither_served_from_nor_written_to_the_cache(chat_model, cache):
+    question = "cuanto cuestan las recetas medicas?"
+    follow_up = "y el envío cuánto sale?"
+    customer = _chatbot(chat_model, cache)
+    customer.respond_to_user(question)
+    customer_reply = customer.respond_to_user(follow_up)
+    assert cache.get(follow_up) is None
+
+    # The same question later in another conversation isn't answered from
+    # the cache either, and its reply isn't stored
+    other = _chatbot(chat_model, cache)
+    other.respond_to_user("hola, que productos tienen?")
+    other_reply = other.respond_to_user(follow_up)
+    other.respond_to_user(question)
+
+    assert other_reply != customer_reply
+    assert chat_model.calls == 5
+
+
+def test_mid_conversation_reply_is_not_cached(chat_model, cache):
+    customer = _chatbot(chat_model, cache)
+    customer.respond_to_user("hola, que productos tienen?")
+    customer.respond_to_user("cuanto cuestan las tarjetas de presentacion?")
+    assert cache.get("cuanto cuestan las tarjetas de presentacion?") is None
+
+
+@pytest.mark.parametrize(
+    "question",
+    [
+        "y el envío cuánto sale?",
+        "cuánto cuesta eso en tamaño carta?",
+        "quiero lo mismo pero en azul",
+        "cual es el estado de mi pedido?",
+        "mi correo es ana@example.com, me cotizas?",
+        "me llamas al 55 1234 5678 por favor",
+        "ok, entonces cuanto seria el total?",
+    ],
+)
+def test_context_dependent_questions_are_not_cacheable(cache, question):
+    assert not cache.is_cacheable(normalize_text(question))
+
+
+@pytest.mark.parametrize(
+    "question",
+    [
+        "cuanto cuestan las recetas medicas?",
+        "me podrias decir que tamaños de tarjetas tienen?",
+        "cuanto cuestan 2000 tarjetas de presentacion?",
+    ],
+)
+def test_standalone_questions_are_cacheable(cache, question):
+    assert cache.is_cacheable(normalize_text(question))
+
+
+def test_replies_with_personal_data_are_not_stored(cache):
+    question = "cual es su numero de contacto?"
+    assert cache.is_cacheable(normalize_text(question))
+    cache.put(question, "Llámanos al 55 1234 5678")
+    assert cache.get(question) is None
+
+
+def test_punctuation_only_message_bypasses_the_cache(chat_model, cache):
+    text = "$$$$$$$$$$$$$$"
+    assert not cache.is_cacheable(normalize_text(text))
+    assert _chatbot(chat_model, cache).respond_to_user(text) == "respuesta 0"
+    assert cache.get(text) is None
@@ -0,0 +1,49 @@
+import sqlite3
+import time
+
+import pytest
+
+from app.utils.status_store import StatusStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return StatusStore(str(tmp_path / "statuses.db"), flush_size=1000)
+
+
+def _rows(store):
+    store.flush()
+    with sqlite3.connect(store.path) as conn:
+        return conn.execute(
+            "SELECT message_id, sent_at, delivered_at FROM message_statuses"
+        ).fetchall()
+
+
+def test_earliest_timestamp_wins(store):
+    store.record({"id": "m1", "status": "sent", "timestamp": "20"})
+    store.record({"id": "m1", "status": "sent", "timestamp": "10"})
+    store.record({"id": "m1", "status": "delivered", "timestamp": "30"})
+    assert _rows(store) == [("m1", 10, 30)]
+
+
+def test_missing_timestamp_defaults_to_now(store):
+    before = int(time.time())
+    store.record({"id": "m1", "status": "sent", "timestamp": None})
+    store.record({"id": "m2", "status": "sent"})
+    rows = _rows(store)
+    assert [row[0] for row in rows] == ["m1", "m2"]
+    assert all(before <= row[1] <= time.time() for row in rows)
+
+
+@pytest.mark.parametrize(
+    "status",
+    [
+        {"id": "m1", "status": "sent", "timestamp": "soon"},
+        {"id": "m1", "status": "sent", "timestamp": {"seconds": 1}},
+        {"id": "m1", "status": "unknown", "timestamp": "1"},
+        {"status": "sent", "timestamp": "1"},
+    ],
+)
+def test_malformed_statuses_are_ignored(store, status):
+    store.record(status)
+    assert _rows(store) == []
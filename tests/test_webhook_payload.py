@@ -0,0 +1,23 @@
+import json
+
+import pytest
+
+from app.utils import jsonlib
+from app.utils.whatsapp_utils import handle_webhook_payload
+
+INVALID_BODIES = [b"not json", b'{"object": "whatsapp_business_account', b'{"object": "\xff"}']
+
+
+@pytest.fixture(params=["default", "stdlib"])
+def parser(request, monkeypatch):
+    if request.param == "stdlib":
+        monkeypatch.setattr(jsonlib, "loads", json.loads)
+        monkeypatch.setattr(jsonlib, "JSONDecodeError", json.JSONDecodeError)
+    return request.param
+
+
+@pytest.mark.parametrize("raw_body", INVALID_BODIES)
+def test_malformed_body_is_a_bad_request(app, parser, raw_body):
+    body, status = handle_webhook_payload(raw_body, lambda event: True)
+    assert status == 400
+    assert body["message"] == "Invalid JSON provided"
@@ -0,0 +1,65 @@
+import pytest
+
+from app.utils.whatsapp_formatting import (
+    format_for_whatsapp,
+    pop_complete_text,
+    split_for_whatsapp,
+)
+
+SAMPLES = [
+    "**Tarjetas** de presentación",
+    "*Tarjetas* de presentación",
+    "_cursiva_ y ~~tachado~~",
+    "# Opciones\n\n- Tamaño *carta*\n* Tinta **azul**\n\n\n\nFin",
+    "Visita [Pixz](https://www.pixz.com.mx/) 【4:0†source】",
+    "Usa `*literal*` y\n```\n**sin cambios**\n```",
+    "Precio: **$1,590.00** por *1000 piezas*",
+]
+
+
+@pytest.mark.parametrize("text", SAMPLES)
+def test_formatting_is_idempotent(text):
+    once = format_for_whatsapp(text)
+    assert format_for_whatsapp(once) == once
+
+
+def test_single_asterisks_are_kept_as_whatsapp_bold():
+    assert format_for_whatsapp("*Recetas* médicas") == "*Recetas* médicas"
+    assert format_for_whatsapp("**Recetas** médicas") == "*Recetas* médicas"
+
+
+def test_markdown_is_converted():
+    assert format_for_whatsapp("# Menú\n- **Tazas**\n~~no~~ [a](http://b)") == (
+        "*Menú*\n• *Tazas*\n~no~ a (http://b)"
+    )
+
+
+def test_streamed_chunks_format_like_the_whole_reply():
+    text = "Claro, las *tarjetas* cuestan **$1,590.00**.\n\nTe ayudo con algo más?"
+    ready, rest = pop_complete_text(text)
+    assert f"{format_for_whatsapp(ready)}\n\n{format_for_whatsapp(rest)}" == (
+        format_for_whatsapp(text)
+    )
+
+
+def test_split_prefers_paragraph_breaks():
+    text = "Primer párrafo. Sigue aquí.\n\nSegundo párrafo."
+    assert split_for_whatsapp(text, limit=40) == [
+        "Primer párrafo. Sigue aquí.",
+        "Segundo párrafo.",
+    ]
+
+
+def test_split_never_cuts_a_bold_span():
+    text = "Hola, " * 5 + "*tarjetas de presentación* y más"
+    chunks = split_for_whatsapp(text, limit=40)
+    assert all(len(chunk) <= 40 for chunk in chunks)
+    assert "*tarjetas de presentación* y más" in chunks
+    assert " ".join(chunks) == text.strip()
+
+
+def test_split_cuts_a_span_longer_than_the_limit():
+    text = "*" + "muy " * 20 + "largo*"
+    chunks = split_for_whatsapp(text, limit=30)
+    assert all(len(chunk) <= 30 for chunk in chunks)
+    assert " ".join(chunks) == text